@@ -0,0 +1,87 @@
+"""
+Executor startup benchmark.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Measures the seconds from starting an executor process to having its S3 and SQS clients ready:
+- cold: a new interpreter imports executor modules, loads service models and resolves credentials
+- prefork: a worker forked from a warm parent (see s3_tools.migration.prefork) creates its own clients
+No request is sent, dummy credentials are used unless AWS credentials are set in environment,
+so getting queue URLs (one request per cold executor, none per forked worker) is not included.
+
+    python benchmarks/startup.py -n 10
+"""
+import os
+import sys
+import time
+import argparse
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+READY = '''
+from s3_tools import settings
+from s3_tools.migration import executor
+from s3_tools.aws_utils.s3 import S3Resource
+from s3_tools.aws_utils.sqs import SqsResource
+S3Resource(settings)
+SqsResource(settings)
+'''
+
+
+def cold_start() -> float:
+    start = time.time()
+    subprocess.check_call([sys.executable, '-c', READY], cwd=ROOT)
+    return time.time() - start
+
+
+def prefork_starts(n: int) -> list:
+    from s3_tools import settings
+    from s3_tools.aws_utils.s3 import S3Resource
+    from s3_tools.aws_utils.sqs import SqsResource
+    from s3_tools.migration.prefork import warm_up
+    # queue urls need requests, local backend skips them
+    settings.set('sqs.backend', 'local')
+    warm_up()
+    seconds = []
+    for _ in range(n):
+        read_fd, write_fd = os.pipe()
+        start = time.time()
+        pid = os.fork()
+        if not pid:
+            os.close(read_fd)
+            S3Resource(settings)
+            SqsResource(settings)
+            os.write(write_fd, b'1')
+            os._exit(0)
+        os.close(write_fd)
+        os.read(read_fd, 1)
+        seconds.append(time.time() - start)
+        os.close(read_fd)
+        os.waitpid(pid, 0)
+    return seconds
+
+
+def median(values: list) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='executor startup benchmark')
+    parser.add_argument('-n', '--runs', help='starts to measure of each kind', default=5, type=int)
+    args = parser.parse_args()
+    sys.path.insert(0, ROOT)
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    if 'AWS_ACCESS_KEY_ID' not in os.environ and 'AWS_PROFILE' not in os.environ:
+        os.environ['AWS_ACCESS_KEY_ID'] = 'benchmark'
+        os.environ['AWS_SECRET_ACCESS_KEY'] = 'benchmark'
+    cold = [cold_start() for _ in range(args.runs)]
+    forked = prefork_starts(args.runs)
+    for name, seconds in [('cold', cold), ('prefork', forked)]:
+        print('{:<8} median {:8.1f} ms  min {:8.1f} ms  max {:8.1f} ms'.format(
+            name, median(seconds) * 1000, min(seconds) * 1000, max(seconds) * 1000))
+    print('speedup  {:.0f}x'.format(median(cold) / median(forked)))
+
+
+if __name__ == '__main__':
+    main()
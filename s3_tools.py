@@ -8,7 +8,11 @@ from s3_tools.logger import init_logger
 def main():
     args = init_args()
     settings = load_config(config_file=args.config_file, env_file=args.env_file, obj=vars(args))
-    init_logger(log_level=settings['migration.log_level'], log_file=settings['migration.log_file'])
+    init_logger(log_level=settings['migration.log_level'], log_file=settings['migration.log_file'],
+                log_format=settings.get('migration.log_format', 'text'),
+                queue_size=settings.get('migration.log_queue_size', 0),
+                sample=settings.get('migration.log_sample', None),
+                rate_limit=settings.get('migration.log_rate_limit', 0))
     args.func(vars(args))
 
 
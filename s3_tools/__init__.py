@@ -34,6 +34,8 @@ def load_env(env_file):
         'QUEUE_NUM': 'sqs.queue_num',
         'DEAD_QUEUE_NAME': 'sqs.dead_queue_name',
         'MAX_RECEIVE_NUM': 'sqs.max_receive_num',
+        'QUEUE_BACKEND': 'sqs.backend',
+        'LOCAL_QUEUE_FILE': 'sqs.local_file',
     }
     casts = {
         'QUEUE_NUM': int,
@@ -49,11 +51,21 @@ def load_dict(obj):
     mappings = {
         'log_level': 'migration.log_level',
         'log_file': 'migration.log_file',
+        'log_format': 'migration.log_format',
         'queue_name_pattern': 'sqs.queue_name_pattern',
         'dead_queue_name': 'sqs.dead_queue_name',
         'max_receive_num': 'sqs.max_receive_num',
         'batch_num': 'migration.batch_num',
         'tmp_dir': 'migration.tmp_dir',
+        'journal_file': 'migration.journal_file',
+        'outcome_dir': 'migration.outcome_dir',
+        'bandwidth_limit': 'migration.bandwidth_limit',
+        'list_workers': 'migration.list_workers',
+        'batch_workers': 'migration.batch_workers',
+        'send_workers': 'migration.send_workers',
+        'adaptive_batch': 'migration.adaptive_batch',
+        'prefork': 'migration.prefork',
+        'restore_archived': 'migration.restore_archived',
     }
     casts = {}
     obj = dict([(k, v) for k, v in obj.items() if v])
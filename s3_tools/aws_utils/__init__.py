@@ -1,6 +1,11 @@
+import threading
 import boto3
 from s3_tools import settings
 
+# sessions by parameters, a session loads service models and resolves credentials once for all its clients
+_sessions = {}
+_sessions_lock = threading.Lock()
+
 
 def get_aws_session(name=None, **kwargs):
     fields = ['profile_name', 'region_name', 'aws_access_key_id', 'aws_secret_access_key', 'aws_session_token']
@@ -9,4 +14,10 @@ def get_aws_session(name=None, **kwargs):
         conf = settings.get('aws.{}'.format(name))
         if conf and isinstance(conf, dict):
             p.update(conf)
-    return boto3.Session(**p)
+    cache_key = tuple(sorted(p.items()))
+    with _sessions_lock:
+        session = _sessions.get(cache_key)
+        if session is None:
+            session = boto3.Session(**p)
+            _sessions[cache_key] = session
+        return session
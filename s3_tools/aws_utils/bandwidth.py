@@ -0,0 +1,207 @@
+"""
+Bandwidth limiter for S3 transfers.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+TokenBucket limits bytes per second of download and upload streams of a process:
+- transfer threads consume tokens for each chunk and sleep until enough tokens are refilled
+- rate 0 means no limit, rate can be changed at any time
+FleetBudget shares a fleet wide budget among executors through a shared directory (such as EFS):
+- every process writes a heartbeat file telling whether it transferred bytes recently
+- budget is read from the budget file in the directory, a number of bytes per second, or the default budget
+- rate of each process is the budget divided by the number of processes transferring, capped by its own limit
+"""
+import os
+import json
+import time
+import atexit
+import socket
+import logging
+import threading
+
+
+class TokenBucket:
+
+    def __init__(self, rate: float=0, burst: float=None, clock=time.time, sleep=time.sleep):
+        """
+
+        :param rate: bytes per second, 0 for no limit
+        :param burst: max tokens, default one second of rate
+        :param clock: time function
+        :param sleep: sleep function
+        """
+        self._rate = rate
+        self._burst = burst
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = 0.0
+        self._last = clock()
+        self._lock = threading.Lock()
+        self.consumed = 0
+
+    def set_rate(self, rate: float):
+        with self._lock:
+            self._refill()
+            self._rate = rate
+
+    @property
+    def rate(self) -> float:
+        return self._rate
+
+    def _refill(self):
+        now = self._clock()
+        if self._rate:
+            self._tokens = min(self._burst or self._rate, self._tokens + (now - self._last) * self._rate)
+        self._last = now
+
+    def consume(self, amount: int):
+        """
+        Take tokens of amount bytes, wait until refilled if not enough. Tokens can go negative,
+        so a chunk larger than burst waits for its own bytes after consumed.
+
+        :param amount: bytes transferred
+        """
+        if amount <= 0:
+            return
+        with self._lock:
+            self.consumed += amount
+            if not self._rate:
+                return
+            self._refill()
+            self._tokens -= amount
+            wait = -self._tokens / self._rate if self._tokens < 0 else 0
+        if wait > 0:
+            self._sleep(wait)
+
+    def callback(self, bytes_transferred=0, **kwargs):
+        """
+        Progress callback of s3transfer ReadFileChunk.
+        """
+        self.consume(bytes_transferred)
+
+
+class FleetBudget(threading.Thread):
+    BUDGET_FILENAME = 'budget'
+
+    def __init__(self, bucket: TokenBucket, directory: str, default_budget: float=0, max_rate: float=0,
+                 interval: int=10):
+        """
+
+        :param bucket: token bucket of this process
+        :param directory: shared directory for heartbeat files and budget file
+        :param default_budget: fleet bytes per second if no budget file
+        :param max_rate: bytes per second limit of this process, 0 for no limit
+        :param interval: seconds between two heartbeats
+        """
+        super().__init__(daemon=True)
+        self._bucket = bucket
+        self._directory = directory
+        self._default_budget = default_budget
+        self._max_rate = max_rate
+        self._interval = interval
+        self._name = '{}-{}.json'.format(socket.gethostname(), os.getpid())
+        self._consumed = bucket.consumed
+        self._stopping = threading.Event()
+        os.makedirs(directory, exist_ok=True)
+
+    def run(self):
+        while not self._stopping.is_set():
+            try:
+                self.update()
+            except Exception as e:
+                logging.warning('update fleet bandwidth budget failed: {}'.format(e))
+            self._stopping.wait(self._interval)
+
+    def update(self):
+        """
+        Write heartbeat and set rate of this process by the budget and processes transferring.
+        """
+        consumed = self._bucket.consumed
+        active = consumed > self._consumed
+        self._consumed = consumed
+        self.write_heartbeat(active)
+        budget = self.read_budget()
+        # count this process as transferring, so it gets a share when it starts
+        others = self.count_active()
+        rate = budget / (others + 1) if budget else 0
+        if self._max_rate and (not rate or rate > self._max_rate):
+            rate = self._max_rate
+        if rate != self._bucket.rate:
+            logging.info('bandwidth of this process set to {:.0f} bytes/s, fleet budget {:.0f} bytes/s shared by {}'
+                         .format(rate, budget, others + 1))
+            self._bucket.set_rate(rate)
+
+    def write_heartbeat(self, active: bool):
+        path = os.path.join(self._directory, self._name)
+        with open(path + '.tmp', 'w') as fp:
+            json.dump({'updated_at': time.time(), 'active': active}, fp)
+        os.replace(path + '.tmp', path)
+
+    def read_budget(self) -> float:
+        path = os.path.join(self._directory, self.BUDGET_FILENAME)
+        try:
+            with open(path) as fp:
+                return float(fp.read().strip())
+        except (IOError, ValueError):
+            return self._default_budget
+
+    def count_active(self) -> int:
+        """
+        Number of other processes transferring, heartbeat files not updated for 3 intervals are removed.
+        """
+        count = 0
+        now = time.time()
+        for name in os.listdir(self._directory):
+            if not name.endswith('.json') or name == self._name:
+                continue
+            path = os.path.join(self._directory, name)
+            try:
+                with open(path) as fp:
+                    heartbeat = json.load(fp)
+            except (IOError, ValueError):
+                continue
+            if now - heartbeat.get('updated_at', 0) > self._interval * 3:
+                try:
+                    os.unlink(path)
+                except OSError:
+                    pass
+            elif heartbeat.get('active'):
+                count += 1
+        return count
+
+    def stop(self):
+        self._stopping.set()
+        try:
+            os.unlink(os.path.join(self._directory, self._name))
+        except OSError:
+            pass
+
+
+_limiter = None
+_limiter_lock = threading.Lock()
+
+
+def get_bandwidth_limiter(settings):
+    """
+    Token bucket shared by all transfers of this process, fleet budget is started if configured.
+
+    :param settings: settings with migration.bandwidth_limit, migration.fleet_bandwidth_dir
+                     and migration.fleet_bandwidth
+    :return: TokenBucket, None if bandwidth is not limited
+    :rtype: TokenBucket
+    """
+    global _limiter
+    rate = settings.get('migration.bandwidth_limit', 0)
+    fleet_dir = settings.get('migration.fleet_bandwidth_dir', None)
+    if not rate and not fleet_dir:
+        return None
+    with _limiter_lock:
+        if _limiter is None:
+            _limiter = TokenBucket(rate)
+            if fleet_dir:
+                budget = FleetBudget(_limiter, fleet_dir, default_budget=settings.get('migration.fleet_bandwidth', 0),
+                                     max_rate=rate, interval=settings.get('migration.fleet_bandwidth_interval', 10))
+                budget.update()
+                budget.start()
+                atexit.register(budget.stop)
+        return _limiter
@@ -6,8 +6,19 @@ Wrapper for boto3 S3 client.
 """
 import os
 import json
+import hashlib
+import logging
+import binascii
+import threading
+from itertools import accumulate
+from concurrent.futures import ThreadPoolExecutor
 from hsettings import Settings
+from s3transfer.utils import ReadFileChunk, signal_transferring, signal_not_transferring
 from s3_tools.aws_utils import get_aws_session
+from s3_tools.aws_utils.bandwidth import get_bandwidth_limiter
+
+# errors of source changed since it was read
+PRECONDITION_ERRORS = ('PreconditionFailed', '412')
 
 
 class S3Resource:
@@ -16,6 +27,10 @@ class S3Resource:
         self._settings = settings
         self._profile = profile or 'copy'
         self._client = get_aws_session(self._profile).client('s3')
+        self._source_client = None
+        self._source_client_lock = threading.Lock()
+        self._limiter = None
+        self._limiter_checked = False
 
     def copy_object(self, source_bucket, target_bucket, source_key, target_key, **kwargs):
         param = {
@@ -45,21 +60,257 @@ class S3Resource:
         if 'aws.copy_source' in self.settings:
             conf = self.settings.get('aws.copy_source')
             if conf and isinstance(conf, dict):
-                source_cli = get_aws_session('copy_source').client('s3')
-                param['SourceClient'] = source_cli
+                param['SourceClient'] = self.source_client
         if param:
             param.update(kwargs)
         self.client.copy(**param)
 
-    def download_object(self, bucket, key, filename=None):
+    def get_part_sizes(self, bucket, key):
+        """
+        Part sizes of an object uploaded by multipart upload.
+
+        Parts are assumed the same size except the last one if the part number matches,
+        otherwise head every part to get its size.
+
+        :param bucket:
+        :param key:
+        :return: part sizes, empty if object is not uploaded by multipart upload
+        :rtype: list
+        """
+        res = self.head_object(bucket=bucket, key=key, PartNumber=1)
+        if 'PartsCount' not in res:
+            return []
+        count = res['PartsCount']
+        first = res['ContentLength']
+        total = int(res['ContentRange'].split('/')[-1])
+        if (count - 1) * first < total <= count * first:
+            return [first] * (count - 1) + [total - first * (count - 1)]
+        logging.info('object %s/%s has parts in different sizes', bucket, key)
+        return [first] + [self.head_object(bucket=bucket, key=key, PartNumber=i)['ContentLength']
+                          for i in range(2, count + 1)]
+
+    def multipart_copy(self, source_bucket, target_bucket, source_key, target_key, part_sizes, callback=None,
+                       source_etag: str=None, resume: bool=False, **kwargs):
+        """
+        Copy object by multipart upload with specific part sizes, so the ETag is the same as source.
+
+        :param part_sizes: size of each part
+        :param callback: called with bytes copied after each part
+        :param source_etag: ETag of source, parts are copied only if source is not changed
+        :param resume: resume the in-progress upload of target key left by a killed executor
+        :param kwargs: extra arguments for create_multipart_upload, such as Metadata and Tagging
+        """
+        copy_source = {
+            'Bucket': source_bucket,
+            'Key': source_key
+        }
+
+        def copy_part(upload_id, part_number, start, size):
+            p = {}
+            if source_etag:
+                p['CopySourceIfMatch'] = source_etag
+            res = self.client.upload_part_copy(
+                Bucket=target_bucket,
+                Key=target_key,
+                UploadId=upload_id,
+                PartNumber=part_number,
+                CopySource=copy_source,
+                CopySourceRange='bytes={}-{}'.format(start, start + size - 1),
+                **p
+            )
+            if callback:
+                callback(size)
+            return {'ETag': res['CopyPartResult']['ETag'], 'PartNumber': part_number}
+
+        self._run_parts(target_bucket, target_key, part_sizes, copy_part, source_etag, resume, **kwargs)
+
+    def multipart_upload(self, bucket, key, filename, part_sizes, callback=None, source_etag: str=None,
+                         resume: bool=False, **kwargs):
+        """
+        Upload file by multipart upload with specific part sizes, so the ETag is the same as source.
+
+        :param filename: local file to upload
+        :param part_sizes: size of each part
+        :param callback: called with bytes uploaded after each part
+        :param source_etag: ETag of source, parts uploaded by an earlier attempt are kept only if they match it
+        :param resume: resume the in-progress upload of key left by a killed executor
+        :param kwargs: extra arguments for create_multipart_upload, such as Metadata and Tagging
+        """
+        def upload_part(upload_id, part_number, start, size):
+            # read part from file while sending instead of loading it into memory
+            with self.open_file_chunk(filename, start, size) as body:
+                res = self.client.upload_part(
+                    Bucket=bucket,
+                    Key=key,
+                    UploadId=upload_id,
+                    PartNumber=part_number,
+                    Body=body
+                )
+            if callback:
+                callback(size)
+            return {'ETag': res['ETag'], 'PartNumber': part_number}
+
+        self._run_parts(bucket, key, part_sizes, upload_part, source_etag, resume, **kwargs)
+
+    def create_multipart_upload(self, bucket, key, **kwargs):
+        param = {
+            'Bucket': bucket,
+            'Key': key,
+            'ACL': 'bucket-owner-full-control'
+        }
+        if kwargs:
+            param.update(kwargs)
+        return self.client.create_multipart_upload(**param)['UploadId']
+
+    def _run_parts(self, bucket, key, part_sizes, func, source_etag=None, resume=False, **kwargs):
+        """
+        Run func(upload_id, part_number, start, size) for parts not uploaded yet and complete the upload.
+
+        If resume, the latest in-progress upload of key is continued and parts of the same size are not sent again.
+        Resumed parts may come from an older version of source, so the ETag of all parts is checked against
+        source_etag before completing, and the upload is started over if it does not match.
+        The upload is kept on failure to be resumed by next attempt, unless resume is disabled or source changed.
+        """
+        upload_id, done = None, {}
+        if resume:
+            upload_id = self.find_multipart_upload(bucket, key)
+        if upload_id:
+            done = dict((n, {'ETag': p['ETag'], 'PartNumber': n}) for n, p in self.list_parts(bucket, key, upload_id)
+                        .items() if n <= len(part_sizes) and p['Size'] == part_sizes[n - 1])
+            logging.info('resume upload %s of %s/%s, %s of %s parts done', upload_id, bucket, key, len(done),
+                         len(part_sizes))
+        else:
+            upload_id = self.create_multipart_upload(bucket=bucket, key=key, **kwargs)
+        starts = [0] + list(accumulate(part_sizes))[:-1]
+        todo = [n for n in range(1, len(part_sizes) + 1) if n not in done]
+        try:
+            with ThreadPoolExecutor(max_workers=self.settings.get('migration.copy_concurrency', 10)) as pool:
+                sent = list(pool.map(func, [upload_id] * len(todo), todo, [starts[n - 1] for n in todo],
+                                     [part_sizes[n - 1] for n in todo]))
+            parts = sorted(list(done.values()) + sent, key=lambda part: part['PartNumber'])
+            if done and source_etag and multipart_etag(p['ETag'] for p in parts) != source_etag.strip('"'):
+                logging.warning('parts of upload %s of %s/%s do not match source ETag %s, start over',
+                                upload_id, bucket, key, source_etag)
+                self.abort_multipart_upload(bucket, key, upload_id)
+                return self._run_parts(bucket, key, part_sizes, func, source_etag, False, **kwargs)
+            self.client.complete_multipart_upload(
+                Bucket=bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception as e:
+            if not resume or getattr(e, 'response', {}).get('Error', {}).get('Code') in PRECONDITION_ERRORS:
+                self.abort_multipart_upload(bucket, key, upload_id)
+            raise
+
+    def find_multipart_upload(self, bucket, key):
+        """
+        Latest in-progress multipart upload of key.
+
+        :return: upload id, None if no upload in progress
+        :rtype: str
+        """
+        uploads = [u for u in self.list_multipart_uploads(bucket, prefix=key) if u['Key'] == key]
+        if not uploads:
+            return None
+        return max(uploads, key=lambda u: u['Initiated'])['UploadId']
+
+    def list_multipart_uploads(self, bucket, prefix=None):
+        """
+        Generate in-progress multipart uploads with Key, UploadId and Initiated.
+        """
+        p = {'Bucket': bucket}
+        if prefix:
+            p['Prefix'] = prefix
+        while True:
+            res = self.client.list_multipart_uploads(**p)
+            for upload in res.get('Uploads', []):
+                yield upload
+            if not res.get('IsTruncated'):
+                break
+            p['KeyMarker'] = res['NextKeyMarker']
+            p['UploadIdMarker'] = res['NextUploadIdMarker']
+
+    def list_parts(self, bucket, key, upload_id) -> dict:
+        """
+        Parts uploaded to a multipart upload.
+
+        :return: part number to part with ETag and Size
+        :rtype: dict
+        """
+        parts = {}
+        p = {'Bucket': bucket, 'Key': key, 'UploadId': upload_id}
+        while True:
+            res = self.client.list_parts(**p)
+            for part in res.get('Parts', []):
+                parts[part['PartNumber']] = part
+            if not res.get('IsTruncated'):
+                return parts
+            p['PartNumberMarker'] = res['NextPartNumberMarker']
+
+    def abort_multipart_upload(self, bucket, key, upload_id):
+        try:
+            self.client.abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+        except Exception as e:
+            logging.warning('abort upload {} of {}/{} failed: {}'.format(upload_id, bucket, key, e))
+
+    def download_object(self, bucket, key, filename=None, callback=None):
         if not filename:
             tmp_dir = self.settings.get('migration.tmp_dir', 'tmp')
             if not os.path.exists(tmp_dir):
                 os.makedirs(tmp_dir, exist_ok=True)
             filename = os.path.join(tmp_dir, os.path.basename(key))
-        self.client.download_file(Bucket=bucket, Key=key, Filename=filename)
+        self.client.download_file(Bucket=bucket, Key=key, Filename=filename, Callback=callback)
+        return filename
+
+    def download_ranges(self, bucket, key, filename, size, part_size=8388608, concurrency=10, callback=None,
+                        **kwargs):
+        """
+        Download object by parallel ranged GETs, each range is written directly at its offset of the file.
+
+        :param filename: preallocated file to write
+        :param size: object size
+        :param part_size: bytes of each range
+        :param concurrency: ranges downloaded at the same time
+        :param callback: called with bytes downloaded
+        :param kwargs: extra arguments for get_object, such as IfMatch
+        """
+        fd = os.open(filename, os.O_WRONLY)
+        try:
+            def download_range(start):
+                end = min(start + part_size, size) - 1
+                res = self.get_object(bucket=bucket, key=key, Range='bytes={}-{}'.format(start, end), **kwargs)
+                offset = start
+                for chunk in res['Body'].iter_chunks(chunk_size=1048576):
+                    if self.limiter:
+                        self.limiter.consume(len(chunk))
+                    write_at(fd, chunk, offset)
+                    offset += len(chunk)
+                    if callback:
+                        callback(len(chunk))
+                if offset != end + 1:
+                    raise IOError('range {}-{} of {}/{} incomplete'.format(start, end, bucket, key))
+
+            if size <= part_size:
+                if size:
+                    download_range(0)
+            else:
+                with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                    list(pool.map(download_range, range(0, size, part_size)))
+        finally:
+            os.close(fd)
         return filename
 
+    def get_object(self, bucket, key, **kwargs):
+        param = {
+            'Bucket': bucket,
+            'Key': key
+        }
+        if kwargs:
+            param.update(kwargs)
+        return self.client.get_object(**param)
+
     def upload_object(self, bucket, key, filename):
         self.client.upload_file(Bucket=bucket, Key=key, Filename=filename)
         return key
@@ -73,6 +324,19 @@ class S3Resource:
             param.update(kwargs)
         return self.client.head_object(**param)
 
+    def restore_object(self, bucket, key, days=7, tier='Bulk', **kwargs):
+        param = {
+            'Bucket': bucket,
+            'Key': key,
+            'RestoreRequest': {
+                'Days': days,
+                'GlacierJobParameters': {'Tier': tier}
+            }
+        }
+        if kwargs:
+            param.update(kwargs)
+        return self.client.restore_object(**param)
+
     def get_object_tagging(self, bucket, key, **kwargs):
         param = {
             'Bucket': bucket,
@@ -93,6 +357,42 @@ class S3Resource:
             param.update(kwargs)
         return self.client.put_object(**param)
 
+    def put_file(self, bucket, key, filename, **kwargs):
+        """
+        Upload a file by put_object, the file is read while sending under the bandwidth limit.
+
+        :param filename: local file to upload
+        :param kwargs: extra arguments for put_object, such as Metadata and Tagging
+        """
+        with self.open_file_chunk(filename, 0, os.path.getsize(filename)) as body:
+            return self.put_object(bucket=bucket, key=key, body=body, **kwargs)
+
+    def open_file_chunk(self, filename, start, size):
+        """
+        Readable chunk of file to upload, bytes read while the request is sent are throttled by the bandwidth limiter.
+        """
+        if not self.limiter:
+            return ReadFileChunk.from_filename(filename, start, size)
+        # callbacks are enabled by signal_transferring only when the request is sent,
+        # so reads to compute checksums before sending are not throttled
+        return ReadFileChunk.from_filename(filename, start, size, callbacks=[self.limiter.callback],
+                                           enable_callbacks=False)
+
+    @property
+    def limiter(self):
+        """
+        Bandwidth limiter shared by downloads and uploads of this process, None if not limited.
+        """
+        if not self._limiter_checked:
+            self._limiter = get_bandwidth_limiter(self._settings)
+            if self._limiter:
+                events = self._client.meta.events
+                events.register_first('request-created.s3', signal_not_transferring,
+                                      unique_id='s3upload-not-transferring')
+                events.register_last('request-created.s3', signal_transferring, unique_id='s3upload-transferring')
+            self._limiter_checked = True
+        return self._limiter
+
     def put_object_tagging(self, bucket, key, tagging, **kwargs):
         param = {
             'Bucket': bucket,
@@ -103,9 +403,9 @@ class S3Resource:
         }
         if kwargs:
             param.update(kwargs)
-        return self.client(**param)
+        return self.client.put_object_tagging(**param)
 
-    def list_objects(self, bucket, prefix=None, max_keys=10, ctoken=None):
+    def list_objects(self, bucket, prefix=None, max_keys=10, ctoken=None, delimiter=None):
         p = {
             'Bucket': bucket,
             'MaxKeys': max_keys,
@@ -115,20 +415,43 @@ class S3Resource:
             p['Prefix'] = prefix
         if ctoken:
             p['ContinuationToken'] = ctoken
+        if delimiter:
+            p['Delimiter'] = delimiter
         return self.client.list_objects_v2(**p)
 
-    def list_objects_all(self, bucket, prefix=None, batch_num=1000):
+    def list_objects_all(self, bucket, prefix=None, batch_num=1000, delimiter=None):
         ctoken = None
         has_next = True
         while has_next:
-            res = self.list_objects(bucket=bucket, prefix=prefix, max_keys=batch_num, ctoken=ctoken)
+            res = self.list_objects(bucket=bucket, prefix=prefix, max_keys=batch_num, ctoken=ctoken,
+                                    delimiter=delimiter)
             if 'IsTruncated' in res and res['IsTruncated']:
                 ctoken = res['NextContinuationToken']
             else:
                 has_next = False
-            yield res['Contents']
+            yield res.get('Contents', [])
         return
 
+    def list_common_prefixes(self, bucket, prefix=None, delimiter='/'):
+        """
+        Prefixes of the next level under prefix.
+
+        :rtype: list
+        """
+        prefixes = []
+        ctoken = None
+        while True:
+            p = {'Bucket': bucket, 'Delimiter': delimiter, 'MaxKeys': 1000}
+            if prefix:
+                p['Prefix'] = prefix
+            if ctoken:
+                p['ContinuationToken'] = ctoken
+            res = self.client.list_objects_v2(**p)
+            prefixes.extend(item['Prefix'] for item in res.get('CommonPrefixes', []))
+            if not res.get('IsTruncated'):
+                return prefixes
+            ctoken = res['NextContinuationToken']
+
     def delete_object(self, bucket, key, **kwargs):
         param = {
             'Bucket': bucket,
@@ -142,11 +465,53 @@ class S3Resource:
     def client(self):
         return self._client
 
+    @property
+    def source_client(self):
+        """
+        Client of aws.copy_source profile to read source objects, created once and shared by threads.
+        """
+        with self._source_client_lock:
+            if self._source_client is None:
+                self._source_client = get_aws_session('copy_source').client('s3')
+            return self._source_client
+
+    def close(self):
+        """
+        Close connections of clients, such as before forking workers, connections are opened again when needed.
+        """
+        for client in [self._client, self._source_client]:
+            if client is not None and hasattr(client, 'close'):
+                client.close()
+
     @property
     def settings(self) -> Settings:
         return self._settings
 
 
+def multipart_etag(part_etags) -> str:
+    """
+    ETag of an object uploaded by multipart upload, MD5 of part MD5s followed by part number.
+
+    :param part_etags: ETags of all parts in order
+    :rtype: str
+    """
+    digests = [binascii.unhexlify(etag.strip('"')) for etag in part_etags]
+    return '{}-{}'.format(hashlib.md5(b''.join(digests)).hexdigest(), len(digests))
+
+
+def write_at(fd, data, offset):
+    if hasattr(os, 'pwrite'):
+        data = memoryview(data)
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data = data[written:]
+            offset += written
+    else:
+        with open(os.dup(fd), 'r+b') as fp:
+            fp.seek(offset)
+            fp.write(data)
+
+
 def split_s3_path(s3_path):
     if s3_path.startswith('s3://'):
         p = s3_path[5:]
@@ -6,21 +6,31 @@ Wrapper for boto3 SQS client.
 """
 import logging
 import json
-import time
-import random
 from hsettings import Settings
 from s3_tools.aws_utils import get_aws_session
+from s3_tools.queues import QueueBackend, MAX_RECEIVE_COUNT
 
+# SendMessageBatch allows at most 10 messages and 256 KB of payload in total
+MAX_BATCH_NUM = 10
+MAX_BATCH_BYTES = 262144
+# queue url prefix of each profile, got once in a process and inherited by forked workers
+_queue_url_prefixes = {}
 
-class SqsResource:
+
+class SqsResource(QueueBackend):
 
     def __init__(self, settings, profile=None):
-        self._settings = settings
+        super().__init__(settings)
         self._profile = profile or 'copy'
         self._client = get_aws_session(self._profile).client('sqs')
-        self._queue_url_prefix = ''
+        self._queue_url_prefix = _queue_url_prefixes.get(self._profile, '')
+
+    def init_queues(self, queue_names=None):
+        """
+        Create dead-letter queue and queues redriven to it.
 
-    def init_queues(self):
+        :param list queue_names: queues to create, default sqs.queue_num queues named by sqs.queue_name_pattern
+        """
         vt = self.settings.get('sqs.visibility_timeout')
         wt = self.settings.get('sqs.receive_message_wait_time')
         rp = self.settings.get('sqs.message_retention_period')
@@ -47,11 +57,11 @@ class SqsResource:
             logging.error(e)
             return
         # create queues
-        pattern = self.settings.get('sqs.queue_name_pattern')
-        num = self.settings.get('sqs.queue_num')
-        for i in range(1, num + 1):
+        if queue_names is None:
+            pattern = self.settings.get('sqs.queue_name_pattern')
+            queue_names = [pattern.format(i) for i in range(1, self.settings.get('sqs.queue_num') + 1)]
+        for queue_name in queue_names:
             try:
-                queue_name = pattern.format(i)
                 logging.info('Create queue {}'.format(queue_name))
                 response = self.client.create_queue(
                     QueueName=queue_name,
@@ -61,75 +71,126 @@ class SqsResource:
                         'VisibilityTimeout': vt,
                         'RedrivePolicy': json.dumps({
                             'deadLetterTargetArn': dead_queue_arn,
-                            'maxReceiveCount': '3'
+                            'maxReceiveCount': str(MAX_RECEIVE_COUNT)
                         })
                     }
                 )
             except Exception as e:
                 logging.error(e)
 
-    def send_message(self, message: dict, number: int=None, to_dead: bool=False):
-        if to_dead:
-            queue_name = self.settings.get('sqs.dead_queue_name')
-        else:
-            queue_name = self.get_queue_name(number)
+    def send_message(self, message: dict, number: int=None, to_dead: bool=False, queue_name: str=None):
+        queue_name = self.resolve_queue_name(number, to_dead, queue_name)
         queue_url = self.get_queue_url(queue_name)
-        logging.info('Send message to queue {}'.format(queue_name))
+        logging.info('Send message to queue %s', queue_name, extra={'event': 'send'})
         response = self.client.send_message(
             QueueUrl=queue_url,
             MessageBody=json.dumps(message),
         )
         return response
 
-    def receive_message(self, number: int=None, including_dead: bool=False):
-        if including_dead:
-            if number == -1 or random.randint(0, 1) == 0:
-                queue_name = self.settings.get('sqs.dead_queue_name')
-            else:
-                queue_name = self.get_queue_name(number)
-        else:
-            queue_name = self.get_queue_name(number)
+    def send_message_batch(self, messages, number: int=None, to_dead: bool=False, queue_name: str=None) -> list:
+        queue_name = self.resolve_queue_name(number, to_dead, queue_name)
         queue_url = self.get_queue_url(queue_name)
-        max_num = self.settings.get('sqs.max_receive_num')
+        bodies = [json.dumps(m) for m in messages]
+        failed = []
+        start = 0
+        while start < len(bodies):
+            end = start + 1
+            size = len(bodies[start].encode('utf-8'))
+            while end < len(bodies) and end - start < MAX_BATCH_NUM:
+                size += len(bodies[end].encode('utf-8'))
+                if size > MAX_BATCH_BYTES:
+                    break
+                end += 1
+            response = self.client.send_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': str(i), 'MessageBody': bodies[i]} for i in range(start, end)]
+            )
+            failed.extend(messages[int(f['Id'])] for f in response.get('Failed', []))
+            start = end
+        logging.info('Send %s messages to queue %s', len(messages) - len(failed), queue_name, extra={'event': 'send'})
+        return failed
+
+    def receive_message(self, number: int=None, including_dead: bool=False, queue_name: str=None,
+                        max_num: int=None, **kwargs):
+        """
+
+        :param max_num: max messages to receive, default sqs.max_receive_num
+        :param kwargs: extra arguments for receive_message, such as WaitTimeSeconds and VisibilityTimeout
+        :return: messages and queue url, messages have ApproximateReceiveCount attribute
+        :rtype: tuple
+        """
+        if not queue_name:
+            queue_name = self.pick_queue_name(number, including_dead)
+        queue_url = self.get_queue_url(queue_name)
+        max_num = max_num or self.settings.get('sqs.max_receive_num')
+        kwargs.setdefault('AttributeNames', ['ApproximateReceiveCount'])
         response = self.client.receive_message(
             QueueUrl=queue_url,
-            MaxNumberOfMessages=max_num
+            MaxNumberOfMessages=max_num,
+            **kwargs
         )
         if 'Messages' in response:
             return response['Messages'], queue_url
         return [], queue_url
 
-    def receive_message_loop(self, number: int=None, include_dead: bool=False, sleep_sec: int=5):
-        while True:
-            messages, queue_url = self.receive_message(number=number, including_dead=include_dead)
-            if messages:
-                logging.info('receive message: {}'.format(messages))
-                for msg in messages:
-                    yield msg, queue_url
-            else:
-                logging.info('no message, sleep for {} seconds'.format(sleep_sec))
-                time.sleep(sleep_sec)
-
     def delete_message(self, queue_url, receipt_handle):
-        logging.info('Delete message {}'.format(receipt_handle))
+        logging.info('Delete message %s', receipt_handle, extra={'event': 'delete_message'})
         self.client.delete_message(QueueUrl=queue_url, ReceiptHandle=receipt_handle)
 
-    def get_queue_name(self, number: int=None):
-        pattern = self.settings.get('sqs.queue_name_pattern')
-        if not number:
-            num = self.settings.get('sqs.queue_num')
-            number = random.randint(1, num)
-        return pattern.format(number)
+    def delete_message_batch(self, queue_url, receipt_handles):
+        """
+        Delete messages by batches of 10.
+
+        :param queue_url:
+        :param list receipt_handles:
+        :return: receipt handles failed to delete
+        :rtype: list
+        """
+        failed = []
+        for i in range(0, len(receipt_handles), 10):
+            handles = receipt_handles[i:i + 10]
+            response = self.client.delete_message_batch(
+                QueueUrl=queue_url,
+                Entries=[{'Id': str(j), 'ReceiptHandle': h} for j, h in enumerate(handles)]
+            )
+            failed.extend(handles[int(f['Id'])] for f in response.get('Failed', []))
+        logging.info('Delete %s messages', len(receipt_handles) - len(failed), extra={'event': 'delete_message'})
+        return failed
+
+    def change_message_visibility(self, queue_url, receipt_handle, visibility_timeout):
+        logging.debug('Change message visibility %s to %s seconds', receipt_handle, visibility_timeout)
+        self.client.change_message_visibility(
+            QueueUrl=queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=int(visibility_timeout)
+        )
+
+    def get_queue_attributes(self, queue_name, attribute_names=None):
+        queue_url = self.get_queue_url(queue_name)
+        response = self.client.get_queue_attributes(
+            QueueUrl=queue_url,
+            AttributeNames=attribute_names or ['All']
+        )
+        return response.get('Attributes', {})
 
     def get_queue_url(self, queue_name):
         if not self._queue_url_prefix:
             response = self.client.get_queue_url(QueueName=queue_name)
             queue_url = response['QueueUrl']
             self._queue_url_prefix = get_queue_url_prefix(queue_url)
+            _queue_url_prefixes[self._profile] = self._queue_url_prefix
         else:
             queue_url = self._queue_url_prefix + queue_name
         return queue_url
 
+    def close(self):
+        """
+        Close connections of client, such as before forking workers, connections are opened again when needed.
+        """
+        if hasattr(self._client, 'close'):
+            self._client.close()
+
     @property
     def client(self):
         return self._client
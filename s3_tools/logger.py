@@ -1,19 +1,183 @@
+"""
+Logger for s3 tools.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Records of the hot path (one per key or message) should be logged with lazy formatting
+and an event type, such as logging.info('copy object %s/%s successfully', bucket, key, extra={'event': 'copied'}):
+- background: records are put to a bounded queue and written by a listener thread,
+  info records are dropped if the queue is full, warnings and errors wait
+- json: one JSON object per line with time, level, message, event and thread
+- sample: keep 1 of every N info records of an event type
+- rate limit: at most N info records per second of each event type
+Records are only formatted if they pass the filters, warnings and errors always pass.
+Processes forked after init_logger call after_fork to start their own listener thread.
+"""
+import json
+import time
+import queue
+import atexit
 import logging
-from logging.handlers import RotatingFileHandler
+import threading
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
+
+EVENT_KEY = 'event'
+TEXT_FORMAT = '[%(levelname)s] %(asctime)s: %(message)s'
+
 
+def init_logger(log_level=None, log_file=None, log_format='text', queue_size=0, sample=None, rate_limit=0):
+    """
 
-def init_logger(log_level=None, log_file=None):
-    formatter = '[%(levelname)s] %(asctime)s: %(message)s'
+    :param log_level: logger level
+    :param log_file: log file path, print to console if not provided
+    :param log_format: text or json
+    :param queue_size: max records waiting to be written by background thread, 0 to write in caller thread
+    :param dict sample: event type to N, keep 1 of every N info records of the event type
+    :param rate_limit: max info records per second of each event type, 0 for no limit
+    :return: background listener if queue_size is not 0
+    """
     if not log_level:
         log_level = 'INFO'
     root_logger = logging.getLogger()
     root_logger.setLevel(log_level)
     if log_file:
         handler = RotatingFileHandler(log_file, maxBytes=5000000, backupCount=10)
-        handler.setFormatter(logging.Formatter(formatter))
-        handler.setLevel(log_level)
     else:
         handler = logging.StreamHandler()
-        handler.setFormatter(logging.Formatter(formatter))
-        handler.setLevel(log_level)
+    if log_format == 'json':
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handler.setLevel(log_level)
+    listener = None
+    if queue_size:
+        listener = QueueListener(queue.Queue(queue_size), handler, respect_handler_level=True)
+        handler = BackgroundHandler(listener.queue)
+        handler.listener = listener
+        listener.start()
+        atexit.register(listener.stop)
+    if sample:
+        handler.addFilter(EventSampler(sample))
+    if rate_limit:
+        handler.addFilter(EventRateLimiter(rate_limit))
     root_logger.addHandler(handler)
+    return listener
+
+
+def after_fork():
+    """
+    Restart background writing in a forked process, the listener thread of parent is not forked.
+
+    :return: listeners started
+    :rtype: list
+    """
+    listeners = []
+    for handler in logging.getLogger().handlers:
+        if not isinstance(handler, BackgroundHandler) or not handler.listener:
+            continue
+        atexit.unregister(handler.listener.stop)
+        # the queue of parent may be locked by its listener thread at fork
+        listener = QueueListener(queue.Queue(handler.queue.maxsize), *handler.listener.handlers,
+                                 respect_handler_level=True)
+        handler.queue = listener.queue
+        handler.listener = listener
+        listener.start()
+        atexit.register(listener.stop)
+        listeners.append(listener)
+    return listeners
+
+
+class BackgroundHandler(QueueHandler):
+    """
+    Put records to a bounded queue without formatting, QueueListener formats and writes them.
+    """
+
+    def __init__(self, q):
+        super().__init__(q)
+        self.dropped = 0
+        self.listener = None
+
+    def prepare(self, record):
+        # queue is consumed in the same process, so the record is passed as it is
+        return record
+
+    def enqueue(self, record):
+        if record.levelno >= logging.WARNING:
+            self.queue.put(record)
+            return
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    Format record as one JSON object, event type and extra fields are included.
+    """
+    RESERVED = set(logging.LogRecord('', 0, '', 0, '', (), None).__dict__) | {'message', 'asctime'}
+
+    def format(self, record):
+        data = {
+            'time': record.created,
+            'level': record.levelname,
+            'message': record.getMessage(),
+            'thread': record.threadName
+        }
+        for k, v in record.__dict__.items():
+            if k not in self.RESERVED:
+                data[k] = v
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class EventSampler(logging.Filter):
+
+    def __init__(self, sample: dict):
+        """
+
+        :param sample: event type to N, keep 1 of every N info records of the event type
+        """
+        super().__init__()
+        self._sample = dict((k, int(v)) for k, v in sample.items())
+        self._counts = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        event = getattr(record, EVENT_KEY, None)
+        if record.levelno >= logging.WARNING or self._sample.get(event, 1) <= 1:
+            return True
+        with self._lock:
+            count = self._counts.get(event, 0)
+            self._counts[event] = count + 1
+        return count % self._sample[event] == 0
+
+
+class EventRateLimiter(logging.Filter):
+
+    def __init__(self, rate: float, clock=time.time):
+        """
+
+        :param rate: max info records per second of each event type
+        :param clock: time function
+        """
+        super().__init__()
+        self._rate = rate
+        self._clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        event = getattr(record, EVENT_KEY, None)
+        now = self._clock()
+        with self._lock:
+            tokens, last = self._buckets.get(event, (self._rate, now))
+            tokens = min(self._rate, tokens + (now - last) * self._rate)
+            if tokens < 1:
+                self._buckets[event] = (tokens, now)
+                return False
+            self._buckets[event] = (tokens - 1, now)
+        return True
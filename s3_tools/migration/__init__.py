@@ -6,16 +6,27 @@ TARGET_BUCKET_KEY = 'target_bucket'
 KEYS_KEY = 'keys'
 SOURCE_KEY_KEY = 'source_key'
 TARGET_KEY_KEY = 'target_key'
+ETAG_KEY = 'etag'
+SIZE_KEY = 'size'
+ERROR_KEY = 'error'
+ACTION_KEY = 'action'
+ACTION_DELETE = 'delete'
+ACTION_RESTORE = 'restore'
+JOB_KEY = 'job'
+STORAGE_CLASS_KEY = 'storage_class'
+# key changed since recorded in executor journals, such as changed since last incremental run
+CHANGED_KEY = 'changed'
 
 
 def common_init_args(parser):
     parser.add_argument('--log-level', help='logger level', default='INFO')
     parser.add_argument('--log-file', help='logger file')
+    parser.add_argument('--log-format', help='logger format, one JSON object per line for json', choices=['text', 'json'])
     parser.add_argument('-c', '--config-file', help='config file path, default config.yml', default='config.yml')
     parser.add_argument('-e', '--env-file', help='env file path')
 
 
-def commander_init_args(parser):
+def lister_init_args(parser):
     parser.add_argument('-m', '--manifest-path',
                         help='manifest file path for S3InventoryLister, use S3InventoryLister if specified')
     parser.add_argument('-s', '--source-bucket',
@@ -26,18 +37,67 @@ def commander_init_args(parser):
     parser.add_argument('--tmp-dir', help='temp directory to store temp files')
     parser.add_argument('--owner', help='send if owner match for S3ObjectLister')
     parser.add_argument('--no-owner', help='send if owner not match for S3ObjectLister')
+    parser.add_argument('--job', help='job registered in jobs of config, messages are sent to queues of the job')
+    parser.add_argument('--modified-since', help='send if object\'s last modified time at or after specific time, '
+                        'UTC if no timezone')
+    parser.add_argument('--not-modified-since', help='send if object\'s last modified time before specific time, '
+                        'UTC if no timezone')
+    parser.add_argument('--min-size', help='send if object size not smaller than min size in bytes', type=int)
+    parser.add_argument('--max-size', help='send if object size not larger than max size in bytes', type=int)
+    parser.add_argument('--storage-class', help='send if object storage class is one of these, such as STANDARD',
+                        nargs='+')
+    parser.add_argument('--shard', help='i/N to list only shard i of N shards (1 <= i <= N), commanders of all shards '
+                        'together send all objects')
+    parser.add_argument('--shard-depth', help='levels of / prefixes to split keys into shards for S3ObjectLister',
+                        default=1, type=int)
+
+
+def commander_init_args(parser):
+    lister_init_args(parser)
+    parser.add_argument('--plan', help='plan file generated by plan command, send messages to queues in plan')
+    parser.add_argument('--incremental', help='snapshot directory, only send objects added or changed since last run',
+                        metavar='SNAPSHOT_DIR')
+    parser.add_argument('--sync-deletes', help='send delete tasks for objects deleted since last run, '
+                        'only used with --incremental', action='store_true')
+    parser.add_argument('--checkpoint', help='checkpoint file, sources all sent by the last run are skipped')
+    parser.add_argument('--list-workers', help='threads to list sources such as inventory list files', type=int)
+    parser.add_argument('--batch-workers', help='threads to filter and batch keys into messages', type=int)
+    parser.add_argument('--send-workers', help='threads to send messages', type=int)
+    parser.add_argument('--adaptive-batch', help='adapt keys per message to processing time of executors in outcome '
+                        'files, default migration.adaptive_batch', action='store_true')
+    parser.add_argument('--outcome-path', help='outcome files, directories or s3://bucket/prefix/ paths for adaptive '
+                        'batch, default migration.outcome_dir', nargs='+')
+    parser.add_argument('--restore-archived', help='send GLACIER and DEEP_ARCHIVE objects to restore queue for '
+                        'restorer command, default migration.restore_archived', action='store_true')
     common_init_args(parser)
     parser.set_defaults(func=run_commander)
 
 
+def planner_init_args(parser):
+    lister_init_args(parser)
+    parser.add_argument('-o', '--output', help='plan file path', default='plan.json')
+    parser.add_argument('--mode', help='executor mode to estimate API calls', choices=['copy', 'downup'],
+                        default='copy')
+    parser.add_argument('-v', '--verify', help='executor verify object before migration', action='store_true')
+    parser.add_argument('--executors', help='executor number to estimate duration', default=100, type=int)
+    parser.add_argument('--call-latency', help='seconds of each S3 API call', default=0.03, type=float)
+    parser.add_argument('--bandwidth', help='bytes per second of each executor', default=50000000, type=float)
+    parser.add_argument('--run-num', help='consecutive messages sent to the same queue', default=100, type=int)
+    common_init_args(parser)
+    parser.set_defaults(func=run_planner)
+
+
 def executor_init_args(parser):
     parser.add_argument('-v', '--verify', help='verify object before migration', action='store_true')
     parser.add_argument('-n', '--queue-num', help='specify queue number, specify -1 to use none, default random pick',
                         type=int)
     parser.add_argument('-d', '--including-dead', help='receive message including dead-letter queue for executor',
                         action='store_true')
-    parser.add_argument('--mode', help='executor mode, directory copy object or download then upload or just check',
-                        choices=['copy', 'downup', 'check'], default='copy')
+    parser.add_argument('--mode', help='executor mode, directory copy object or download then upload or just check, '
+                        'auto to select copy or download then upload for each object',
+                        choices=['copy', 'downup', 'auto', 'check'], default='copy')
+    parser.add_argument('--schedule', help='how to pick queue to receive, random pick or weighted by queue depth',
+                        choices=['random', 'depth'], default='random')
     parser.add_argument('--sleep-sec', help='sleep seconds if no messages', default=5, type=int)
     parser.add_argument('--modified-since', help='copy if object\'s last modified time after specific time')
     parser.add_argument('--not-modified-since', help='copy if object\'s last modified time before specific time')
@@ -45,17 +105,130 @@ def executor_init_args(parser):
     parser.add_argument('--queue-name-pattern', help='task queue name pattern')
     parser.add_argument('--dead-queue-name', help='dead-letter queue name')
     parser.add_argument('--max-receive-num', help='max receive messages number', type=int)
+    parser.add_argument('--journal-file', help='completion journal file, skip keys migrated successfully before')
+    parser.add_argument('--outcome-dir', help='directory to write outcome files of each key for report command')
+    parser.add_argument('--bandwidth-limit', help='max bytes per second of downloads and uploads in downup mode',
+                        type=int)
+    parser.add_argument('--jobs', help='receive from queues of jobs by weighted fair scheduling, all for all jobs '
+                        'registered in config, --queue-num and --schedule are ignored', nargs='+')
+    parser.add_argument('--prefork', help='worker processes forked from a warm parent which loads clients, '
+                        'credentials and queue URLs once, default migration.prefork', type=int)
+    parser.add_argument('--restore-archived', help='send keys failed with InvalidObjectState to restore queue for '
+                        'restorer command, default migration.restore_archived', action='store_true')
     common_init_args(parser)
     parser.set_defaults(func=run_executor)
 
 
+def journal_init_args(parser):
+    parser.add_argument('--journal-file', help='completion journal file, default migration.journal_file in config')
+    parser.add_argument('--export', help='export journal records to a JSON lines file')
+    parser.add_argument('--merge', help='merge JSON lines files exported from other journals', nargs='+')
+    common_init_args(parser)
+    parser.set_defaults(func=run_journal)
+
+
+def report_init_args(parser):
+    parser.add_argument('paths', help='outcome files, directories or s3://bucket/prefix/ paths', nargs='+')
+    parser.add_argument('-o', '--output', help='write report as JSON file')
+    parser.add_argument('--workers', help='processes to aggregate files, default cpu number', type=int)
+    parser.add_argument('--interval', help='seconds of each throughput bucket', default=60, type=int)
+    parser.add_argument('--failed-keys', help='write failed keys to a JSON lines file')
+    parser.add_argument('--tmp-dir', help='temp directory to download outcome files from S3')
+    common_init_args(parser)
+    parser.set_defaults(func=run_report)
+
+
+def deadletter_init_args(parser):
+    parser.add_argument('--dry-run', help='only write summary, messages are left in dead-letter queue',
+                        action='store_true')
+    parser.add_argument('--hold-errors', help='error classes not to retry, default migration.deadletter_hold_errors',
+                        nargs='*')
+    parser.add_argument('--hold-file', help='JSON lines file to append messages of held keys',
+                        default='deadletter-held.jsonl')
+    parser.add_argument('--summary', help='summary file of failed keys by error class and prefix',
+                        default='deadletter-summary.json')
+    parser.add_argument('--prefix-depth', help='folder depth of key prefixes in summary', default=1, type=int)
+    parser.add_argument('--concurrency', help='threads to receive and send messages', default=10, type=int)
+    parser.add_argument('--round-size', help='messages to triage in each round', default=1000, type=int)
+    parser.add_argument('-n', '--queue-num', help='main queue to send retried keys, default random pick', type=int)
+    parser.add_argument('-b', '--batch-num', help='keys number in one message sent to main queues', type=int)
+    parser.add_argument('--replay', help='send messages in a hold file to main queues instead of triage',
+                        metavar='HOLD_FILE')
+    common_init_args(parser)
+    parser.set_defaults(func=run_deadletter)
+
+
+def scaler_init_args(parser):
+    parser.add_argument('--target-sec', help='seconds to empty the queues', default=3600, type=int)
+    parser.add_argument('--executors', help='current executors, counted by recent outcome files '
+                        'or estimated by in-flight messages if not specified', type=int)
+    parser.add_argument('--min-executors', help='min executors to suggest', default=0, type=int)
+    parser.add_argument('--max-executors', help='max executors to suggest, 0 for no limit', default=0, type=int)
+    parser.add_argument('-d', '--including-dead', help='count dead-letter queue in backlog', action='store_true')
+    parser.add_argument('--jobs', help='queues of these jobs, all for all jobs registered in config, '
+                        'default main queues', nargs='+')
+    parser.add_argument('--outcome-path', help='outcome files, directories or s3://bucket/prefix/ paths to find '
+                        'drain rate, executors and throttling, default migration.outcome_dir', nargs='+')
+    parser.add_argument('--window-sec', help='seconds of outcomes counted as recent', default=600, type=int)
+    parser.add_argument('--throttle-ratio', help='ratio of throttled keys to be throttled', default=0.01,
+                        type=float)
+    parser.add_argument('--state-file', help='file to keep last sample, drain rate is computed since last sample',
+                        default='scaler-state.json')
+    parser.add_argument('--sample-sec', help='seconds to wait for a second sample if no recent last sample',
+                        default=60, type=int)
+    parser.add_argument('-o', '--output', help='write result to file instead of stdout')
+    parser.add_argument('--format', help='json result or CloudWatch PutMetricData payload',
+                        choices=['json', 'metric'], default='json')
+    parser.add_argument('--namespace', help='namespace of metric payload', default='S3Migration')
+    parser.add_argument('--watch', help='sample every WATCH seconds until interrupted', type=int)
+    common_init_args(parser)
+    parser.set_defaults(func=run_scaler)
+
+
+def status_init_args(parser):
+    parser.add_argument('--checkpoint', help='commander checkpoint file for keys and bytes enqueued')
+    parser.add_argument('--outcome-path', help='outcome files, directories or s3://bucket/prefix/ paths for keys done '
+                        'and failed, default migration.outcome_dir', nargs='+')
+    parser.add_argument('--jobs', help='queues of these jobs, all for all jobs registered in config, '
+                        'default sqs.queue_num queues', nargs='+')
+    parser.add_argument('--window-sec', help='seconds of samples to compute rates', default=600, type=int)
+    parser.add_argument('--watch', help='refresh every WATCH seconds until interrupted', type=int)
+    parser.add_argument('--format', help='text for terminal or one JSON object per refresh',
+                        choices=['text', 'json'], default='text')
+    common_init_args(parser)
+    parser.set_defaults(func=run_status)
+
+
+def cleanup_init_args(parser):
+    parser.add_argument('buckets', help='target buckets to abort stale multipart uploads', nargs='+')
+    parser.add_argument('-p', '--prefix', help='only uploads of keys with this prefix')
+    parser.add_argument('--older-than', help='abort uploads initiated more than these hours ago', default=168,
+                        type=float)
+    parser.add_argument('--dry-run', help='only list stale uploads', action='store_true')
+    common_init_args(parser)
+    parser.set_defaults(func=run_cleanup)
+
+
+def restorer_init_args(parser):
+    parser.add_argument('--state-file', help='SQLite file of keys restoring, default migration.restore_state_file')
+    parser.add_argument('--days', help='days restored copies are kept, default migration.restore_days', type=int)
+    parser.add_argument('--tier', help='retrieval tier, default migration.restore_tier',
+                        choices=['Expedited', 'Standard', 'Bulk'])
+    parser.add_argument('--concurrency', help='threads to restore and check keys', default=20, type=int)
+    parser.add_argument('--check-sec', help='seconds between two checks of a key not yet restored, '
+                        'default migration.restore_check_sec', type=int)
+    parser.add_argument('-n', '--queue-num', help='main queue to send keys restored, default random pick', type=int)
+    common_init_args(parser)
+    parser.set_defaults(func=run_restorer)
+
+
 def initializer_init_args(parser):
+    parser.add_argument('--job', help='create queues of a job registered in jobs of config')
     common_init_args(parser)
     parser.set_defaults(func=run_init)
 
 
-def run_commander(args):
-    from s3_tools.migration.commander import Commander
+def get_lister(args):
     if args['manifest_path']:
         # use inventory manifest file
         from s3_tools.migration.commander import S3InventoryLister
@@ -66,33 +239,354 @@ def run_commander(args):
         from s3_tools.migration.commander import S3ObjectLister
         logging.info('Use list_objects API lister')
         lister = S3ObjectLister(**args)
-    comd = Commander(lister=lister)
+    if args.get('incremental'):
+        from s3_tools.migration.commander import IncrementalLister
+        logging.info('Use incremental lister with snapshots in {}'.format(args['incremental']))
+        lister = IncrementalLister(lister=lister, snapshot_dir=args['incremental'], sync_deletes=args['sync_deletes'])
+    return lister
+
+
+def run_commander(args):
+    from s3_tools.migration.commander import Commander
+    lister = get_lister(args)
+    plan = None
+    if args['plan']:
+        from s3_tools.migration.planner import load_plan
+        plan = load_plan(args['plan'])
+        if plan['batch_num'] != lister.batch_num:
+            raise ValueError('batch number {} differs from plan {}'.format(lister.batch_num, plan['batch_num']))
+        from s3_tools.migration.sharding import shard_name
+        shard = shard_name(lister.shard) if lister.shard else None
+        if plan.get('shard') != shard:
+            raise ValueError('shard {} differs from plan {}'.format(shard, plan.get('shard')))
+    if args['checkpoint'] and args.get('incremental'):
+        raise ValueError('checkpoint is not supported with incremental')
+    job = None
+    if args['job']:
+        from s3_tools.migration.jobs import get_job
+        from s3_tools import settings
+        job = get_job(settings, args['job'])
+        if plan and plan['queue_num'] != job.queue_num:
+            raise ValueError('queue number {} of job differs from plan {}'.format(job.queue_num, plan['queue_num']))
+    from s3_tools import settings
+    outcome_files = None
+    if settings.get('migration.adaptive_batch', False):
+        outcome_files = get_outcome_files(args.get('outcome_path'))
+    comd = Commander(lister=lister, plan=plan, checkpoint=args['checkpoint'], job=job, outcome_files=outcome_files)
     comd.run(**args)
 
 
+def run_planner(args):
+    from s3_tools.migration.planner import MigrationPlanner, save_plan
+    from s3_tools import settings
+    lister = get_lister(args)
+    queue_num = settings.get('sqs.queue_num')
+    if args['job']:
+        from s3_tools.migration.jobs import get_job
+        queue_num = get_job(settings, args['job']).queue_num
+    planner = MigrationPlanner(lister=lister, queue_num=queue_num, run_num=args['run_num'])
+    plan = planner.plan(max_receive_num=settings.get('sqs.max_receive_num', 10), **args)
+    save_plan(plan, args['output'])
+    logging.info('Plan saved to {}'.format(args['output']))
+
+
 def run_executor(args):
-    from s3_tools.migration.executor import Executor
+    from s3_tools import settings
     p = parse_args(args)
+    workers = settings.get('migration.prefork', 0)
+    if workers:
+        from s3_tools.migration.prefork import PreforkPool, warm_up
+        pool = PreforkPool(lambda: start_executor(p), workers, warm_up=warm_up,
+                           min_uptime=settings.get('migration.prefork_min_uptime', 10))
+        exit(pool.run())
+    start_executor(p)
+
+
+def start_executor(p: dict):
+    from s3_tools.migration.executor import Executor
     exe = Executor(**p)
     exe.run()
 
 
 def run_init(args):
-    from s3_tools.aws_utils.sqs import SqsResource
+    from s3_tools.queues import get_queue_backend
+    from s3_tools import settings
+    sqs = get_queue_backend(settings)
+    if args['job']:
+        from s3_tools.migration.jobs import get_job, job_queue_names
+        sqs.init_queues(queue_names=job_queue_names(get_job(settings, args['job'])))
+    else:
+        sqs.init_queues()
+    if settings.get('migration.restore_archived', False):
+        sqs.init_queues(queue_names=[settings.get('sqs.restore_queue_name')])
+
+
+def run_journal(args):
+    from s3_tools.migration.journal import CompletionJournal
+    from s3_tools import settings
+    journal_file = args['journal_file'] or settings.get('migration.journal_file', None)
+    if not journal_file:
+        raise ValueError('journal file not provided')
+    journal = CompletionJournal(journal_file, settings.get('migration.journal_max_entries', 10000000))
+    for filename in args['merge'] or []:
+        logging.info('Merge {} records from {}'.format(journal.merge(filename), filename))
+    if args['export']:
+        logging.info('Export {} records to {}'.format(journal.export(args['export']), args['export']))
+    logging.info('Journal {} has {} records'.format(journal_file, len(journal)))
+    journal.close()
+
+
+def run_report(args):
+    import json
+    from s3_tools.migration.outcomes import list_outcome_files, aggregate_files
+    from s3_tools.aws_utils.s3 import S3Resource
+    from s3_tools import settings
+    s3 = None
+    if any(p.startswith('s3://') for p in args['paths']):
+        s3 = S3Resource(settings)
+    filenames = list_outcome_files(args['paths'], tmp_dir=settings.get('migration.tmp_dir', 'tmp'), s3_resource=s3)
+    logging.info('Aggregate {} outcome files'.format(len(filenames)))
+    report = aggregate_files(filenames, interval=args['interval'], workers=args['workers'],
+                             failed_keys=bool(args['failed_keys']))
+    failed_keys = report.pop('failed_keys')
+    for action, item in sorted(report['actions'].items()):
+        logging.info('{}: {} keys, {} bytes'.format(action, item['count'], item['bytes']))
+    for error, count in report['errors'].items():
+        logging.info('failed by {}: {} keys'.format(error, count))
+    logging.info('{} keys in {} files, {:.0f} bytes per second'.format(report['keys'], report['files'],
+                                                                      report['bytes_per_sec']))
+    if args['output']:
+        with open(args['output'], 'w') as fp:
+            json.dump(report, fp, indent=2)
+        logging.info('Report saved to {}'.format(args['output']))
+    if args['failed_keys']:
+        with open(args['failed_keys'], 'w') as fp:
+            for bucket, key, error in failed_keys:
+                fp.write(json.dumps({'bucket': bucket, 'key': key, 'error': error}) + '\n')
+        logging.info('{} failed keys saved to {}'.format(len(failed_keys), args['failed_keys']))
+
+
+def run_deadletter(args):
+    import json
+    from s3_tools.migration.deadletter import DeadLetterTriage, replay_held
+    from s3_tools.migration.jobs import load_jobs
+    from s3_tools.queues import get_queue_backend
+    from s3_tools import settings
+    sqs = get_queue_backend(settings)
+    jobs = load_jobs(settings)
+    if args['replay']:
+        logging.info('Replay {} keys from {}'.format(replay_held(sqs, args['replay'], args['queue_num'], jobs=jobs),
+                                                     args['replay']))
+        return
+    hold_errors = args['hold_errors']
+    if hold_errors is None:
+        hold_errors = settings.get('migration.deadletter_hold_errors', None) or []
+    triage = DeadLetterTriage(
+        sqs=sqs,
+        batch_num=settings.get('migration.batch_num', 500),
+        hold_errors=hold_errors,
+        hold_file=args['hold_file'],
+        prefix_depth=args['prefix_depth'],
+        concurrency=args['concurrency'],
+        round_size=args['round_size'],
+        visibility_timeout=int(settings.get('sqs.visibility_timeout', 1800)),
+        queue_num=args['queue_num'],
+        dry_run=args['dry_run'],
+        jobs=jobs
+    )
+    summary = triage.run()
+    for error, item in summary['errors'].items():
+        logging.info('{}: {} keys, {} bytes, {}'.format(error, item['keys'], item['bytes'],
+                                                         'retry' if item['retry'] else 'hold'))
+    with open(args['summary'], 'w') as fp:
+        json.dump(summary, fp, indent=2)
+    logging.info('{} keys in {} messages, {} keys retried, {} keys held, summary saved to {}'.format(
+        summary['keys'], summary['messages'], summary['retried_keys'], summary['held_keys'], args['summary']))
+
+
+def get_queue_names(sqs, jobs=None) -> list:
+    """
+    Main queues of jobs, all for all jobs registered in config, or sqs.queue_num queues if no jobs.
+    """
+    if not jobs:
+        return sqs.get_queue_names()
+    from s3_tools.migration.jobs import load_jobs, job_queue_names
+    registry = load_jobs(sqs.settings)
+    names = sorted(registry) if jobs == ['all'] else jobs
+    for name in names:
+        if name not in registry:
+            raise ValueError('job {} not registered in config'.format(name))
+    return [q for name in names for q in job_queue_names(registry[name])]
+
+
+def get_outcome_files(paths=None):
+    """
+    Function listing outcome files in paths or migration.outcome_dir, None if no outcome files.
+    """
+    from s3_tools.migration.outcomes import list_outcome_files
+    from s3_tools import settings
+    paths = paths or [p for p in [settings.get('migration.outcome_dir', None)] if p]
+    if not paths:
+        return None
+    s3 = None
+    if any(p.startswith('s3://') for p in paths):
+        from s3_tools.aws_utils.s3 import S3Resource
+        s3 = S3Resource(settings)
+
+    def outcome_files():
+        return list_outcome_files(paths, tmp_dir=settings.get('migration.tmp_dir', 'tmp'), s3_resource=s3)
+    return outcome_files
+
+
+def run_scaler(args):
+    import json
+    import time
+    from s3_tools.migration.scaler import FleetScaler, load_state, save_json, make_metric_data
+    from s3_tools.queues import get_queue_backend
+    from s3_tools import settings
+    sqs = get_queue_backend(settings)
+    queue_names = get_queue_names(sqs, args['jobs'])
+    outcome_files = get_outcome_files(args['outcome_path'])
+    scaler = FleetScaler(
+        sqs=sqs,
+        queue_names=queue_names,
+        dead_queue_name=settings.get('sqs.dead_queue_name'),
+        target_sec=args['target_sec'],
+        min_executors=args['min_executors'],
+        max_executors=args['max_executors'],
+        batch_num=settings.get('migration.batch_num', 500),
+        max_receive_num=settings.get('sqs.max_receive_num', 10),
+        outcome_files=outcome_files,
+        window_sec=args['window_sec'],
+        throttle_ratio=args['throttle_ratio'],
+        including_dead=args['including_dead']
+    )
+    previous = load_state(args['state_file'], max_age=max(args['window_sec'], (args['watch'] or 0) * 3))
+    if previous is None:
+        logging.info('no recent sample, sample again in {} seconds'.format(args['sample_sec']))
+        previous = scaler.evaluate(scaler.sample(), executors=args['executors'])
+        time.sleep(args['sample_sec'])
+    while True:
+        result = scaler.evaluate(scaler.sample(), previous=previous, executors=args['executors'])
+        if args['state_file']:
+            save_json(result, args['state_file'])
+        logging.info('backlog {} messages, {} executors, desired {}{}'.format(
+            result['backlog'], result['executors'], result['desired_executors'],
+            ', bottleneck: ' + result['bottleneck'] if result['bottleneck'] else ''))
+        output = result
+        if args['format'] == 'metric':
+            output = make_metric_data(result, namespace=args['namespace'])
+        if args['output']:
+            save_json(output, args['output'])
+        else:
+            print(json.dumps(output), flush=True)
+        if not args['watch']:
+            break
+        previous = result
+        time.sleep(args['watch'])
+
+
+def run_status(args):
+    import sys
+    import json
+    import time
+    from s3_tools.migration.status import MigrationStatus, format_status
+    from s3_tools.queues import get_queue_backend
+    from s3_tools import settings
+    sqs = get_queue_backend(settings)
+    status = MigrationStatus(
+        sqs=sqs,
+        queue_names=get_queue_names(sqs, args['jobs']),
+        dead_queue_name=settings.get('sqs.dead_queue_name'),
+        batch_num=settings.get('migration.batch_num', 500),
+        checkpoint_file=args['checkpoint'],
+        outcome_files=get_outcome_files(args['outcome_path']),
+        window_sec=args['window_sec']
+    )
+    # refresh in place only in a terminal, append otherwise such as redirected to a file
+    in_place = args['watch'] and args['format'] == 'text' and sys.stdout.isatty()
+    while True:
+        result = status.refresh()
+        if args['format'] == 'json':
+            print(json.dumps(result), flush=True)
+        else:
+            print(('\x1b[H\x1b[J' if in_place else '') + format_status(result) + ('' if in_place else '\n'),
+                  flush=True)
+        if not args['watch']:
+            break
+        time.sleep(args['watch'])
+
+
+def run_cleanup(args):
+    from s3_tools.migration.cleanup import cleanup_uploads
+    from s3_tools.aws_utils.s3 import S3Resource
+    from s3_tools import settings
+    s3 = S3Resource(settings)
+    for bucket in args['buckets']:
+        summary = cleanup_uploads(s3, bucket, prefix=args['prefix'], older_than_sec=args['older_than'] * 3600,
+                                  dry_run=args['dry_run'])
+        logging.info('{}: {} uploads in progress, {} stale, {} aborted'.format(
+            bucket, summary['uploads'], summary['stale'], summary['aborted']))
+
+
+def run_restorer(args):
+    import signal
+    import threading
+    from s3_tools.migration.restore import Restorer, RestoreTracker
+    from s3_tools.migration.jobs import load_jobs
+    from s3_tools.queues import get_queue_backend
+    from s3_tools.aws_utils.s3 import S3Resource
     from s3_tools import settings
-    sqs = SqsResource(settings)
-    sqs.init_queues()
+    tracker = RestoreTracker(args['state_file'] or settings.get('migration.restore_state_file', 'restore.db'))
+    restorer = Restorer(
+        sqs=get_queue_backend(settings),
+        s3=S3Resource(settings),
+        tracker=tracker,
+        queue_name=settings.get('sqs.restore_queue_name'),
+        days=args['days'] or settings.get('migration.restore_days', 7),
+        tier=args['tier'] or settings.get('migration.restore_tier', 'Bulk'),
+        concurrency=args['concurrency'],
+        check_sec=args['check_sec'] or settings.get('migration.restore_check_sec', 1800),
+        batch_num=settings.get('migration.batch_num', 500),
+        queue_num=args['queue_num'],
+        jobs=load_jobs(settings),
+        report_sec=settings.get('migration.report_sec', 60)
+    )
+    stopping = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stopping.set())
+    try:
+        restorer.run(stopping)
+    except KeyboardInterrupt:
+        restorer.report()
+    finally:
+        tracker.close()
 
 
 def init_args(subparsers):
     parser = subparsers.add_parser('commander', help='S3 Migration Commander')
     commander_init_args(parser)
+    parser = subparsers.add_parser('plan', help='S3 Migration Planner')
+    planner_init_args(parser)
     parser = subparsers.add_parser('executor', help='S3 Migration Executor')
     executor_init_args(parser)
     parser = subparsers.add_parser('init', help='Initialize Migration Queues')
     initializer_init_args(parser)
+    parser = subparsers.add_parser('journal', help='Export or Merge Completion Journal')
+    journal_init_args(parser)
+    parser = subparsers.add_parser('report', help='Aggregate Executor Outcome Files')
+    report_init_args(parser)
+    parser = subparsers.add_parser('deadletter', help='Triage and Replay Dead-letter Queue')
+    deadletter_init_args(parser)
+    parser = subparsers.add_parser('scaler', help='Executors Needed by Queue Depth')
+    scaler_init_args(parser)
+    parser = subparsers.add_parser('status', help='Migration Progress and ETA')
+    status_init_args(parser)
+    parser = subparsers.add_parser('cleanup', help='Abort Stale Multipart Uploads')
+    cleanup_init_args(parser)
+    parser = subparsers.add_parser('restorer', help='Restore Archived Objects and Send Them to Copy')
+    restorer_init_args(parser)
 
 
 def parse_args(args: dict) -> dict:
-    common_args = ['log_level', 'log_file', 'config_file', 'env_file']
+    common_args = ['log_level', 'log_file', 'log_format', 'config_file', 'env_file']
     return dict([(k, v) for k, v in args.items() if k not in common_args])
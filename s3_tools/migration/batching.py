@@ -0,0 +1,167 @@
+"""
+Adaptive batch sizing for commander.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Executors already publish the processing time and size of every key in outcome files, the time of a message
+is the sum of its keys. BatchSizer fits the processing time of a key from recent outcome files as
+`seconds = per_key + size * per_byte` by least squares, and commander closes a message when the estimated time
+of its keys reaches target_ratio of sqs.visibility_timeout:
+- tiny objects get more keys per message (up to max_num), so SQS calls are amortized over more keys
+- large or slow objects get fewer keys per message, so messages finish before their visibility timeout
+- message bodies are kept under the SQS message size limit
+Until there is enough feedback, or without outcome files, messages have batch_num keys as before.
+Sums of outcome files are computed by numpy column operations, a plain python fallback if numpy is not installed.
+"""
+import os
+import math
+import time
+import logging
+# numpy as imported by outcomes, columns read are numpy arrays if it is installed
+from s3_tools.migration.outcomes import ACTION_FAILED, ACTION_RESTORING, read_outcomes, np
+
+# actions without any work for the key
+IGNORED_ACTIONS = (ACTION_FAILED, ACTION_RESTORING, 'journaled')
+# rows needed to fit the model
+MIN_ROWS = 100
+# SQS message size limit with room for bucket names and other fields
+MAX_MESSAGE_BYTES = 250000
+# JSON bytes of a key item besides the keys, {"source_key": "", "target_key": "", "size": , "etag": ""}
+KEY_ITEM_BYTES = 100
+
+
+def fit_sums(sums):
+    """
+    Least squares fit of latency by size from sums of rows.
+
+    :param sums: n, sum of size, sum of latency, sum of size squared, sum of size times latency
+    :return: seconds per key and seconds per byte, both not negative
+    :rtype: tuple
+    """
+    n, sx, sy, sxx, sxy = sums
+    denominator = n * sxx - sx * sx
+    per_byte = (n * sxy - sx * sy) / denominator if denominator > 0 else 0.0
+    per_byte = max(per_byte, 0.0)
+    per_key = max((sy - per_byte * sx) / n, 0.0)
+    return per_key, per_byte
+
+
+def file_sums(filename):
+    """
+    Sums of size and latency of rows of an outcome file for fitting, and time of its last row.
+
+    :return: sums (n, sum of size, sum of latency, sum of size squared, sum of size times latency),
+             and time of the last row, None if no rows
+    :rtype: tuple
+    """
+    header, c, _ = read_outcomes(filename)
+    if not header['rows']:
+        return (0.0, 0.0, 0.0, 0.0, 0.0), None
+    ignored = [i for i, action in enumerate(header['dicts']['action']) if action in IGNORED_ACTIONS]
+    if np is not None:
+        mask = ~np.isin(c['action'], ignored)
+        x = c['size'][mask].astype('f8')
+        y = c['latency'][mask].astype('f8')
+        sums = (float(mask.sum()), float(x.sum()), float(y.sum()), float(np.dot(x, x)), float(np.dot(x, y)))
+        return sums, float(c['time'].max())
+    n = sx = sy = sxx = sxy = 0.0
+    for latency, size, action in zip(c['latency'], c['size'], c['action']):
+        if action in ignored:
+            continue
+        latency, size = float(latency), float(size)
+        n += 1
+        sx += size
+        sy += latency
+        sxx += size * size
+        sxy += size * latency
+    return (n, sx, sy, sxx, sxy), float(max(c['time']))
+
+
+class BatchSizer:
+
+    def __init__(self, visibility_timeout: int, target_ratio: float=0.5, batch_num: int=500, max_num: int=5000,
+                 outcome_files=None, window_sec: int=1800):
+        """
+
+        :param visibility_timeout: seconds of sqs.visibility_timeout
+        :param target_ratio: estimated seconds of a message as a ratio of visibility timeout
+        :param batch_num: keys in a message until there is enough feedback
+        :param max_num: max keys in a message
+        :param outcome_files: function returning outcome file paths, feedback of executors
+        :param window_sec: outcome files with rows written in these seconds are used
+        """
+        self._target_sec = visibility_timeout * target_ratio
+        self._batch_num = batch_num
+        self._max_num = max_num
+        self._outcome_files = outcome_files
+        self._window_sec = window_sec
+        # outcome file path to (mtime, size, sums, time of last row)
+        self._sums = {}
+        # seconds per key and per byte, None until fitted, replaced as a whole so batch threads read it without lock
+        self._model = None
+
+    def update(self):
+        """
+        Fit the model again with outcome files written recently.
+        """
+        if not self._outcome_files:
+            return
+        now = time.time()
+        totals = [0.0] * 5
+        cached = {}
+        for filename in self._outcome_files():
+            try:
+                stat = os.stat(filename)
+                # a file is modified after its last row, but files downloaded from S3 are all modified recently
+                if stat.st_mtime < now - self._window_sec:
+                    continue
+                item = self._sums.get(filename)
+                if not item or item[:2] != (stat.st_mtime, stat.st_size):
+                    item = (stat.st_mtime, stat.st_size) + file_sums(filename)
+            except (OSError, ValueError) as e:
+                logging.warning('read outcome file {} failed: {}'.format(filename, e))
+                continue
+            cached[filename] = item
+            if item[3] is None or item[3] < now - self._window_sec:
+                continue
+            totals = [t + s for t, s in zip(totals, item[2])]
+        self._sums = cached
+        if totals[0] < MIN_ROWS:
+            return
+        model = fit_sums(totals)
+        self._model = model
+        logging.info('batch sizing: {:.3f} seconds per key, {:.1f} MB per second, {} keys of average size '
+                     'per message'.format(model[0], 1e-6 / model[1] if model[1] else float('inf'),
+                                          self.keys_for(totals[1] / totals[0])))
+
+    @property
+    def model(self):
+        return self._model
+
+    def cost(self, size) -> float:
+        """
+        Estimated seconds to process a key, 0 until the model is fitted.
+        """
+        model = self._model
+        if not model:
+            return 0.0
+        return model[0] + model[1] * (size or 0)
+
+    def full(self, keys: int, cost: float, body_bytes: int) -> bool:
+        """
+        Whether a message of keys with estimated seconds cost and body_bytes is full.
+        """
+        if body_bytes >= MAX_MESSAGE_BYTES or keys >= self._max_num:
+            return True
+        if not self._model:
+            return keys >= self._batch_num
+        return cost >= self._target_sec
+
+    def keys_for(self, size: float) -> int:
+        """
+        Keys of a given size in a full message, the message is closed by the key its estimated time reaches target.
+        """
+        cost = self.cost(size)
+        if not cost:
+            return self._max_num
+        return max(1, min(self._max_num, int(math.ceil(self._target_sec / cost))))
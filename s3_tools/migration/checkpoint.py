@@ -0,0 +1,123 @@
+"""
+Commander checkpoint.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Checkpoint is a JSON file of commander progress, so a commander restarted with the same checkpoint
+skips sources (such as inventory list files) all sent before:
+- a source is done when it is listed and all its messages are sent
+- messages, keys and bytes sent are counted, which is also the enqueued totals of the run
+- file is written atomically every save_sec and when the run finished
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+
+class CommanderCheckpoint:
+
+    def __init__(self, filename: str=None, save_sec: int=60, **identity):
+        """
+
+        :param filename: checkpoint file path, only counts in memory if not provided
+        :param save_sec: min seconds between two saves
+        :param identity: values to identify the run, such as buckets and batch number,
+                         raise ValueError if checkpoint exists with different values
+        """
+        self._filename = filename
+        self._save_sec = save_sec
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._listed = set()
+        self._saved_at = 0
+        self._data = {
+            'identity': identity,
+            'done_sources': [],
+            'messages': 0,
+            'keys': 0,
+            'bytes': 0,
+            'started_at': time.time(),
+            'updated_at': time.time(),
+            'finished': False
+        }
+        if filename and os.path.exists(filename):
+            with open(filename) as fp:
+                data = json.load(fp)
+            if data.get('identity') != identity:
+                raise ValueError('checkpoint {} is for a different run: {}'.format(filename, data.get('identity')))
+            self._data.update(data)
+            self._data['finished'] = False
+            logging.info('Resume from checkpoint {}, {} sources done'.format(filename, len(self._data['done_sources'])))
+        self._done = set(self._data['done_sources'])
+
+    def is_done(self, source) -> bool:
+        return source in self._done
+
+    def queued(self, source):
+        """
+        A message of source is created and waiting to be sent.
+        """
+        with self._lock:
+            self._pending[source] = self._pending.get(source, 0) + 1
+
+    def sent(self, source, keys: int, size: int):
+        """
+        A message of source is sent.
+
+        :param keys: key number in message
+        :param size: total bytes of keys in message
+        """
+        with self._lock:
+            self._pending[source] -= 1
+            self._data['messages'] += 1
+            self._data['keys'] += keys
+            self._data['bytes'] += size
+            self._check(source)
+
+    def listed(self, source):
+        """
+        All messages of source are created.
+        """
+        with self._lock:
+            self._listed.add(source)
+            self._check(source)
+
+    def _check(self, source):
+        if source in self._listed and not self._pending.get(source):
+            self._listed.discard(source)
+            self._pending.pop(source, None)
+            self._done.add(source)
+            self._data['done_sources'].append(source)
+
+    def save(self, force: bool=False, finished: bool=False):
+        if not self._filename or (not force and time.time() - self._saved_at < self._save_sec):
+            return
+        with self._lock:
+            self._data['updated_at'] = time.time()
+            self._data['finished'] = finished
+            content = json.dumps(self._data)
+        tmp_file = self._filename + '.tmp'
+        with open(tmp_file, 'w') as fp:
+            fp.write(content)
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(tmp_file, self._filename)
+        self._saved_at = time.time()
+
+    @property
+    def messages(self) -> int:
+        return self._data['messages']
+
+    @property
+    def keys(self) -> int:
+        return self._data['keys']
+
+    @property
+    def bytes(self) -> int:
+        return self._data['bytes']
+
+    @property
+    def done_sources(self) -> list:
+        return list(self._data['done_sources'])
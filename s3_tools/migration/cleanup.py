@@ -0,0 +1,42 @@
+"""
+Stale multipart upload cleanup.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Executors keep the multipart upload of a failed copy so the next attempt copies only missing parts,
+uploads never resumed (object deleted from the migration, executors stopped for good) are charged for their parts.
+Cleanup aborts in-progress uploads initiated before a time:
+- older_than should be longer than the time of a message being retried, such as several visibility timeouts
+- dry run only lists stale uploads
+"""
+import logging
+from datetime import datetime, timedelta, timezone
+
+
+def cleanup_uploads(s3, bucket: str, prefix: str=None, older_than_sec: float=7 * 86400, dry_run: bool=False,
+                    now: datetime=None) -> dict:
+    """
+    Abort multipart uploads of bucket initiated more than older_than_sec seconds ago.
+
+    :param s3: S3Resource
+    :param bucket: target bucket
+    :param prefix: only uploads of keys with this prefix
+    :param older_than_sec: min age of uploads to abort
+    :param dry_run: only count stale uploads
+    :param now: current time, for test
+    :return: uploads in progress, stale uploads and aborted uploads
+    :rtype: dict
+    """
+    before = (now or datetime.now(timezone.utc)) - timedelta(seconds=older_than_sec)
+    summary = {'bucket': bucket, 'uploads': 0, 'stale': 0, 'aborted': 0}
+    for upload in s3.list_multipart_uploads(bucket, prefix=prefix):
+        summary['uploads'] += 1
+        if upload['Initiated'] >= before:
+            continue
+        summary['stale'] += 1
+        logging.info('{} upload {} of {}/{} initiated at {}'.format(
+            'stale' if dry_run else 'abort', upload['UploadId'], bucket, upload['Key'], upload['Initiated']))
+        if not dry_run:
+            s3.client.abort_multipart_upload(Bucket=bucket, Key=upload['Key'], UploadId=upload['UploadId'])
+            summary['aborted'] += 1
+    return summary
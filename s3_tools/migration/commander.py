@@ -4,31 +4,247 @@ Commander package for s3 migration.
 :Author: wuwentao <wuwentao@patsnap.com>
 
 Commander is used to send migration tasks to SQS queues.
-Commander use a lister object to get S3 file list.
+Commander use a lister object to get S3 file list, listing, batching and sending run in parallel stages.
 - S3ObjectLister: use boto3 list objects API to get objects, easy to use for small buckets
 - S3InventoryLister: use S3 inventory files to get objects, helpful for large buckets
+- IncrementalLister: wrap another lister, only list objects added or changed since last run
+Objects out of last modified time window, size range or storage classes are filtered before batching.
+Listers started with a shard only list their part of the objects, see s3_tools.migration.sharding.
+Keys per message adapt to processing time of executors with migration.adaptive_batch, see s3_tools.migration.batching.
+Archived objects are sent to the restore queue with migration.restore_archived, see s3_tools.migration.restore.
 """
 import os
 import csv
 import logging
 import gzip
+import threading
 from urllib import parse
 from s3_tools import settings
 from s3_tools.aws_utils.s3 import split_s3_path, ManifestFile, S3Resource
-from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY
-from s3_tools.aws_utils.sqs import SqsResource
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY, \
+    SIZE_KEY, ETAG_KEY, ACTION_KEY, ACTION_DELETE, ACTION_RESTORE, JOB_KEY, STORAGE_CLASS_KEY, CHANGED_KEY
+from s3_tools.queues import get_queue_backend
+from s3_tools.migration.pipeline import Pipeline, Stage
+from s3_tools.migration.checkpoint import CommanderCheckpoint
+from s3_tools.migration.jobs import job_queue_name
+from s3_tools.migration.filters import RowFilter
+from s3_tools.migration.batching import BatchSizer, KEY_ITEM_BYTES
+from s3_tools.migration.restore import is_archived
+from s3_tools.migration.sharding import parse_shard, shard_name, owns_index, owns_unit, list_units, split_unit, \
+    UNIT_DIRECT
+from s3_tools.migration.snapshot import SnapshotStore, build_snapshot, diff_snapshots, CHANGE_ADDED, CHANGE_CHANGED, \
+    CHANGE_DELETED
 
 
 class Commander:
-    def __init__(self, lister):
+    def __init__(self, lister, plan=None, checkpoint=None, job=None, outcome_files=None):
+        """
+
+        :param lister: InventoryLister to list objects
+        :param dict plan: migration plan generated by MigrationPlanner, messages are sent to queues
+                          in plan, otherwise random pick queues
+        :param checkpoint: checkpoint file path, sources all sent before are skipped
+        :param job: Job of messages, messages are sent to queues of the job
+        :param outcome_files: function returning executor outcome file paths, to adapt keys per message
+                              if migration.adaptive_batch is enabled
+        """
         if not lister or not isinstance(lister, InventoryLister):
             raise ValueError('lister not supported')
         self._lister = lister
-        self._sqs = SqsResource(settings)
+        self._sqs = get_queue_backend(settings)
+        self._router = None
+        if plan:
+            from s3_tools.migration.planner import PlanRouter
+            self._router = PlanRouter(plan)
+        self._checkpoint_file = checkpoint
+        self._job = job
+        self._checkpoint = None
+        self._batcher = None
+        self._list_workers = settings.get('migration.list_workers', 4)
+        self._batch_workers = settings.get('migration.batch_workers', 2)
+        self._send_workers = settings.get('migration.send_workers', 8)
+        self._queue_size = settings.get('migration.stage_queue_size', 100)
+        self._report_sec = settings.get('migration.report_sec', 60)
+        self._sizer = None
+        if settings.get('migration.adaptive_batch', False):
+            if plan:
+                # plan routes messages by their index, messages must have batch_num keys as planned
+                logging.warning('adaptive batch is disabled with plan, {} keys per message'.format(lister.batch_num))
+            else:
+                self._sizer = BatchSizer(
+                    int(settings.get('sqs.visibility_timeout', 1800)),
+                    target_ratio=settings.get('migration.batch_target_ratio', 0.5),
+                    batch_num=lister.batch_num,
+                    max_num=settings.get('migration.batch_max_num', 5000),
+                    outcome_files=outcome_files,
+                    window_sec=settings.get('migration.batch_window_sec', 1800))
+        self._restore_queue = None
+        if settings.get('migration.restore_archived', False):
+            if plan:
+                # restore messages are not in plan, they would shift the queues of messages planned
+                logging.warning('restore archived is disabled with plan, archived objects are sent to copy')
+            else:
+                self._restore_queue = settings.get('sqs.restore_queue_name')
 
     def run(self, **kwargs):
-        for msg in self._lister.list_objects(**kwargs):
-            self._sqs.send_message(msg)
+        """
+        List, batch and send messages in three stages connected by bounded queues:
+        - list: list rows of sources in parallel, rows are put to batch stage in pages
+        - batch: filter rows and batch keys into messages, rows of a source are always batched by the same worker
+          so messages of the source are created in the same order
+        - send: send messages to queues
+        """
+        sources = self._lister.list_sources(**kwargs)
+        identity = dict(source_bucket=self._lister.source_bucket, target_bucket=self._lister.target_bucket,
+                        batch_num=self._lister.batch_num)
+        if self._job:
+            identity['job'] = self._job.name
+        if self._lister.row_filter:
+            identity['filter'] = self._lister.row_filter.spec
+        if self._lister.shard:
+            identity['shard'] = shard_name(self._lister.shard)
+        self._checkpoint = CommanderCheckpoint(self._checkpoint_file, save_sec=self._report_sec, **identity)
+        self._batcher = MessageBatcher(self._lister, sizer=self._sizer)
+        if self._sizer:
+            self._sizer.update()
+        sources = [s for s in sources if not self._checkpoint.is_done(s)]
+        logging.info('{} sources to list'.format(len(sources)))
+        stages = [
+            Stage('list', lambda source, emit: self.list_source(source, emit, **kwargs), self._list_workers),
+            Stage('batch', self.batch_rows, self._batch_workers, partition=lambda item: item[0]),
+            Stage('send', self.send_message, self._send_workers)
+        ]
+        pipeline = Pipeline(stages, queue_size=self._queue_size, report_sec=self._report_sec, reporter=self.report)
+        pipeline.run(sources)
+        pipeline.report()
+        self._lister.finish()
+        self._checkpoint.save(force=True, finished=True)
+
+    def list_source(self, source_index, emit, **kwargs):
+        rows = []
+        for row in self._lister.list_source_rows(source_index, **kwargs):
+            rows.append(row)
+            if len(rows) >= self._lister.batch_num:
+                emit((source_index, rows))
+                rows = []
+        if rows:
+            emit((source_index, rows))
+        # end of source
+        emit((source_index, None))
+
+    def batch_rows(self, item, emit):
+        source_index, rows = item
+        if rows is None:
+            for msg in self._batcher.flush(source_index):
+                self.emit_message(source_index, msg, emit)
+            self._checkpoint.listed(source_index)
+            return
+        for row in rows:
+            if not self._lister.accept(row):
+                continue
+            if self._restore_queue and not row.get(ACTION_KEY) and is_archived(row.get('StorageClass')):
+                row[ACTION_KEY] = ACTION_RESTORE
+            msg = self._batcher.add(source_index, row)
+            if msg:
+                self.emit_message(source_index, msg, emit)
+
+    def emit_message(self, source_index, msg, emit):
+        number = self._router.route(source_index) if self._router else None
+        if self._job:
+            msg[JOB_KEY] = self._job.name
+        self._checkpoint.queued(source_index)
+        emit((source_index, msg, number))
+
+    def send_message(self, item, emit):
+        source_index, msg, number = item
+        if msg.get(ACTION_KEY) == ACTION_RESTORE:
+            self._sqs.send_message(msg, queue_name=self._restore_queue)
+        elif self._job:
+            self._sqs.send_message(msg, queue_name=job_queue_name(self._job, number))
+        else:
+            self._sqs.send_message(msg, number=number)
+        keys = msg[KEYS_KEY]
+        self._checkpoint.sent(source_index, len(keys), sum(k.get(SIZE_KEY, 0) for k in keys))
+
+    def report(self):
+        logging.info('{}{} messages sent with {} keys, {} bytes'.format(
+            'shard {}: '.format(shard_name(self._lister.shard)) if self._lister.shard else '',
+            self._checkpoint.messages, self._checkpoint.keys, self._checkpoint.bytes))
+        row_filter = self._lister.row_filter
+        if row_filter and row_filter.rejected:
+            logging.info('objects filtered out: {}'.format(', '.join(
+                '{} by {}'.format(n, reason) for reason, n in sorted(row_filter.rejected.items()))))
+        if self._sizer:
+            self._sizer.update()
+        self._checkpoint.save()
+
+
+class MessageBatcher:
+
+    def __init__(self, lister, sizer=None):
+        """
+        Batch keys of rows into messages, keys of each source and action are batched separately.
+        Safe to be shared by batch workers, each source is batched by one worker but buffers are shared.
+
+        :param lister: InventoryLister to make messages
+        :param sizer: BatchSizer to close messages by estimated processing time, batch_num keys if not provided
+        """
+        self._lister = lister
+        self._sizer = sizer
+        self._lock = threading.Lock()
+        self._buffers = {}
+
+    def add(self, source_index, row):
+        """
+        Add key of row.
+
+        :param source_index: source index of row
+        :param dict row: object row, ACTION_KEY in row is set to the message
+        :return: message if batch_num keys batched or sizer says full, otherwise None
+        :rtype: dict
+        """
+        action = row.get(ACTION_KEY)
+        buffer_key = (source_index, action)
+        key = make_key(row)
+        cost = self._sizer.cost(key.get(SIZE_KEY)) if self._sizer else 0.0
+        with self._lock:
+            if self._sizer is None:
+                keys = self._buffers.setdefault(buffer_key, [])
+                keys.append(key)
+                full = len(keys) >= self._lister.batch_num
+            else:
+                # keys, estimated seconds and message bytes
+                buffer = self._buffers.setdefault(buffer_key, [[], 0.0, 0])
+                keys = buffer[0]
+                keys.append(key)
+                buffer[1] += cost
+                buffer[2] += len(key[SOURCE_KEY_KEY]) + len(key[TARGET_KEY_KEY]) + KEY_ITEM_BYTES
+                full = self._sizer.full(len(keys), buffer[1], buffer[2])
+            if full:
+                del self._buffers[buffer_key]
+        if full:
+            return self.make_message(keys, action)
+        return None
+
+    def flush(self, source_index):
+        """
+        Messages of keys left of source.
+
+        :return: list of messages
+        :rtype: list
+        """
+        with self._lock:
+            buffers = [(k, self._buffers.pop(k)) for k in list(self._buffers) if k[0] == source_index]
+        messages = []
+        for buffer_key, buffer in buffers:
+            keys = buffer if self._sizer is None else buffer[0]
+            messages.append(self.make_message(keys, buffer_key[1]))
+        return messages
+
+    def make_message(self, keys, action=None):
+        if action:
+            return self._lister.make_message(keys, **{ACTION_KEY: action})
+        return self._lister.make_message(keys)
 
 
 class InventoryLister:
@@ -37,6 +253,9 @@ class InventoryLister:
         super().__init__()
         self._source_bucket = source_bucket
         self._target_bucket = target_bucket
+        self._batch_num = settings.get('migration.batch_num', 500)
+        self._filter = RowFilter.from_args(kwargs)
+        self._shard = parse_shard(kwargs['shard']) if kwargs.get('shard') else None
 
     def list_objects(self, **kwargs):
         """
@@ -45,35 +264,236 @@ class InventoryLister:
         :return:
         :rtype: list
         """
+        for source_index, msg in self.list_batches(**kwargs):
+            yield msg
+
+    @property
+    def batch_num(self):
+        return self._batch_num
+
+    @property
+    def source_bucket(self):
+        return self._source_bucket
+
+    @property
+    def target_bucket(self):
+        return self._target_bucket
+
+    @property
+    def row_filter(self):
+        return self._filter
+
+    @property
+    def shard(self):
+        """
+        Shard of objects to list, None to list all objects.
+        """
+        return self._shard
+
+    def list_batches(self, **kwargs):
+        """
+        List messages with index of the source they come from, such as the file index in inventory manifest.
+        Messages of the same source are always generated in the same order.
+
+        :param kwargs:
+        :return: generator of (source index, message)
+        """
+        batcher = MessageBatcher(self)
+        for source_index in self.list_sources(**kwargs):
+            for row in self.list_source_rows(source_index, **kwargs):
+                if not self.accept(row):
+                    continue
+                msg = batcher.add(source_index, row)
+                if msg:
+                    yield source_index, msg
+            # send last keys
+            for msg in batcher.flush(source_index):
+                yield source_index, msg
+
+    def list_rows(self, **kwargs):
+        """
+        List objects with index of the source they come from, folders are excluded.
+
+        :param kwargs:
+        :return: generator of (source index, row), row is a dict with Key (url quoted), Size, LastModifiedDate,
+                 ETag and StorageClass if available
+        """
+        for source_index in self.list_sources(**kwargs):
+            for row in self.list_source_rows(source_index, **kwargs):
+                yield source_index, row
+
+    def list_sources(self, **kwargs):
+        """
+        Indexes of sources which can be listed in parallel, such as files in inventory manifest.
+
+        :param kwargs:
+        :return: list of source index
+        :rtype: list
+        """
+        return [0]
+
+    def list_source_rows(self, source_index, **kwargs):
+        """
+        List objects of a source, folders are excluded.
+
+        :param source_index: source index from list_sources
+        :param kwargs:
+        :return: generator of row
+        """
+        pass
+
+    def accept(self, row) -> bool:
+        """
+        Whether to send the object of row, by last modified time, size and storage class filters.
+        """
+        return self._filter is None or self._filter.accept(row)
+
+    def finish(self):
+        """
+        Called after all messages sent.
+        """
         pass
 
+    def make_message(self, keys, **kwargs):
+        msg = {
+            SOURCE_BUCKET_KEY: self._source_bucket,
+            TARGET_BUCKET_KEY: self._target_bucket,
+            KEYS_KEY: keys
+        }
+        if kwargs:
+            msg.update(kwargs)
+        return msg
+
+
+def make_key(row):
+    """
+    Key item in message of an object row.
+
+    :param dict row: object row
+    :return: key item
+    :rtype: dict
+    """
+    item = {SOURCE_KEY_KEY: row['Key'], TARGET_KEY_KEY: row['Key']}
+    if row.get('Size') not in (None, ''):
+        item[SIZE_KEY] = int(row['Size'])
+    if row.get('ETag'):
+        item[ETAG_KEY] = row['ETag'].strip('"')
+    if row.get(ACTION_KEY) == ACTION_RESTORE:
+        item[STORAGE_CLASS_KEY] = row['StorageClass']
+    if row.get(CHANGED_KEY):
+        item[CHANGED_KEY] = True
+    return item
+
 
 class S3ObjectLister(InventoryLister):
 
     def __init__(self, source_bucket: str, target_bucket: str, **kwargs):
         super().__init__(source_bucket, target_bucket, **kwargs)
-        self._batch_num = settings.get('migration.batch_num', 500)
         self._resource = S3Resource(settings, 'inventory')
 
-    def list_objects(self, **kwargs):
-        super().list_objects(**kwargs)
+    def list_sources(self, **kwargs):
+        """
+        One source of all objects, or keyspace units of the shard named by kind and prefix.
+        """
+        if not self._shard:
+            return [0]
+        units = list_units(self._resource, self._source_bucket, prefix=kwargs.get('prefix') or '',
+                           depth=kwargs.get('shard_depth') or 1)
+        sources = [unit for unit in units if owns_unit(self._shard, unit)]
+        logging.info('shard {} takes {} of {} prefixes'.format(shard_name(self._shard), len(sources), len(units)))
+        return sources
+
+    def list_source_rows(self, source_index, **kwargs):
         prefix = kwargs.get('prefix') or None
+        delimiter = None
+        if self._shard:
+            kind, prefix = split_unit(source_index)
+            if kind == UNIT_DIRECT:
+                delimiter = '/'
         owner = kwargs.get('owner') or None
         not_owner = kwargs.get('not_owner') or None
-        for keys in self._resource.list_objects_all(bucket=self._source_bucket, prefix=prefix, batch_num=self._batch_num):
+        for keys in self._resource.list_objects_all(bucket=self._source_bucket, prefix=prefix or None,
+                                                    batch_num=self._batch_num, delimiter=delimiter):
             if owner:
                 keys = [k for k in keys if k['Owner']['DisplayName'] == owner]
             if not_owner:
                 keys = [k for k in keys if k['Owner']['DisplayName'] != not_owner]
-            msg = {
-                SOURCE_BUCKET_KEY: self._source_bucket,
-                TARGET_BUCKET_KEY: self._target_bucket,
-                KEYS_KEY: [{
-                    SOURCE_KEY_KEY: parse.quote(k['Key']),
-                    TARGET_KEY_KEY: parse.quote(k['Key'])
-                } for k in keys if not k['Key'].endswith('/')]
-            }
-            yield msg
+            for k in keys:
+                if not k['Key'].endswith('/'):
+                    yield {
+                        'Key': parse.quote(k['Key']),
+                        'Size': k['Size'],
+                        'LastModifiedDate': k['LastModified'].isoformat(),
+                        'ETag': k['ETag'].strip('"'),
+                        'StorageClass': k.get('StorageClass')
+                    }
+
+
+class IncrementalLister(InventoryLister):
+
+    def __init__(self, lister: InventoryLister, snapshot_dir: str, sync_deletes: bool=False, **kwargs):
+        """
+
+        :param lister: lister to list all objects
+        :param snapshot_dir: directory to keep snapshots of objects listed by each run
+        :param sync_deletes: send delete tasks for objects disappeared since last run
+        """
+        super().__init__(lister.source_bucket, lister.target_bucket, **kwargs)
+        self._lister = lister
+        self._store = SnapshotStore(snapshot_dir)
+        self._sync_deletes = sync_deletes
+        self._new_snapshot = None
+
+    def list_sources(self, **kwargs):
+        """
+        Build snapshot of all objects, changes since last run are listed as one source.
+        """
+        self._new_snapshot = self._store.new_snapshot()
+        build_snapshot((row for _, row in self._lister.list_rows(**kwargs)), self._new_snapshot)
+        self._source_bucket = self._lister.source_bucket
+        return [0]
+
+    def list_source_rows(self, source_index, **kwargs):
+        """
+        Compare objects with snapshot of last run, deleted objects are listed with delete action.
+        """
+        old_snapshot = self._store.latest()
+        logging.info('Compare snapshot {} with {}'.format(self._new_snapshot, old_snapshot))
+        counts = {CHANGE_ADDED: 0, CHANGE_CHANGED: 0, CHANGE_DELETED: 0}
+        for change, row in diff_snapshots(old_snapshot, self._new_snapshot):
+            counts[change] += 1
+            if change == CHANGE_DELETED:
+                if not self._sync_deletes:
+                    continue
+                row[ACTION_KEY] = ACTION_DELETE
+            elif change == CHANGE_CHANGED:
+                # executors must not skip it by a journal record of the old version, inventory may have no ETag
+                row[CHANGED_KEY] = True
+            yield row
+        logging.info('{} objects added, {} changed, {} deleted since last run'
+                     .format(counts[CHANGE_ADDED], counts[CHANGE_CHANGED], counts[CHANGE_DELETED]))
+
+    def accept(self, row) -> bool:
+        """
+        Filters of the lister wrapped, deleted objects are always accepted.
+        """
+        if row.get(ACTION_KEY) == ACTION_DELETE:
+            return True
+        return self._lister.accept(row)
+
+    @property
+    def row_filter(self):
+        return self._lister.row_filter
+
+    @property
+    def shard(self):
+        return self._lister.shard
+
+    def finish(self):
+        """
+        Point LATEST snapshot to the snapshot of this run after all messages sent.
+        """
+        self._store.commit(self._new_snapshot)
 
 
 class S3InventoryLister(InventoryLister):
@@ -82,19 +502,33 @@ class S3InventoryLister(InventoryLister):
     def __init__(self, source_bucket: str, target_bucket: str, **kwargs):
         super().__init__(source_bucket, target_bucket, **kwargs)
         self._tmp_dir = settings.get('migration.tmp_dir', 'tmp')
-        self._batch_num = settings.get('migration.batch_num', 500)
         self._resource = S3Resource(settings, 'inventory')
+        self._manifest = None
 
-    def list_objects(self, **kwargs):
-        super().list_objects(**kwargs)
+    def list_sources(self, **kwargs):
+        """
+        Download manifest, each list file in manifest is a source.
+        """
         if 'manifest_path' not in kwargs:
             raise ValueError('manifest_path not provided')
         manifest_path = kwargs.get('manifest_path')
-        manifest = self.download_manifest(manifest_path)
+        self._manifest = self.download_manifest(manifest_path)
+        if self._filter:
+            self._filter.check_schema(self._manifest.file_schema or [])
         if not self._source_bucket:
-            self._source_bucket = manifest.source_bucket
-        for f in manifest.files:
-            yield from self.process_list_file(f, manifest.dest_bucket)
+            self._source_bucket = self._manifest.source_bucket
+        sources = list(range(len(self._manifest.files)))
+        if self._shard:
+            sources = [i for i in sources if owns_index(self._shard, i)]
+            logging.info('shard {} takes {} of {} list files'.format(shard_name(self._shard), len(sources),
+                                                                   len(self._manifest.files)))
+        return sources
+
+    def list_source_rows(self, source_index, **kwargs):
+        manifest = self._manifest
+        f = manifest.files[source_index]
+        for row in self.process_list_file(f, manifest.dest_bucket, manifest.file_schema):
+            yield row
 
     def download_manifest(self, manifest_path: str):
         if manifest_path.startswith('s3://'):
@@ -112,37 +546,30 @@ class S3InventoryLister(InventoryLister):
             local_file = manifest_path
         return ManifestFile(local_file)
 
-    def process_list_file(self, file_obj, inventory_bucket):
+    def process_list_file(self, file_obj, inventory_bucket, schema=None):
         list_file = self.download_list_file(file_obj, bucket=inventory_bucket)
         if list_file:
             logging.info('Process file {}'.format(list_file))
-            with open(list_file) as fp:
-                keys = []
-                reader = csv.reader(fp)
-                for line in reader:
-                    key = line[1].strip() if len(line) > 1 else ''
-                    if key and not key.endswith('/'):
-                        keys.append({SOURCE_KEY_KEY: key, TARGET_KEY_KEY: key})
-                        if len(keys) >= self._batch_num:
-                            msg = {
-                                SOURCE_BUCKET_KEY: self._source_bucket,
-                                TARGET_BUCKET_KEY: self._target_bucket,
-                                KEYS_KEY: keys
-                            }
-                            yield msg
-                            keys.clear()
-                # send last keys
-                if len(keys) > 0:
-                    msg = {
-                        SOURCE_BUCKET_KEY: self._source_bucket,
-                        TARGET_BUCKET_KEY: self._target_bucket,
-                        KEYS_KEY: keys
-                    }
-                    yield msg
-                    keys.clear()
+            for row in self.read_list_file(list_file, schema):
+                key = row.get('Key', '')
+                if key and not key.endswith('/'):
+                    yield row
         else:
             logging.error('Invalid file {}'.format(file_obj['key']))
 
+    def read_list_file(self, list_file, schema=None):
+        """
+        Read rows of inventory list file.
+
+        :param list_file: local csv list file
+        :param list schema: field names in manifest fileSchema, default Bucket and Key
+        :return: generator of dict with field names as keys
+        """
+        schema = schema or ['Bucket', 'Key']
+        with open(list_file) as fp:
+            for line in csv.reader(fp):
+                yield dict(zip(schema, [v.strip() for v in line]))
+
     def download_list_file(self, file_obj, bucket):
         res = self._resource.list_objects(bucket=bucket, prefix=file_obj['key'], max_keys=1)
         if 'Contents' in res and res['KeyCount'] == 1 \
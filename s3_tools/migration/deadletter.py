@@ -0,0 +1,259 @@
+"""
+Dead-letter queue triage.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Triage drains the dead-letter queue in rounds with parallel batch receives:
+- failed keys are grouped by error class (sent by executor with each failed key) and key prefix into a summary
+- keys of retryable error classes are re-packed into full batches and sent to main queues
+- keys of error classes to hold, such as AccessDenied, are written to a hold file and can be replayed later
+- originals are deleted by batches after their keys are sent or held, dry run only summarizes and releases them
+- keys of a job are sent back to queues of the job
+"""
+import json
+import logging
+import threading
+from urllib import parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, SIZE_KEY, ERROR_KEY, \
+    ACTION_KEY, JOB_KEY
+from s3_tools.migration.jobs import job_queue_name
+
+# error class of keys moved to dead-letter queue by redrive policy, without executor error
+ERROR_UNKNOWN = 'Unknown'
+TOP_PREFIXES = 20
+
+
+def key_prefix(key: str, depth: int=1) -> str:
+    """
+    First depth folders of a url quoted key, empty for keys in the root.
+    """
+    parts = urlparse.unquote(key).split('/')
+    if len(parts) <= 1 or depth <= 0:
+        return ''
+    return '/'.join(parts[:min(depth, len(parts) - 1)]) + '/'
+
+
+class DeadLetterTriage:
+
+    def __init__(self, sqs, batch_num: int=500, hold_errors=None, hold_file: str=None, prefix_depth: int=1,
+                 concurrency: int=10, round_size: int=1000, visibility_timeout: int=1800, queue_num: int=None,
+                 dry_run: bool=False, jobs=None):
+        """
+
+        :param sqs: QueueBackend
+        :param batch_num: keys number in one message sent to main queues
+        :param hold_errors: error classes not to retry
+        :param hold_file: JSON lines file to append messages of held keys
+        :param prefix_depth: folder depth of prefixes in summary
+        :param concurrency: threads to receive and send messages
+        :param round_size: messages received in one round, keys are re-packed and originals deleted each round
+        :param visibility_timeout: seconds messages received are invisible, should be longer than a round
+        :param queue_num: main queue to send retried keys, default random pick
+        :param dry_run: only summarize, messages are released at the end
+        :param dict jobs: job name to Job, keys of a job not registered are sent to main queues
+        """
+        if hold_errors and not hold_file and not dry_run:
+            raise ValueError('hold file not provided')
+        self._sqs = sqs
+        self._batch_num = batch_num
+        self._hold_errors = set(hold_errors or [])
+        self._hold_file = hold_file
+        self._prefix_depth = prefix_depth
+        self._concurrency = concurrency
+        self._round_size = round_size
+        self._visibility_timeout = visibility_timeout
+        self._queue_num = queue_num
+        self._dry_run = dry_run
+        self._jobs = jobs or {}
+        self._dead_queue_name = sqs.settings.get('sqs.dead_queue_name')
+        self._lock = threading.Lock()
+        self._summary = {'messages': 0, 'keys': 0, 'bytes': 0, 'retried_keys': 0, 'retried_messages': 0,
+                         'held_keys': 0, 'errors': {}}
+
+    def run(self) -> dict:
+        """
+        Drain dead-letter queue.
+
+        :return: summary
+        :rtype: dict
+        """
+        received = []
+        while True:
+            messages, queue_url = self.receive_round()
+            if not messages:
+                break
+            retries, holds = self.triage(messages)
+            if self._dry_run:
+                received.extend(messages)
+                continue
+            self.send(retries)
+            self.hold(holds)
+            failed = self._sqs.delete_message_batch(queue_url, [m['ReceiptHandle'] for m in messages])
+            if failed:
+                logging.warning('{} messages not deleted, their keys will be received again'.format(len(failed)))
+            logging.info('{} messages triaged, {} keys retried, {} keys held'.format(
+                self._summary['messages'], self._summary['retried_keys'], self._summary['held_keys']))
+        if received:
+            queue_url = self._sqs.get_queue_url(self._dead_queue_name)
+            for m in received:
+                self._sqs.change_message_visibility(queue_url, m['ReceiptHandle'], 0)
+        return self.summary
+
+    def receive_round(self):
+        """
+        Receive up to round_size messages by parallel batch receives, until dead-letter queue is empty.
+
+        :return: messages and queue url
+        :rtype: tuple
+        """
+        messages = []
+        urls = []
+
+        def receive():
+            empty = 0
+            while empty < 2:
+                with self._lock:
+                    if len(messages) >= self._round_size:
+                        return
+                batch, url = self._sqs.receive_message(queue_name=self._dead_queue_name, max_num=10,
+                                                       WaitTimeSeconds=1, VisibilityTimeout=self._visibility_timeout)
+                empty = 0 if batch else empty + 1
+                with self._lock:
+                    messages.extend(batch)
+                    urls.append(url)
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+            for f in [pool.submit(receive) for _ in range(self._concurrency)]:
+                f.result()
+        return messages, urls[0] if urls else None
+
+    def triage(self, messages):
+        """
+        Summarize keys of messages and re-pack them into retry and hold batches.
+
+        :param messages: SQS messages
+        :return: messages to retry and messages to hold
+        :rtype: tuple
+        """
+        buffers = {}
+        retries = []
+        holds = []
+        errors = self._summary['errors']
+        for message in messages:
+            body = json.loads(message['Body'])
+            self._summary['messages'] += 1
+            for key in body[KEYS_KEY]:
+                error = key.get(ERROR_KEY) or ERROR_UNKNOWN
+                size = key.get(SIZE_KEY, 0)
+                item = errors.setdefault(error, {'keys': 0, 'bytes': 0, 'prefixes': {}})
+                item['keys'] += 1
+                item['bytes'] += size
+                prefix = key_prefix(key[SOURCE_KEY_KEY], self._prefix_depth)
+                item['prefixes'][prefix] = item['prefixes'].get(prefix, 0) + 1
+                self._summary['keys'] += 1
+                self._summary['bytes'] += size
+                held = error in self._hold_errors
+                if held:
+                    self._summary['held_keys'] += 1
+                else:
+                    self._summary['retried_keys'] += 1
+                    key = dict((k, v) for k, v in key.items() if k != ERROR_KEY)
+                group = (held, body[SOURCE_BUCKET_KEY], body[TARGET_BUCKET_KEY], body.get(ACTION_KEY),
+                         body.get(JOB_KEY))
+                keys = buffers.setdefault(group, [])
+                keys.append(key)
+                if len(keys) >= self._batch_num:
+                    (holds if held else retries).append(make_message(group, keys))
+                    buffers[group] = []
+        for group, keys in buffers.items():
+            if keys:
+                (holds if group[0] else retries).append(make_message(group, keys))
+        self._summary['retried_messages'] += len(retries)
+        return retries, holds
+
+    def send(self, messages):
+        if not messages:
+            return
+        with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+            list(pool.map(lambda m: self._sqs.send_message(
+                m, queue_name=queue_name_of(self._sqs, m, self._queue_num, self._jobs)), messages))
+
+    def hold(self, messages):
+        if not messages:
+            return
+        with open(self._hold_file, 'a') as fp:
+            for m in messages:
+                fp.write(json.dumps(m) + '\n')
+
+    @property
+    def summary(self) -> dict:
+        summary = dict(self._summary)
+        summary['errors'] = {}
+        for error, item in sorted(self._summary['errors'].items(), key=lambda e: -e[1]['keys']):
+            prefixes = sorted(item['prefixes'].items(), key=lambda p: -p[1])[:TOP_PREFIXES]
+            summary['errors'][error] = {
+                'keys': item['keys'],
+                'bytes': item['bytes'],
+                'retry': error not in self._hold_errors,
+                'top_prefixes': dict(prefixes)
+            }
+        return summary
+
+
+def make_message(group, keys):
+    _, source_bucket, target_bucket, action, job = group
+    msg = {SOURCE_BUCKET_KEY: source_bucket, TARGET_BUCKET_KEY: target_bucket, KEYS_KEY: keys}
+    if action:
+        msg[ACTION_KEY] = action
+    if job:
+        msg[JOB_KEY] = job
+    return msg
+
+
+def queue_name_of(sqs, msg: dict, queue_num: int=None, jobs: dict=None) -> str:
+    """
+    Queue to send a message, a queue of its job, or a main queue if it has no job registered.
+    """
+    job = (jobs or {}).get(msg.get(JOB_KEY))
+    if job:
+        return job_queue_name(job, queue_num)
+    return sqs.get_queue_name(queue_num)
+
+
+def replay_held(sqs, hold_file: str, queue_num: int=None, jobs: dict=None, batch_size: int=10) -> int:
+    """
+    Send messages in hold file to main queues by batches, error classes of keys are removed.
+
+    :param sqs: QueueBackend
+    :param hold_file: hold file written by triage
+    :param queue_num: main queue to send, default random pick
+    :param jobs: job name to Job, keys of a job are sent to queues of the job
+    :param batch_size: messages sent to a queue in one batch
+    :return: keys number sent
+    :rtype: int
+    """
+    count = 0
+    batches = {}
+
+    def send(batch):
+        failed = sqs.send_message_batch(batch, queue_name=queue_name_of(sqs, batch[0], queue_num, jobs))
+        if failed:
+            logging.warning('{} messages failed to send, replay the hold file again'.format(len(failed)))
+        return sum(len(m[KEYS_KEY]) for m in batch) - sum(len(m[KEYS_KEY]) for m in failed)
+
+    with open(hold_file) as fp:
+        for line in fp:
+            if not line.strip():
+                continue
+            msg = json.loads(line)
+            msg[KEYS_KEY] = [dict((k, v) for k, v in key.items() if k != ERROR_KEY) for key in msg[KEYS_KEY]]
+            batch = batches.setdefault(msg.get(JOB_KEY), [])
+            batch.append(msg)
+            if len(batch) >= batch_size:
+                count += send(batch)
+                batches[msg.get(JOB_KEY)] = []
+    for batch in batches.values():
+        if batch:
+            count += send(batch)
+    return count
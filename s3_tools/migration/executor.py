@@ -7,73 +7,269 @@ Executor is used to get migration tasks from SQS queues and execute object migra
 There are three methods now:
 - copy: copy objects using boto3 copy or copy_object API, should check permission (bucket policy) first.
 - downup: copy objects using download objects and then upload, do not use bucket policy.
+- auto: copy or download then upload for each object, by copy permission of the bucket pair and throughput
+  measured by object size class, objects failed to copy with AccessDenied fall back to download then upload.
+Objects failed with InvalidObjectState (archived) are sent to the restore queue with migration.restore_archived.
 """
-import os
 import json
+import time
+import signal
 import logging
+import threading
 from urllib import parse as urlparse
 from queue import Queue
-from dateutil.parser import parse
+from collections import namedtuple
 from s3_tools import settings
-from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY
-from s3_tools.aws_utils.sqs import SqsResource
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY, \
+    ETAG_KEY, SIZE_KEY, ERROR_KEY, ACTION_KEY, ACTION_DELETE, ACTION_RESTORE, JOB_KEY, CHANGED_KEY
+from s3_tools.queues import get_queue_backend
 from s3_tools.aws_utils.s3 import S3Resource
+from s3_tools.migration.scheduler import QueueScheduler, JobScheduler
+from s3_tools.migration.jobs import load_jobs, job_queue_names
+from s3_tools.migration.heartbeat import VisibilityHeartbeat
+from s3_tools.migration.journal import CompletionJournal
+from s3_tools.migration.staging import StagingManager
+from s3_tools.migration.outcomes import OutcomeWriter, ACTION_FAILED, ACTION_RESTORING, error_class
+from s3_tools.migration.modes import ModeSelector, PATH_COPY, PATH_DOWNUP, is_denied
+from s3_tools.migration.restore import ARCHIVED_ERROR
+from s3_tools.migration.filters import iso_second, modified_reason
+
+
+ACTION_COPIED = 'copied'
+ACTION_SKIPPED = 'skipped'
+ACTION_TAGGED = 'tagged'
+ACTION_NOT_MODIFIED = 'not_modified'
+ACTION_MISSING = 'missing'
+ACTION_JOURNALED = 'journaled'
+ACTION_DELETED = 'deleted'
+ACTION_CHECKED = 'checked'
+# actions mean target object is same as source object
+DONE_ACTIONS = (ACTION_COPIED, ACTION_SKIPPED, ACTION_TAGGED)
+
+Outcome = namedtuple('Outcome', ['action', 'source'])
+
+# max object size for copy_object API
+MAX_COPY_SIZE = 5000000000
+# additional checksums returned by head_object with ChecksumMode enabled
+CHECKSUM_FIELDS = ['ChecksumCRC64NVME', 'ChecksumCRC32', 'ChecksumCRC32C', 'ChecksumSHA1', 'ChecksumSHA256']
 
 
 class Executor:
 
     def __init__(self, queue_num=None, including_dead=False, mode='copy', verify=False, sleep_sec=5,
-                 modified_since=None, not_modified_since=None, **kwargs):
+                 modified_since=None, not_modified_since=None, schedule='random', journal_file=None, outcome_dir=None,
+                 jobs=None, **kwargs):
         self._num = queue_num
         self._including_dead = including_dead
         self._mode = mode
         self._verify = verify
         self._sleep_sec = sleep_sec
-        self._modified_since = parse(modified_since) if modified_since else None
-        self._not_modified_since = parse(not_modified_since) if not_modified_since else None
+        # UTC ISO strings compared as commander filters do
+        self._modified_since = iso_second(modified_since) if modified_since else None
+        self._not_modified_since = iso_second(not_modified_since) if not_modified_since else None
         self._fails = Queue()
-        self._sqs = SqsResource(settings)
+        self._restores = Queue()
+        self._restore_queue = None
+        if settings.get('migration.restore_archived', False):
+            self._restore_queue = settings.get('sqs.restore_queue_name')
+        self._sqs = get_queue_backend(settings)
         self._s3 = S3Resource(settings)
+        self._stopping = threading.Event()
+        self._staging = StagingManager(
+            tmp_dir=settings.get('migration.tmp_dir', 'tmp'),
+            quota=settings.get('migration.staging_quota', 0),
+            min_free=settings.get('migration.staging_min_free', 0),
+            timeout=settings.get('migration.staging_timeout', 600)
+        )
+        self._callback = None
+        # resume multipart uploads left by a killed executor instead of starting over
+        self._resume = settings.get('migration.resume_multipart', True)
+        self._journal = None
+        journal_file = journal_file or settings.get('migration.journal_file', None)
+        if journal_file and mode != 'check':
+            self._journal = CompletionJournal(journal_file, settings.get('migration.journal_max_entries', 10000000))
+        self._outcomes = None
+        outcome_dir = outcome_dir or settings.get('migration.outcome_dir', None)
+        if outcome_dir:
+            self._outcomes = OutcomeWriter(
+                directory=outcome_dir,
+                rotate_rows=settings.get('migration.outcome_rotate_rows', 100000),
+                rotate_sec=settings.get('migration.outcome_rotate_sec', 300),
+                s3_path=settings.get('migration.outcome_s3_path', None),
+                s3_resource=self._s3
+            )
+        self._selector = None
+        if mode == 'auto':
+            self._selector = ModeSelector(
+                cache_file=settings.get('migration.mode_cache_file', None),
+                cache_sec=settings.get('migration.mode_cache_sec', 86400),
+                explore_every=settings.get('migration.mode_explore_every', 100)
+            )
+        self._report_sec = settings.get('migration.report_sec', 60)
+        self._scheduler = None
+        self._jobs = None
+        if jobs:
+            registry = load_jobs(settings)
+            names = sorted(registry) if jobs == ['all'] else jobs
+            for name in names:
+                if name not in registry:
+                    raise ValueError('job {} not registered in config'.format(name))
+            self._jobs = [registry[name] for name in names]
+            self._scheduler = JobScheduler(
+                sqs=self._sqs,
+                jobs=self._jobs,
+                queue_names=dict([(job.name, job_queue_names(job)) for job in self._jobs]),
+                dead_queue_name=settings.get('sqs.dead_queue_name') if including_dead else None,
+                dead_weight=settings.get('sqs.dead_queue_weight', 0.1),
+                sample_sec=settings.get('sqs.depth_sample_sec', 30)
+            )
+        elif schedule == 'depth':
+            self._scheduler = QueueScheduler(
+                sqs=self._sqs,
+                queue_names=self._sqs.get_queue_names(number=queue_num, including_dead=including_dead),
+                dead_queue_name=settings.get('sqs.dead_queue_name'),
+                sample_sec=settings.get('sqs.depth_sample_sec', 30),
+                dead_weight=settings.get('sqs.dead_queue_weight', 0.1)
+            )
 
-    def process_message(self, message: dict):
+    def process_message(self, message: dict, queue_url: str=None) -> bool:
         """
         Process each message from SQS.
 
+        Visibility of the message is extended while keys are processed if queue_url is provided,
+        keys not yet done are handed off to the same queue if executor is stopping.
+
         :param dict message:
-        :return:
+        :param str queue_url: queue url which the message received from
+        :return: False if message has been handed off, otherwise message should be deleted
+        :rtype: bool
         """
         body = json.loads(message['Body'])
         source_bucket = body[SOURCE_BUCKET_KEY]
         target_bucket = body[TARGET_BUCKET_KEY]
         keys = body[KEYS_KEY]
-        logging.info('Receive {} keys from message'.format(len(keys)))
+        logging.info('Receive %s keys from message', len(keys), extra={'event': 'receive'})
+        # journal records without ETag only match keys of a message received again, not sent again by a re-run
+        redelivered = self._sqs.is_redelivered(message, queue_url)
         methods = {
             'copy': self.copy,
             'downup': self.downup,
+            'auto': self.copy,
             'check': self.check
         }
-        for key in keys:
-            try:
-                param = {
-                    'source_bucket': source_bucket,
-                    'target_bucket': target_bucket,
-                    'source_key': urlparse.unquote(key[SOURCE_KEY_KEY]),
-                    'target_key': urlparse.unquote(key[TARGET_KEY_KEY])
-                }
-                method = methods[self._mode]
-                method(**param)
-            except Exception as e:
-                logging.warning(e, exc_info=True)
-                logging.warning('Send to dead-letter queue')
-                self._fails.put(key)
-        self.resend_fails(source_bucket, target_bucket)
+        if body.get(ACTION_KEY) == ACTION_DELETE:
+            methods = {
+                'copy': self.delete,
+                'downup': self.delete,
+                'auto': self.delete,
+                'check': self.check_deleted
+            }
+        heartbeat = None
+        if queue_url and 'ReceiptHandle' in message:
+            heartbeat = VisibilityHeartbeat(
+                sqs=self._sqs,
+                queue_url=queue_url,
+                receipt_handle=message['ReceiptHandle'],
+                body=body,
+                visibility_timeout=int(settings.get('sqs.visibility_timeout', 1800)),
+                deadline_sec=settings.get('sqs.message_deadline_sec', None),
+                stopping=self._stopping
+            )
+            self._callback = heartbeat.progress
+            heartbeat.start()
+        try:
+            for index, key in enumerate(keys):
+                if heartbeat and not heartbeat.begin():
+                    logging.info('message handed off, stop processing')
+                    break
+                start = time.time()
+                try:
+                    param = {
+                        'source_bucket': source_bucket,
+                        'target_bucket': target_bucket,
+                        'source_key': urlparse.unquote(key[SOURCE_KEY_KEY]),
+                        'target_key': urlparse.unquote(key[TARGET_KEY_KEY])
+                    }
+                    if self._journal and body.get(ACTION_KEY) != ACTION_DELETE \
+                            and self._journal.contains(etag=key.get(ETAG_KEY), size=key.get(SIZE_KEY),
+                                                       any_version=redelivered and not key.get(CHANGED_KEY),
+                                                       **param):
+                        logging.info('object %s/%s in journal, skip', source_bucket, param['source_key'],
+                                     extra={'event': ACTION_JOURNALED})
+                        outcome = Outcome(ACTION_JOURNALED, None)
+                    else:
+                        method = methods[self._mode]
+                        outcome = method(**param)
+                        if self._journal and isinstance(outcome, Outcome):
+                            self.journal_outcome(outcome, **param)
+                    self.record_outcome(key, outcome, time.time() - start, source_bucket, message_keys=len(keys))
+                except Exception as e:
+                    error = error_class(e)
+                    if error == ARCHIVED_ERROR and self._restore_queue and body.get(ACTION_KEY) != ACTION_DELETE:
+                        logging.info('object %s/%s is archived, send to restore queue', source_bucket,
+                                     key[SOURCE_KEY_KEY], extra={'event': ACTION_RESTORING})
+                        self._restores.put(key)
+                        self.record_outcome(key, Outcome(ACTION_RESTORING, None), time.time() - start, source_bucket,
+                                            message_keys=len(keys))
+                    else:
+                        logging.warning(e, exc_info=True)
+                        logging.warning('Send to dead-letter queue')
+                        self._fails.put(dict(key, **{ERROR_KEY: error}))
+                        self.record_outcome(key, Outcome(ACTION_FAILED, None), time.time() - start, source_bucket,
+                                            error=error, message_keys=len(keys))
+                if heartbeat:
+                    heartbeat.done(index)
+            self.resend_fails(source_bucket, target_bucket, action=body.get(ACTION_KEY), job=body.get(JOB_KEY))
+        finally:
+            self._callback = None
+            if heartbeat:
+                heartbeat.stop()
+        return not (heartbeat and heartbeat.handed_off)
+
+    def journal_outcome(self, outcome, **kwargs):
+        """
+        Record key migrated successfully in journal, remove key deleted from journal.
+
+        :param Outcome outcome: outcome of the key
+        :param kwargs:
+        """
+        if outcome.action == ACTION_DELETED:
+            self._journal.remove(**kwargs)
+        elif outcome.action in DONE_ACTIONS and outcome.source:
+            self._journal.record(etag=outcome.source.get('ETag'), size=outcome.source.get('ContentLength'), **kwargs)
+
+    def record_outcome(self, key: dict, outcome, latency: float, source_bucket: str, error: str=None,
+                       message_keys: int=0):
+        """
+        Record outcome of a key to outcome files.
+
+        :param dict key: key item in message
+        :param outcome: Outcome of the key, check mode returns True instead
+        :param latency: seconds to process the key
+        :param source_bucket: source bucket
+        :param error: error class if failed
+        :param message_keys: keys in the message of the key, to count messages processed
+        """
+        if not self._outcomes:
+            return
+        if isinstance(outcome, Outcome):
+            action = outcome.action
+            size = outcome.source['ContentLength'] if outcome.source else key.get(SIZE_KEY, 0)
+        else:
+            action = ACTION_CHECKED
+            size = key.get(SIZE_KEY, 0)
+        self._outcomes.record(bucket=source_bucket, key=urlparse.unquote(key[SOURCE_KEY_KEY]), action=action,
+                              size=size, latency=latency, error=error, message_keys=message_keys)
 
-    def resend_fails(self, source_bucket: str, target_bucket: str):
+    def resend_fails(self, source_bucket: str, target_bucket: str, action: str=None, job: str=None):
         """
-        Send fail keys to dead-letter queue.
+        Send fail keys to dead-letter queue, each key has the error class it failed with,
+        and archived keys to restore queue.
 
         :param source_bucket:
         :param target_bucket:
+        :param action: action of the message, such as delete
+        :param job: job of the message
         :return:
         """
         keys = []
@@ -81,127 +277,237 @@ class Executor:
             keys.append(self._fails.get())
         if keys:
             msg = {SOURCE_BUCKET_KEY: source_bucket, TARGET_BUCKET_KEY: target_bucket, KEYS_KEY: keys}
+            if action:
+                msg[ACTION_KEY] = action
+            if job:
+                msg[JOB_KEY] = job
             self._sqs.send_message(msg, to_dead=True)
+        keys = []
+        while not self._restores.empty():
+            keys.append(self._restores.get())
+        if keys:
+            msg = {SOURCE_BUCKET_KEY: source_bucket, TARGET_BUCKET_KEY: target_bucket, KEYS_KEY: keys,
+                   ACTION_KEY: ACTION_RESTORE}
+            if job:
+                msg[JOB_KEY] = job
+            self._sqs.send_message(msg, queue_name=self._restore_queue)
 
     def copy(self, **kwargs):
         """
         copy mode
 
         :param kwargs:
-        :return:
+        :return: action taken and source object info
+        :rtype: Outcome
         """
         if self._verify:
-            max_copy_size = 5000000000
             source = self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
             target = self.get_object_info(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'))
             if not source:
-                logging.warning('source object {}/{} not exists!'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
-                return
-            size = source['ContentLength']
+                logging.warning('source object %s/%s not exists!', kwargs.get('source_bucket'),
+                                kwargs.get('source_key'), extra={'event': ACTION_MISSING})
+                return Outcome(ACTION_MISSING, None)
             if self.verify_object(source, target) and self.verify_metadata(source, target):
                 if self.verify_tags(source, target):
-                    logging.info('object {}/{} exactly same, skip'
-                                 .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s exactly same, skip', kwargs.get('source_bucket'),
+                                 kwargs.get('source_key'), extra={'event': ACTION_SKIPPED})
+                    return Outcome(ACTION_SKIPPED, source)
                 else:
                     self._s3.put_object_tagging(
                         bucket=kwargs.get('target_bucket'),
                         key=kwargs.get('target_key'),
                         tagging=source['TagSet']
                     )
-                    logging.info('object {}/{} copy tags'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s copy tags', kwargs.get('source_bucket'), kwargs.get('source_key'),
+                                 extra={'event': ACTION_TAGGED})
+                    return Outcome(ACTION_TAGGED, source)
             else:
                 if self.verify_modified(source, self._modified_since, self._not_modified_since):
-                    if size < max_copy_size:
-                        self._s3.copy_object(**kwargs)
-                    else:
-                        self._s3.copy(**kwargs)
-                    logging.info('copy object {}/{} successfully'
-                                 .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    self.transfer(source, **kwargs)
+                    logging.info('copy object %s/%s successfully', kwargs.get('source_bucket'),
+                                 kwargs.get('source_key'), extra={'event': ACTION_COPIED})
+                    return Outcome(ACTION_COPIED, source)
                 else:
-                    logging.info('object {}/{} mismatch but do not copy because do not pass last modified'
-                                 .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s mismatch but do not copy because do not pass last modified',
+                                 kwargs.get('source_bucket'), kwargs.get('source_key'),
+                                 extra={'event': ACTION_NOT_MODIFIED})
+                    return Outcome(ACTION_NOT_MODIFIED, source)
         else:
             source = self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
             if not source:
-                logging.warning('source object {}/{} not exists!'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
-                return
+                logging.warning('source object %s/%s not exists!', kwargs.get('source_bucket'),
+                                kwargs.get('source_key'), extra={'event': ACTION_MISSING})
+                return Outcome(ACTION_MISSING, None)
             if self.verify_modified(source, self._modified_since, self._not_modified_since):
-                self._s3.copy(**kwargs)
-                logging.info('copy object {}/{} successfully'
-                             .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                self.transfer(source, **kwargs)
+                logging.info('copy object %s/%s successfully', kwargs.get('source_bucket'), kwargs.get('source_key'),
+                             extra={'event': ACTION_COPIED})
+                return Outcome(ACTION_COPIED, source)
             else:
-                logging.info('object {}/{} do not copy because do not pass last modified'
-                             .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                logging.info('object %s/%s do not copy because do not pass last modified', kwargs.get('source_bucket'),
+                             kwargs.get('source_key'), extra={'event': ACTION_NOT_MODIFIED})
+                return Outcome(ACTION_NOT_MODIFIED, source)
+
+    def transfer(self, source, **kwargs):
+        """
+        Transfer object by server-side copy, or by the path selected for the object in auto mode.
+
+        :param source: source object info
+        :param kwargs:
+        """
+        if not self._selector:
+            self.copy_data(source, **kwargs)
+            return
+        source_bucket, target_bucket = kwargs.get('source_bucket'), kwargs.get('target_bucket')
+        size = source['ContentLength']
+        path = self._selector.choose(source_bucket, target_bucket, size)
+        start = time.time()
+        if path == PATH_COPY:
+            try:
+                self.copy_data(source, **kwargs)
+            except Exception as e:
+                if not is_denied(e):
+                    raise
+                logging.info('copy object %s/%s denied, fall back to download then upload', source_bucket,
+                             kwargs.get('source_key'))
+                self._selector.denied(source_bucket, target_bucket, size)
+                path = PATH_DOWNUP
+                start = time.time()
+                self.download_then_upload(source, **kwargs)
+        else:
+            self.download_then_upload(source, **kwargs)
+        self._selector.succeeded(source_bucket, target_bucket, path, size, time.time() - start)
+
+    def copy_data(self, source, **kwargs):
+        """
+        Copy object in server side, keep part layout of multipart uploaded source so the ETag is the same.
+
+        :param source: source object info
+        :param kwargs:
+        """
+        part_sizes = self.get_part_sizes(source, bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
+        if part_sizes:
+            p = self.get_object_args(source)
+            p.update(kwargs)
+            self._s3.multipart_copy(part_sizes=part_sizes, callback=self._callback, source_etag=source['ETag'],
+                                    resume=self._resume, **p)
+        elif source['ContentLength'] < MAX_COPY_SIZE:
+            self._s3.copy_object(**kwargs)
+        else:
+            self._s3.copy(Callback=self._callback, **kwargs)
 
     def download_then_upload(self, source, **kwargs):
-        filename = self._s3.download_object(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
-        with open(filename, 'rb') as fp:
-            p = {
-                'bucket': kwargs.get('target_bucket'),
-                'key': kwargs.get('target_key'),
-                'body': fp
-            }
-            if 'CacheControl' in source:
-                p['CacheControl'] = source['CacheControl']
-            if 'ContentDisposition' in source:
-                p['ContentDisposition'] = source['ContentDisposition']
-            if 'ContentEncoding' in source:
-                p['ContentEncoding'] = source['ContentEncoding']
-            if 'ContentLanguage' in source:
-                p['ContentLanguage'] = source['ContentLanguage']
-            if 'ContentType' in source:
-                p['ContentType'] = source['ContentType']
-            if 'Metadata' in source and source['Metadata']:
-                p['Metadata'] = source['Metadata']
-            if 'TagSet' in source and source['TagSet']:
-                p['Tagging'] = urlparse.urlencode(dict([(item['Key'], item['Value']) for item in source['TagSet']]))
-            self._s3.put_object(**p)
-        os.unlink(filename)
-        logging.info('download and upload object {}/{} successfully'
-                     .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+        size = source['ContentLength']
+        with self._staging.stage(size) as filename:
+            self._s3.download_ranges(
+                bucket=kwargs.get('source_bucket'),
+                key=kwargs.get('source_key'),
+                filename=filename,
+                size=size,
+                part_size=settings.get('migration.download_part_size', 8388608),
+                concurrency=settings.get('migration.download_concurrency', 10),
+                callback=self._callback,
+                IfMatch=source['ETag']
+            )
+            p = self.get_object_args(source)
+            part_sizes = self.get_part_sizes(source, bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
+            if part_sizes:
+                self._s3.multipart_upload(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'),
+                                          filename=filename, part_sizes=part_sizes, callback=self._callback,
+                                          source_etag=source['ETag'], resume=self._resume, **p)
+            else:
+                self._s3.put_file(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'), filename=filename,
+                                  **p)
+        logging.info('download and upload object %s/%s successfully', kwargs.get('source_bucket'),
+                     kwargs.get('source_key'), extra={'event': ACTION_COPIED})
+
+    def get_object_args(self, source) -> dict:
+        """
+        Arguments to put source object's metadata and tags to target object.
+
+        :param source: source object info
+        :return: arguments for put_object or create_multipart_upload
+        :rtype: dict
+        """
+        p = {}
+        if 'CacheControl' in source:
+            p['CacheControl'] = source['CacheControl']
+        if 'ContentDisposition' in source:
+            p['ContentDisposition'] = source['ContentDisposition']
+        if 'ContentEncoding' in source:
+            p['ContentEncoding'] = source['ContentEncoding']
+        if 'ContentLanguage' in source:
+            p['ContentLanguage'] = source['ContentLanguage']
+        if 'ContentType' in source:
+            p['ContentType'] = source['ContentType']
+        if 'Metadata' in source and source['Metadata']:
+            p['Metadata'] = source['Metadata']
+        if 'TagSet' in source and source['TagSet']:
+            p['Tagging'] = urlparse.urlencode(dict([(item['Key'], item['Value']) for item in source['TagSet']]))
+        return p
+
+    def get_part_sizes(self, source, bucket: str, key: str) -> list:
+        """
+        Part sizes of source object, only heads parts if ETag shows it is uploaded by multipart upload.
+
+        :return: part sizes, empty if source is not uploaded by multipart upload
+        :rtype: list
+        """
+        if '-' not in source.get('ETag', ''):
+            return []
+        return self._s3.get_part_sizes(bucket=bucket, key=key)
 
     def downup(self, **kwargs):
         """
         downup mode
 
         :param kwargs:
-        :return:
+        :return: action taken and source object info
+        :rtype: Outcome
         """
         if self._verify:
             source = self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
             target = self.get_object_info(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'))
             if not source:
-                logging.warning(
-                    'source object {}/{} not exists!'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
-                return
+                logging.warning('source object %s/%s not exists!', kwargs.get('source_bucket'),
+                                kwargs.get('source_key'), extra={'event': ACTION_MISSING})
+                return Outcome(ACTION_MISSING, None)
             if self.verify_object(source, target) and self.verify_metadata(source, target):
                 if self.verify_tags(source, target):
-                    logging.info('object {}/{} exactly same, skip'
-                                 .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s exactly same, skip', kwargs.get('source_bucket'),
+                                 kwargs.get('source_key'), extra={'event': ACTION_SKIPPED})
+                    return Outcome(ACTION_SKIPPED, source)
                 else:
                     self._s3.put_object_tagging(
                         bucket=kwargs.get('target_bucket'),
                         key=kwargs.get('target_key'),
                         tagging=source['TagSet']
                     )
-                    logging.info('object {}/{} copy tags'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s copy tags', kwargs.get('source_bucket'), kwargs.get('source_key'),
+                                 extra={'event': ACTION_TAGGED})
+                    return Outcome(ACTION_TAGGED, source)
             else:
                 if self.verify_modified(source, self._modified_since, self._not_modified_since):
                     self.download_then_upload(source, **kwargs)
+                    return Outcome(ACTION_COPIED, source)
                 else:
-                    logging.info('object {}/{} mismatch but do not copy because do not pass last modified'
-                                 .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                    logging.info('object %s/%s mismatch but do not copy because do not pass last modified',
+                                 kwargs.get('source_bucket'), kwargs.get('source_key'),
+                                 extra={'event': ACTION_NOT_MODIFIED})
+                    return Outcome(ACTION_NOT_MODIFIED, source)
         else:
             source = self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
             if not source:
-                logging.warning(
-                    'source object {}/{} not exists!'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
-                return
+                logging.warning('source object %s/%s not exists!', kwargs.get('source_bucket'),
+                                kwargs.get('source_key'), extra={'event': ACTION_MISSING})
+                return Outcome(ACTION_MISSING, None)
             if self.verify_modified(source, self._modified_since, self._not_modified_since):
                 self.download_then_upload(source, **kwargs)
+                return Outcome(ACTION_COPIED, source)
             else:
-                logging.info('object {}/{} do not copy because do not pass last modified'
-                             .format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+                logging.info('object %s/%s do not copy because do not pass last modified', kwargs.get('source_bucket'),
+                             kwargs.get('source_key'), extra={'event': ACTION_NOT_MODIFIED})
+                return Outcome(ACTION_NOT_MODIFIED, source)
 
     def check(self, **kwargs):
         """
@@ -213,16 +519,62 @@ class Executor:
         source = self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key'))
         target = self.get_object_info(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'))
         if not source:
-            logging.warning(
-                'source object {}/{} not exists!'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
+            logging.warning('source object %s/%s not exists!', kwargs.get('source_bucket'), kwargs.get('source_key'),
+                            extra={'event': ACTION_MISSING})
             return True
         if self.verify_object(source, target) and self.verify_metadata(source, target) and self.verify_tags(source, target):
             return True
         raise ValueError('object {}/{} mismatch'.format(kwargs.get('source_bucket'), kwargs.get('source_key')))
 
-    def verify_object(self, source_obj, target_obj) -> bool:
-        if source_obj and target_obj and source_obj['ETag'] == target_obj['ETag']:
+    def delete(self, **kwargs):
+        """
+        delete target object of an object deleted from source since last incremental run
+
+        :param kwargs:
+        :return: action taken
+        :rtype: Outcome
+        """
+        if self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key')):
+            logging.info('source object %s/%s exists, do not delete', kwargs.get('source_bucket'),
+                         kwargs.get('source_key'), extra={'event': ACTION_SKIPPED})
+            return Outcome(ACTION_SKIPPED, None)
+        self._s3.delete_object(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key'))
+        logging.info('delete object %s/%s successfully', kwargs.get('target_bucket'), kwargs.get('target_key'),
+                     extra={'event': ACTION_DELETED})
+        return Outcome(ACTION_DELETED, None)
+
+    def check_deleted(self, **kwargs):
+        """
+        check mode of delete task
+
+        :param kwargs:
+        :return:
+        """
+        if self.get_object_info(bucket=kwargs.get('source_bucket'), key=kwargs.get('source_key')):
+            return True
+        if self.get_object_info(bucket=kwargs.get('target_bucket'), key=kwargs.get('target_key')):
+            raise ValueError('object {}/{} not deleted'.format(kwargs.get('target_bucket'), kwargs.get('target_key')))
+        return True
+
+    @staticmethod
+    def verify_object(source_obj, target_obj) -> bool:
+        """
+        Verify object content by ETag, fall back to size and additional checksum because ETag of
+        multipart uploaded objects depends on the part layout.
+
+        Only the first checksum both objects have is compared. Checksums of multipart uploaded objects
+        are composite of part checksums, so they depend on the part layout too: a target copied in
+        another layout without a full object checksum is reported as mismatched and copied again.
+        """
+        if not source_obj or not target_obj:
+            return False
+        if source_obj['ETag'] == target_obj['ETag']:
             return True
+        if source_obj.get('ContentLength') != target_obj.get('ContentLength'):
+            return False
+        for field in CHECKSUM_FIELDS:
+            if field in source_obj and field in target_obj:
+                return source_obj[field] == target_obj[field]
         return False
 
     def verify_metadata(self, source_obj, target_obj) -> bool:
@@ -238,18 +590,18 @@ class Executor:
             return True
         return False
 
-    def verify_modified(self, source_obj, modified_since=None, not_modified_since=None) -> bool:
-        if modified_since:
-            last_modified = source_obj['LastModified'].replace(tzinfo=None)
-            if last_modified >= modified_since:
-                return True
-            return False
-        if not_modified_since:
-            last_modified = source_obj['LastModified'].replace(tzinfo=None)
-            if last_modified < not_modified_since:
-                return True
-            return False
-        return True
+    @staticmethod
+    def verify_modified(source_obj, modified_since=None, not_modified_since=None) -> bool:
+        """
+        Whether source object is in the last modified time window, both bounds apply as commander filters.
+
+        :param source_obj: head of source object
+        :param modified_since: UTC ISO string to the second, see s3_tools.migration.filters.iso_second
+        :param not_modified_since: UTC ISO string to the second
+        """
+        if not modified_since and not not_modified_since:
+            return True
+        return modified_reason(iso_second(source_obj['LastModified']), modified_since, not_modified_since) is None
 
     def get_object_info(self, bucket: str, key: str):
         """
@@ -260,18 +612,44 @@ class Executor:
         :rtype: dict
         """
         try:
-            obj = self._s3.head_object(bucket=bucket, key=key)
+            obj = self._s3.head_object(bucket=bucket, key=key, ChecksumMode='ENABLED')
             tags = self._s3.get_object_tagging(bucket=bucket, key=key)
             obj['TagSet'] = tags['TagSet']
             return obj
         except Exception as e:
             return None
 
+    def shutdown(self, *args):
+        """
+        Stop receiving messages, keys after the one in progress are handed off by heartbeat.
+        """
+        logging.info('executor is stopping')
+        self._stopping.set()
+
     def run(self):
-        for message, queue_url in self._sqs.receive_message_loop(number=self._num, include_dead=self._including_dead,
-                                                                 sleep_sec=self._sleep_sec):
-            try:
-                self.process_message(message)
-                self._sqs.delete_message(queue_url=queue_url, receipt_handle=message['ReceiptHandle'])
-            except Exception as e:
-                logging.error(e, exc_info=True)
+        signal.signal(signal.SIGTERM, self.shutdown)
+        reported_at = time.time()
+        try:
+            for message, queue_url in self._sqs.receive_message_loop(number=self._num,
+                                                                     include_dead=self._including_dead,
+                                                                     sleep_sec=self._sleep_sec,
+                                                                     scheduler=self._scheduler,
+                                                                     stopping=self._stopping):
+                start = time.time()
+                try:
+                    if self.process_message(message, queue_url=queue_url):
+                        self._sqs.delete_message(queue_url=queue_url, receipt_handle=message['ReceiptHandle'])
+                except Exception as e:
+                    logging.error(e, exc_info=True)
+                if self._jobs:
+                    self._scheduler.charge(queue_url.rsplit('/', 1)[-1], time.time() - start)
+                if self._selector and time.time() - reported_at >= self._report_sec:
+                    self._selector.log_report()
+                    reported_at = time.time()
+                if self._stopping.is_set():
+                    break
+        finally:
+            if self._selector:
+                self._selector.log_report()
+            if self._outcomes:
+                self._outcomes.close()
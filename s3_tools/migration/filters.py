@@ -0,0 +1,175 @@
+"""
+Object row filters for commander.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+RowFilter evaluates object rows listed by a lister (inventory list file columns or ListObjectsV2 fields),
+so objects out of the filters are never sent to queues and executors do not call any API for them:
+- last modified time window: modified since (inclusive) and not modified since (exclusive),
+  executors check objects by the same modified_reason
+- size range: min size and max size in bytes, both inclusive
+- storage classes to include
+Rows without a field, such as inventory without the LastModifiedDate column, pass the filter on that field.
+Last modified times of S3 are in UTC, they are compared as ISO strings without being parsed.
+"""
+import threading
+from datetime import timezone
+from dateutil.parser import parse
+
+FILTER_MODIFIED = 'modified_since'
+FILTER_NOT_MODIFIED = 'not_modified_since'
+FILTER_SIZE = 'size'
+FILTER_STORAGE_CLASS = 'storage_class'
+# ISO time to the second, 2019-01-01T00:00:00
+ISO_SECOND_LENGTH = 19
+
+
+class RowFilter:
+
+    def __init__(self, modified_since=None, not_modified_since=None, min_size: int=None, max_size: int=None,
+                 storage_classes=None):
+        """
+
+        :param modified_since: accept objects modified at or after this time, UTC if no timezone
+        :param not_modified_since: accept objects modified before this time, UTC if no timezone
+        :param min_size: accept objects not smaller than min_size bytes
+        :param max_size: accept objects not larger than max_size bytes
+        :param storage_classes: accept objects of these storage classes
+        """
+        self._modified_since = iso_second(modified_since) if modified_since else None
+        self._not_modified_since = iso_second(not_modified_since) if not_modified_since else None
+        self._min_size = min_size
+        self._max_size = max_size
+        self._storage_classes = set(storage_classes) if storage_classes else None
+        self._rejected = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_args(cls, args: dict):
+        """
+        Filter of commander arguments, None if no filter is specified.
+        """
+        row_filter = cls(
+            modified_since=args.get('modified_since'),
+            not_modified_since=args.get('not_modified_since'),
+            min_size=args.get('min_size'),
+            max_size=args.get('max_size'),
+            storage_classes=args.get('storage_class')
+        )
+        return row_filter if row_filter.fields else None
+
+    @property
+    def fields(self) -> list:
+        """
+        Row fields the filter evaluates.
+        """
+        fields = []
+        if self._modified_since or self._not_modified_since:
+            fields.append('LastModifiedDate')
+        if self._min_size is not None or self._max_size is not None:
+            fields.append('Size')
+        if self._storage_classes:
+            fields.append('StorageClass')
+        return fields
+
+    @property
+    def spec(self) -> dict:
+        """
+        Filters specified, such as identity of commander checkpoint.
+        """
+        spec = {
+            FILTER_MODIFIED: self._modified_since,
+            FILTER_NOT_MODIFIED: self._not_modified_since,
+            'min_size': self._min_size,
+            'max_size': self._max_size,
+            FILTER_STORAGE_CLASS: sorted(self._storage_classes) if self._storage_classes else None
+        }
+        return dict((k, v) for k, v in spec.items() if v is not None)
+
+    def check_schema(self, schema):
+        """
+        Raise ValueError if fields evaluated are not in inventory schema.
+
+        :param list schema: field names of inventory list files
+        """
+        missing = [f for f in self.fields if f not in schema]
+        if missing:
+            raise ValueError('inventory has no {} field to filter objects, add them to inventory optional fields'
+                             .format(', '.join(missing)))
+
+    def accept(self, row: dict) -> bool:
+        reason = self.reject_reason(row)
+        if reason is None:
+            return True
+        with self._lock:
+            self._rejected[reason] = self._rejected.get(reason, 0) + 1
+        return False
+
+    def reject_reason(self, row: dict):
+        """
+        Name of the first filter rejecting row, None if row is accepted.
+        """
+        if self._modified_since or self._not_modified_since:
+            value = row.get('LastModifiedDate')
+            if value:
+                reason = modified_reason(row_time(value), self._modified_since, self._not_modified_since)
+                if reason:
+                    return reason
+        if self._min_size is not None or self._max_size is not None:
+            value = row.get('Size')
+            if value not in (None, ''):
+                size = int(value)
+                if self._min_size is not None and size < self._min_size \
+                        or self._max_size is not None and size > self._max_size:
+                    return FILTER_SIZE
+        if self._storage_classes:
+            value = row.get('StorageClass')
+            if value and value not in self._storage_classes:
+                return FILTER_STORAGE_CLASS
+        return None
+
+    @property
+    def rejected(self) -> dict:
+        """
+        Rows rejected by each filter.
+        """
+        with self._lock:
+            return dict(self._rejected)
+
+
+def modified_reason(modified: str, modified_since: str=None, not_modified_since: str=None):
+    """
+    Name of the last modified filter rejecting an object, None if accepted.
+
+    :param modified: last modified time of the object, UTC ISO string to the second
+    :param modified_since: accept objects modified at or after this time, UTC ISO string to the second
+    :param not_modified_since: accept objects modified before this time, UTC ISO string to the second
+    """
+    if modified_since and modified < modified_since:
+        return FILTER_MODIFIED
+    if not_modified_since and modified >= not_modified_since:
+        return FILTER_NOT_MODIFIED
+    return None
+
+
+def iso_second(value) -> str:
+    """
+    UTC time to the second as ISO string.
+
+    :param value: datetime or time string, UTC if no timezone
+    :rtype: str
+    """
+    if isinstance(value, str):
+        value = parse(value)
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value.strftime('%Y-%m-%dT%H:%M:%S')
+
+
+def row_time(value: str) -> str:
+    """
+    Last modified time of a row as ISO string to the second, rows in UTC (Z or +00:00) are not parsed.
+    """
+    if value.endswith('Z') or value.endswith('+00:00'):
+        return value[:ISO_SECOND_LENGTH]
+    return iso_second(value)
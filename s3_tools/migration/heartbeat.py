@@ -0,0 +1,137 @@
+"""
+Visibility heartbeat for in-flight messages.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Heartbeat extends the visibility timeout of a message while the executor is still making
+progress on it, so SQS does not redeliver a message with huge objects to another executor.
+If the executor must give up, heartbeat hands off the message: keys not yet done are
+re-enqueued to the same queue and the original is deleted. On shutdown the executor finishes
+the key in progress and hands off the keys after it, before a deadline it will miss the
+heartbeat thread hands off at once.
+"""
+import time
+import logging
+import threading
+from s3_tools.migration import KEYS_KEY
+
+# SQS does not allow to extend visibility beyond 12 hours since the message is received
+MAX_VISIBILITY_SEC = 43200
+
+
+class VisibilityHeartbeat(threading.Thread):
+
+    def __init__(self, sqs, queue_url: str, receipt_handle: str, body: dict, visibility_timeout: int=1800,
+                 deadline_sec: int=None, stall_sec: int=None, stopping: threading.Event=None):
+        """
+
+        :param sqs: queue resource
+        :param queue_url: queue url which the message received from
+        :param receipt_handle: receipt handle of the message
+        :param body: message body
+        :param visibility_timeout: seconds to extend visibility for each beat
+        :param deadline_sec: seconds since received to hand off the message, default 12 hours limit of SQS
+        :param stall_sec: stop extending if no progress for these seconds, default visibility_timeout
+        :param stopping: event set when executor is shutting down, checked by begin() before next key
+        """
+        super().__init__(daemon=True)
+        self._sqs = sqs
+        self._queue_url = queue_url
+        self._receipt_handle = receipt_handle
+        self._body = body
+        self._keys = body[KEYS_KEY]
+        self._visibility_timeout = visibility_timeout
+        self._deadline_sec = min(deadline_sec or MAX_VISIBILITY_SEC, MAX_VISIBILITY_SEC)
+        self._stall_sec = stall_sec or visibility_timeout
+        self._interval = max(visibility_timeout // 3, 1)
+        self._stopping = stopping or threading.Event()
+        self._finished = threading.Event()
+        self._lock = threading.Lock()
+        self._received_at = time.time()
+        self._visible_at = self._received_at + visibility_timeout
+        self._progress_at = self._received_at
+        self._done = set()
+        self._handed_off = False
+        self._stalled = False
+
+    def run(self):
+        while not self._finished.wait(1) and not self._handed_off:
+            try:
+                self.beat()
+            except Exception as e:
+                logging.warning('heartbeat failed: {}'.format(e))
+
+    def beat(self):
+        now = time.time()
+        if now + self._visibility_timeout - self._received_at > self._deadline_sec:
+            logging.info('message will miss the deadline, hand off message')
+            self.handoff()
+            return
+        if now - self._progress_at > self._stall_sec:
+            if not self._stalled:
+                self._stalled = True
+                logging.warning('no progress for {} seconds, stop extending visibility'
+                                .format(int(now - self._progress_at)))
+            return
+        self._stalled = False
+        if self._visible_at - now <= self._interval * 2:
+            self._sqs.change_message_visibility(self._queue_url, self._receipt_handle, self._visibility_timeout)
+            self._visible_at = now + self._visibility_timeout
+            logging.info('extend message visibility for {} seconds'.format(self._visibility_timeout))
+
+    def begin(self) -> bool:
+        """
+        Mark next key is being processed, hand off the message instead if executor is stopping.
+
+        :return: False if message has been handed off and key should not be processed
+        :rtype: bool
+        """
+        if self._stopping.is_set():
+            logging.info('executor is stopping, hand off message')
+            self.handoff()
+            return False
+        with self._lock:
+            if self._handed_off:
+                return False
+            self._progress_at = time.time()
+            return True
+
+    def done(self, index: int):
+        """
+        Mark key at index is done, failed keys are also done since they are sent to dead-letter queue.
+
+        :param index: key index in message
+        """
+        with self._lock:
+            self._done.add(index)
+            self._progress_at = time.time()
+
+    def progress(self, *args):
+        """
+        Record progress, can be used as boto3 transfer callback.
+        """
+        self._progress_at = time.time()
+
+    def handoff(self):
+        """
+        Re-enqueue keys not yet done to the same queue and delete original message.
+        """
+        with self._lock:
+            if self._handed_off:
+                return
+            self._handed_off = True
+            keys = [k for i, k in enumerate(self._keys) if i not in self._done]
+        if keys:
+            msg = dict(self._body)
+            msg[KEYS_KEY] = keys
+            queue_name = self._queue_url[self._queue_url.rindex('/') + 1:]
+            self._sqs.send_message(msg, queue_name=queue_name)
+        self._sqs.delete_message(queue_url=self._queue_url, receipt_handle=self._receipt_handle)
+        logging.info('hand off {} keys of {}'.format(len(keys), len(self._keys)))
+
+    def stop(self):
+        self._finished.set()
+
+    @property
+    def handed_off(self) -> bool:
+        return self._handed_off
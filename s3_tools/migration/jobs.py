@@ -0,0 +1,72 @@
+"""
+Job registry for migrations sharing one executor fleet.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Each job is a migration (usually a bucket pair) registered in `jobs` of config:
+- messages of a job carry the job name and are sent to queues of the job, named by the job name
+  and sqs.queue_name_pattern unless the job has its own queue_name_pattern
+- weight is the share of executor time a job gets while several jobs have messages
+- max_in_flight limits messages of a job in processing across the fleet, 0 for no limit
+"""
+import re
+import random
+from collections import namedtuple
+
+Job = namedtuple('Job', ['name', 'weight', 'max_in_flight', 'queue_name_pattern', 'queue_num'])
+
+# job name is a part of queue names
+JOB_NAME_PATTERN = re.compile(r'^[A-Za-z0-9_-]{1,40}$')
+
+
+def load_jobs(settings) -> dict:
+    """
+    Jobs registered in config.
+
+    :param settings: settings with jobs, sqs.queue_name_pattern and sqs.queue_num
+    :return: job name to Job
+    :rtype: dict
+    """
+    jobs = {}
+    for name, conf in (settings.get('jobs', None) or {}).items():
+        name = str(name)
+        if not JOB_NAME_PATTERN.match(name):
+            raise ValueError('invalid job name {}, only letters, digits, - and _ are allowed'.format(name))
+        conf = conf or {}
+        weight = float(conf.get('weight', 1))
+        if weight <= 0:
+            raise ValueError('weight of job {} should be positive'.format(name))
+        jobs[name] = Job(
+            name=name,
+            weight=weight,
+            max_in_flight=int(conf.get('max_in_flight', 0)),
+            queue_name_pattern=conf.get('queue_name_pattern') or '{}-{}'.format(
+                name, settings.get('sqs.queue_name_pattern')),
+            queue_num=int(conf.get('queue_num') or settings.get('sqs.queue_num'))
+        )
+    return jobs
+
+
+def get_job(settings, name: str) -> Job:
+    jobs = load_jobs(settings)
+    if name not in jobs:
+        raise ValueError('job {} not registered in config'.format(name))
+    return jobs[name]
+
+
+def job_queue_name(job: Job, number: int=None) -> str:
+    """
+    Queue name of a job.
+
+    :param job:
+    :param number: queue number, None for random pick
+    :return: queue name
+    :rtype: str
+    """
+    if not number:
+        number = random.randint(1, job.queue_num)
+    return job.queue_name_pattern.format(number)
+
+
+def job_queue_names(job: Job) -> list:
+    return [job.queue_name_pattern.format(i) for i in range(1, job.queue_num + 1)]
@@ -0,0 +1,152 @@
+"""
+Completion journal for executors.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Journal records keys migrated successfully in a local SQLite database, so keys redelivered
+by SQS, replayed from dead-letter queue or sent again by a re-run are skipped without any API call.
+- crash safe: SQLite WAL mode, every record is committed
+- versioned: ETag and size of the source are recorded, a key of another ETag or size does not match,
+  a key without ETag only matches when the caller accepts any version of it, executors accept it
+  only for messages redelivered or from dead-letter queue
+- size bound: oldest records are evicted when more than max_entries records
+- export/merge: JSON lines file to move journals across nodes
+"""
+import json
+import sqlite3
+import logging
+
+
+class CompletionJournal:
+    EVICT_EVERY = 1000
+
+    def __init__(self, filename: str, max_entries: int=10000000):
+        """
+
+        :param filename: SQLite database file path
+        :param max_entries: max records to keep, 0 for no limit
+        """
+        self._filename = filename
+        self._max_entries = max_entries
+        self._inserts = 0
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS completions ('
+                           'seq INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'source_bucket TEXT NOT NULL, '
+                           'source_key TEXT NOT NULL, '
+                           'target_bucket TEXT NOT NULL, '
+                           'target_key TEXT NOT NULL, '
+                           'etag TEXT, '
+                           'size INTEGER)')
+        self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS completions_key ON completions '
+                           '(source_bucket, source_key, target_bucket, target_key)')
+        self._conn.commit()
+
+    def contains(self, source_bucket: str, source_key: str, target_bucket: str, target_key: str,
+                 etag: str=None, size: int=None, any_version: bool=False) -> bool:
+        """
+        Check if key has been migrated.
+
+        :param etag: source ETag if known, record with different ETag does not match
+        :param size: source size if known, record with different size does not match
+        :param any_version: match a record of the key when ETag is unknown, only if the caller knows the key
+                            is not changed since recorded, such as a message redelivered
+        :return: True if key has been migrated
+        :rtype: bool
+        """
+        row = self._conn.execute('SELECT etag, size FROM completions WHERE source_bucket=? AND source_key=? '
+                                 'AND target_bucket=? AND target_key=?',
+                                 (source_bucket, source_key, target_bucket, target_key)).fetchone()
+        if not row:
+            return False
+        if size is not None and row[1] is not None and int(size) != row[1]:
+            return False
+        if etag and row[0]:
+            return normalize_etag(etag) == row[0]
+        return any_version
+
+    def record(self, source_bucket: str, source_key: str, target_bucket: str, target_key: str, etag: str=None,
+               size: int=None):
+        """
+        Record key has been migrated.
+        """
+        self._conn.execute('INSERT OR REPLACE INTO completions '
+                           '(source_bucket, source_key, target_bucket, target_key, etag, size) '
+                           'VALUES (?, ?, ?, ?, ?, ?)',
+                           (source_bucket, source_key, target_bucket, target_key, normalize_etag(etag), size))
+        self._conn.commit()
+        self._inserts += 1
+        if self._inserts % self.EVICT_EVERY == 0:
+            self.evict()
+
+    def remove(self, source_bucket: str, source_key: str, target_bucket: str, target_key: str):
+        """
+        Remove record of a key, such as target object deleted.
+        """
+        self._conn.execute('DELETE FROM completions WHERE source_bucket=? AND source_key=? '
+                           'AND target_bucket=? AND target_key=?',
+                           (source_bucket, source_key, target_bucket, target_key))
+        self._conn.commit()
+
+    def evict(self):
+        """
+        Delete oldest records if more than max_entries records.
+        """
+        if not self._max_entries:
+            return
+        cur = self._conn.execute('DELETE FROM completions WHERE seq <= '
+                                 '(SELECT MAX(seq) FROM completions) - ?', (self._max_entries,))
+        self._conn.commit()
+        if cur.rowcount:
+            logging.info('evict {} records from journal {}'.format(cur.rowcount, self._filename))
+
+    def export(self, filename: str) -> int:
+        """
+        Export records to a JSON lines file, oldest first.
+
+        :param filename: output file path
+        :return: exported record number
+        :rtype: int
+        """
+        count = 0
+        with open(filename, 'w') as fp:
+            for row in self._conn.execute('SELECT source_bucket, source_key, target_bucket, target_key, etag, '
+                                          'size FROM completions ORDER BY seq'):
+                fp.write(json.dumps(dict(zip(JOURNAL_FIELDS, row))) + '\n')
+                count += 1
+        return count
+
+    def merge(self, filename: str) -> int:
+        """
+        Merge records from a JSON lines file exported by another journal.
+
+        :param filename: exported file path
+        :return: merged record number
+        :rtype: int
+        """
+        count = 0
+        with open(filename) as fp:
+            rows = (json.loads(line) for line in fp if line.strip())
+            for row in rows:
+                self._conn.execute('INSERT OR REPLACE INTO completions '
+                                   '(source_bucket, source_key, target_bucket, target_key, etag, size) '
+                                   'VALUES (?, ?, ?, ?, ?, ?)', tuple(row.get(k) for k in JOURNAL_FIELDS))
+                count += 1
+        self._conn.commit()
+        self.evict()
+        return count
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM completions').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+JOURNAL_FIELDS = ('source_bucket', 'source_key', 'target_bucket', 'target_key', 'etag', 'size')
+
+
+def normalize_etag(etag):
+    return etag.strip('"') if etag else etag
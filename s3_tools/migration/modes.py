@@ -0,0 +1,200 @@
+"""
+Transfer path selection for executor auto mode.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+ModeSelector picks server-side copy or download then upload for each object:
+- server-side copy permission is probed once per bucket pair by the first copies of the pair:
+  the pair is allowed after a copy succeeds, denied after deny_after copies failed with AccessDenied
+  and none succeeded, denied pairs always use downup
+- the result of a pair is cached in memory and in cache_file if provided, valid for cache_sec seconds,
+  so restarted executors (or executors sharing the file) do not probe again
+- for allowed pairs, throughput (bytes per second, moving average) of each path is measured by object size class,
+  both paths are tried until min_samples objects of a size class are measured, then the faster path is used,
+  the slower path is tried again every explore_every objects to follow changes
+- a copy failed with AccessDenied falls back to downup for that object even if the pair is allowed
+"""
+import os
+import json
+import time
+import logging
+import threading
+
+PATH_COPY = 'copy'
+PATH_DOWNUP = 'downup'
+# upper bounds of object size classes
+SIZE_CLASSES = [(1048576, '<1MB'), (16777216, '1MB-16MB'), (134217728, '16MB-128MB'), (1073741824, '128MB-1GB'),
+                (5368709120, '1GB-5GB'), (None, '>=5GB')]
+# errors of server-side copy not permitted
+DENIED_ERRORS = ('AccessDenied', 'AllAccessDisabled')
+# weight of the latest measurement in moving average
+EWMA_ALPHA = 0.2
+
+
+def size_class(size: int) -> str:
+    for bound, name in SIZE_CLASSES:
+        if bound is None or size < bound:
+            return name
+
+
+def is_denied(e) -> bool:
+    """
+    Check if exception of a server-side copy means copy is not permitted.
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict):
+        return response.get('Error', {}).get('Code') in DENIED_ERRORS
+    return False
+
+
+class ModeSelector:
+
+    def __init__(self, cache_file: str=None, cache_sec: int=86400, deny_after: int=3, min_samples: int=3,
+                 explore_every: int=100):
+        """
+
+        :param cache_file: JSON file to cache copy permission of bucket pairs
+        :param cache_sec: seconds a cached permission is valid
+        :param deny_after: copies failed with AccessDenied before a pair without successful copies is denied
+        :param min_samples: objects measured by each path of a size class before choosing the faster one
+        :param explore_every: try the slower path once every these objects of a size class
+        """
+        self._cache_file = cache_file
+        self._cache_sec = cache_sec
+        self._deny_after = deny_after
+        self._min_samples = min_samples
+        self._explore_every = explore_every
+        self._lock = threading.Lock()
+        # bucket pair to {'copy': bool, 'checked_at': time}
+        self._pairs = self._load()
+        # bucket pair to copies denied before the pair is decided
+        self._denials = {}
+        # size class to path to {'objects', 'bytes', 'seconds', 'rate', 'fallbacks'}
+        self._stats = {}
+        self._choices = {}
+
+    def _load(self) -> dict:
+        if not self._cache_file or not os.path.exists(self._cache_file):
+            return {}
+        try:
+            with open(self._cache_file) as fp:
+                pairs = json.load(fp)
+        except ValueError as e:
+            logging.warning('read mode cache {} failed: {}'.format(self._cache_file, e))
+            return {}
+        now = time.time()
+        return dict((k, v) for k, v in pairs.items() if now - v.get('checked_at', 0) < self._cache_sec)
+
+    def _save(self, pair: str):
+        """
+        Save a pair to cache file, merged with pairs saved by other executors since loaded.
+        """
+        if not self._cache_file:
+            return
+        pairs = self._load()
+        pairs[pair] = self._pairs[pair]
+        for k, v in pairs.items():
+            self._pairs.setdefault(k, v)
+        tmp_file = '{}.{}.tmp'.format(self._cache_file, os.getpid())
+        with open(tmp_file, 'w') as fp:
+            json.dump(pairs, fp, indent=2)
+        os.replace(tmp_file, self._cache_file)
+
+    @staticmethod
+    def pair(source_bucket: str, target_bucket: str) -> str:
+        return '{}->{}'.format(source_bucket, target_bucket)
+
+    def copy_allowed(self, source_bucket: str, target_bucket: str):
+        """
+        Copy permission of a bucket pair, None if not probed yet.
+        """
+        item = self._pairs.get(self.pair(source_bucket, target_bucket))
+        if item is None or time.time() - item['checked_at'] >= self._cache_sec:
+            return None
+        return item['copy']
+
+    def choose(self, source_bucket: str, target_bucket: str, size: int) -> str:
+        """
+        Path to transfer an object.
+
+        :return: copy or downup
+        :rtype: str
+        """
+        if self.copy_allowed(source_bucket, target_bucket) is False:
+            return PATH_DOWNUP
+        if self.copy_allowed(source_bucket, target_bucket) is None:
+            return PATH_COPY
+        name = size_class(size)
+        with self._lock:
+            stats = self._stats.get(name, {})
+            copy, downup = stats.get(PATH_COPY), stats.get(PATH_DOWNUP)
+            for path, item in [(PATH_COPY, copy), (PATH_DOWNUP, downup)]:
+                if not item or item['objects'] < self._min_samples:
+                    return path
+            faster, slower = (PATH_COPY, PATH_DOWNUP) if copy['rate'] >= downup['rate'] else (PATH_DOWNUP, PATH_COPY)
+            self._choices[name] = self._choices.get(name, 0) + 1
+            if self._explore_every and self._choices[name] % self._explore_every == 0:
+                return slower
+            return faster
+
+    def succeeded(self, source_bucket: str, target_bucket: str, path: str, size: int, seconds: float):
+        """
+        Measure an object transferred, a successful copy allows the bucket pair.
+        """
+        with self._lock:
+            if path == PATH_COPY and self.copy_allowed(source_bucket, target_bucket) is None:
+                self._decide(source_bucket, target_bucket, True)
+            item = self._stats.setdefault(size_class(size), {}).setdefault(path, {
+                'objects': 0, 'bytes': 0, 'seconds': 0.0, 'rate': None, 'fallbacks': 0})
+            item['objects'] += 1
+            item['bytes'] += size
+            item['seconds'] += seconds
+            rate = size / max(seconds, 0.001)
+            item['rate'] = rate if item['rate'] is None else EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * item['rate']
+
+    def denied(self, source_bucket: str, target_bucket: str, size: int):
+        """
+        A copy failed with AccessDenied, the object falls back to downup.
+        """
+        pair = self.pair(source_bucket, target_bucket)
+        with self._lock:
+            item = self._stats.setdefault(size_class(size), {}).setdefault(PATH_DOWNUP, {
+                'objects': 0, 'bytes': 0, 'seconds': 0.0, 'rate': None, 'fallbacks': 0})
+            item['fallbacks'] += 1
+            if self.copy_allowed(source_bucket, target_bucket) is None:
+                self._denials[pair] = self._denials.get(pair, 0) + 1
+                if self._denials[pair] >= self._deny_after:
+                    self._decide(source_bucket, target_bucket, False)
+
+    def _decide(self, source_bucket, target_bucket, allowed):
+        pair = self.pair(source_bucket, target_bucket)
+        self._pairs[pair] = {'copy': allowed, 'checked_at': time.time()}
+        self._denials.pop(pair, None)
+        logging.info('server-side copy {} for {}'.format('allowed' if allowed else 'denied', pair))
+        try:
+            self._save(pair)
+        except OSError as e:
+            logging.warning('save mode cache {} failed: {}'.format(self._cache_file, e))
+
+    def report(self) -> dict:
+        """
+        Objects, bytes, average throughput and fallbacks of each path by size class, and permission of bucket pairs.
+        """
+        with self._lock:
+            classes = {}
+            for name, paths in self._stats.items():
+                classes[name] = dict((path, {
+                    'objects': item['objects'],
+                    'bytes': item['bytes'],
+                    'bytes_per_sec': item['bytes'] / item['seconds'] if item['seconds'] else None,
+                    'fallbacks': item['fallbacks']
+                }) for path, item in paths.items())
+            return {'pairs': dict(self._pairs), 'size_classes': classes}
+
+    def log_report(self):
+        for name, paths in sorted(self.report()['size_classes'].items()):
+            logging.info('auto mode {}: {}'.format(name, ', '.join(
+                '{} {} objects {:.0f} bytes/s{}'.format(
+                    path, item['objects'], item['bytes_per_sec'] or 0,
+                    ' ({} fallbacks)'.format(item['fallbacks']) if item['fallbacks'] else '')
+                for path, item in sorted(paths.items()))))
@@ -0,0 +1,458 @@
+"""
+Per-key outcome files of executors and report aggregation.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Executor records an outcome for each key (time, latency, size, bucket, key, action, error class and
+keys in its message, so messages are counted as the sum of 1 / keys in message even if keys per message vary),
+rows are kept in columns and written to a binary file every rotate_rows rows or rotate_sec seconds:
+- file: magic, header length, JSON header (row number, column types and lengths, dictionaries), then columns
+- bucket, action and error class are dictionary encoded, keys are utf-8 lengths plus one blob
+- files are written to a temp file then renamed, optionally uploaded to S3 and removed
+- a background thread writes rows waited rotate_sec seconds even if no key is recorded, and uploads files
+  so recording threads never wait on S3
+Report reads outcome files in parallel processes, each file is aggregated by vectorized numpy
+operations (a plain python fallback if numpy is not installed), partial aggregates are merged into
+totals per action, failures per error class, throughput over time and latency percentiles.
+"""
+import os
+import sys
+import json
+import time
+import array
+import socket
+import struct
+import logging
+import threading
+from queue import Queue, Empty
+from multiprocessing import Pool
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+MAGIC = b'S3OC'
+VERSION = 1
+ACTION_FAILED = 'failed'
+# archived keys sent to restore queue, they are processed again after restored
+ACTION_RESTORING = 'restoring'
+# actions of executor done without transferring object data, such as skipped as already migrated
+SKIP_ACTIONS = ('skipped', 'journaled', 'not_modified', 'missing', 'tagged', 'deleted', 'checked')
+# bytes of keys in these actions are not counted in byte throughput
+NO_TRANSFER_ACTIONS = (ACTION_FAILED, ACTION_RESTORING) + SKIP_ACTIONS
+# column name, array typecode
+COLUMNS = [
+    ('time', 'd'),
+    ('latency', 'f'),
+    ('size', 'q'),
+    ('bucket', 'H'),
+    ('action', 'B'),
+    ('error', 'H'),
+    ('key_length', 'I'),
+    ('message_keys', 'I'),
+]
+# columns are written in little endian
+SWAP_BYTES = sys.byteorder == 'big'
+NUMPY_TYPES = {'d': '<f8', 'f': '<f4', 'q': '<i8', 'H': '<u2', 'B': 'u1', 'I': '<u4'}
+# latency histogram bucket upper bounds in seconds, from 1ms doubling to about 4.6 hours
+LATENCY_BOUNDS = [0.001 * 2 ** i for i in range(25)]
+
+
+def error_class(e) -> str:
+    """
+    Error class of an exception, error code of AWS client errors such as AccessDenied.
+
+    :param Exception e: exception
+    :rtype: str
+    """
+    response = getattr(e, 'response', None)
+    if isinstance(response, dict) and response.get('Error', {}).get('Code'):
+        return response['Error']['Code']
+    return type(e).__name__
+
+
+class OutcomeWriter:
+
+    def __init__(self, directory: str, rotate_rows: int=100000, rotate_sec: int=300, s3_path: str=None,
+                 s3_resource=None):
+        """
+
+        :param directory: directory to write outcome files
+        :param rotate_rows: max rows in one file
+        :param rotate_sec: max seconds a row waits to be written
+        :param s3_path: upload files to s3://bucket/prefix/ and remove local files if provided
+        :param s3_resource: S3Resource to upload files
+        """
+        self._directory = directory
+        self._rotate_rows = rotate_rows
+        self._rotate_sec = rotate_sec
+        self._s3_path = s3_path
+        self._s3 = s3_resource
+        self._lock = threading.Lock()
+        self._seq = 0
+        self._prefix = 'outcomes-{}-{}'.format(socket.gethostname(), os.getpid())
+        os.makedirs(directory, exist_ok=True)
+        self._reset()
+        # files written to upload, None to stop
+        self._uploads = Queue()
+        self._thread = threading.Thread(target=self._run, name='outcome-writer', daemon=True)
+        self._thread.start()
+
+    def _reset(self):
+        self._columns = dict((name, array.array(code)) for name, code in COLUMNS)
+        self._keys = bytearray()
+        self._dicts = {'bucket': {}, 'action': {}, 'error': {'': 0}}
+        self._started = time.time()
+
+    def _code(self, name, value):
+        codes = self._dicts[name]
+        if value not in codes:
+            codes[value] = len(codes)
+        return codes[value]
+
+    def record(self, bucket: str, key: str, action: str, size: int=0, latency: float=0.0, error: str=None,
+               message_keys: int=0):
+        """
+        Record outcome of a key.
+
+        :param bucket: source bucket
+        :param key: source key
+        :param action: action taken, failed for exceptions
+        :param size: object size
+        :param latency: seconds to process the key
+        :param error: error class for failed keys
+        :param message_keys: keys in the message of the key, 0 if unknown
+        """
+        data = key.encode('utf-8')
+        with self._lock:
+            c = self._columns
+            c['time'].append(time.time())
+            c['latency'].append(latency)
+            c['size'].append(size or 0)
+            c['bucket'].append(self._code('bucket', bucket))
+            c['action'].append(self._code('action', action))
+            c['error'].append(self._code('error', error or ''))
+            c['key_length'].append(len(data))
+            c['message_keys'].append(message_keys or 0)
+            self._keys.extend(data)
+            if len(c['time']) >= self._rotate_rows or time.time() - self._started >= self._rotate_sec:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        rows = len(self._columns['time'])
+        if not rows:
+            self._started = time.time()
+            return
+        self._seq += 1
+        filename = os.path.join(self._directory, '{}-{}-{}.bin'.format(
+            self._prefix, time.strftime('%Y%m%d%H%M%S'), self._seq))
+        write_outcomes(filename, self._columns, self._keys, self._dicts)
+        self._reset()
+        logging.info('Write {} outcomes to {}'.format(rows, filename))
+        if self._s3_path and self._s3:
+            self._uploads.put(filename)
+
+    def _run(self):
+        """
+        Write rows waited rotate_sec seconds and upload files written, until closed.
+        """
+        while True:
+            try:
+                filename = self._uploads.get(timeout=max(self._started + self._rotate_sec - time.time(), 0.01))
+            except Empty:
+                with self._lock:
+                    if time.time() - self._started >= self._rotate_sec:
+                        self._flush()
+                continue
+            if filename is None:
+                return
+            self._upload(filename)
+
+    def _upload(self, filename):
+        from s3_tools.aws_utils.s3 import split_s3_path
+        bucket, prefix = split_s3_path(self._s3_path)
+        key = prefix.rstrip('/') + '/' + os.path.basename(filename) if prefix else os.path.basename(filename)
+        try:
+            self._s3.upload_object(bucket=bucket, key=key, filename=filename)
+            os.unlink(filename)
+        except Exception as e:
+            logging.warning('upload {} failed, keep local file: {}'.format(filename, e))
+
+    def close(self):
+        """
+        Write rows left and wait for uploads.
+        """
+        self.flush()
+        if self._thread.is_alive():
+            self._uploads.put(None)
+            self._thread.join()
+
+
+def write_outcomes(filename, columns, keys, dicts):
+    """
+    Write columns to an outcome file atomically.
+
+    :param filename: outcome file path
+    :param dict columns: column name to array
+    :param keys: utf-8 keys concatenated
+    :param dict dicts: dictionary encoded column name to {value: code}
+    """
+    header = {
+        'version': VERSION,
+        'rows': len(columns['time']),
+        'columns': [[name, code, len(columns[name]) * columns[name].itemsize] for name, code in COLUMNS],
+        'keys': len(keys),
+        'dicts': dict((name, sorted(codes, key=codes.get)) for name, codes in dicts.items())
+    }
+    data = json.dumps(header).encode('utf-8')
+    tmp_file = filename + '.tmp'
+    with open(tmp_file, 'wb') as fp:
+        fp.write(MAGIC)
+        fp.write(struct.pack('<I', len(data)))
+        fp.write(data)
+        for name, code in COLUMNS:
+            column = columns[name]
+            if SWAP_BYTES:
+                column = array.array(code, column)
+                column.byteswap()
+            fp.write(column.tobytes())
+        fp.write(bytes(keys))
+    os.replace(tmp_file, filename)
+
+
+def read_outcomes(filename):
+    """
+    Read an outcome file.
+
+    :param filename: outcome file path
+    :return: header dict and dict of column name to numpy array (array.array without numpy), keys blob as bytes
+    :rtype: tuple
+    """
+    with open(filename, 'rb') as fp:
+        content = fp.read()
+    if content[:4] != MAGIC:
+        raise ValueError('{} is not an outcome file'.format(filename))
+    length = struct.unpack('<I', content[4:8])[0]
+    header = json.loads(content[8:8 + length].decode('utf-8'))
+    offset = 8 + length
+    columns = {}
+    for name, code, size in header['columns']:
+        buf = content[offset:offset + size]
+        if np is not None:
+            columns[name] = np.frombuffer(buf, dtype=NUMPY_TYPES[code])
+        else:
+            column = array.array(code)
+            column.frombytes(buf)
+            if SWAP_BYTES:
+                column.byteswap()
+            columns[name] = column
+        offset += size
+    keys = content[offset:offset + header['keys']]
+    return header, columns, keys
+
+
+def new_aggregate():
+    return {'files': 0, 'rows': 0, 'messages': 0.0, 'first': None, 'last': None, 'actions': {}, 'errors': {},
+            'throughput': {}, 'latency': {}, 'failed_keys': []}
+
+
+def aggregate_file(filename, interval=60, failed_keys=False):
+    """
+    Aggregate an outcome file.
+
+    :param filename: outcome file path
+    :param interval: seconds of each throughput bucket
+    :param failed_keys: collect (bucket, key, error) of failed keys
+    :return: partial aggregate
+    :rtype: dict
+    """
+    header, c, keys = read_outcomes(filename)
+    agg = new_aggregate()
+    agg['files'] = 1
+    agg['rows'] = header['rows']
+    if not header['rows']:
+        return agg
+    dicts = header['dicts']
+    if np is not None:
+        agg['first'] = float(c['time'].min())
+        agg['last'] = float(c['time'].max())
+        message_keys = c['message_keys'][c['message_keys'] > 0]
+        agg['messages'] = float((1.0 / message_keys).sum())
+        for code, action in enumerate(dicts['action']):
+            mask = c['action'] == code
+            sizes = c['size'][mask]
+            agg['actions'][action] = {'count': int(mask.sum()), 'bytes': int(sizes.sum())}
+            agg['latency'][action] = np.bincount(np.searchsorted(LATENCY_BOUNDS, c['latency'][mask]),
+                                                 minlength=len(LATENCY_BOUNDS) + 1).tolist()
+            if action == ACTION_FAILED:
+                counts = np.bincount(c['error'][mask], minlength=len(dicts['error']))
+                agg['errors'] = dict((dicts['error'][i], int(n)) for i, n in enumerate(counts) if n)
+            elif action not in NO_TRANSFER_ACTIONS:
+                buckets = (c['time'][mask] // interval).astype('<i8')
+                uniques, inverse = np.unique(buckets, return_inverse=True)
+                totals = np.bincount(inverse, weights=sizes, minlength=len(uniques))
+                for b, total in zip(uniques.tolist(), totals.tolist()):
+                    agg['throughput'][b * interval] = agg['throughput'].get(b * interval, 0) + int(total)
+    else:
+        agg['first'] = min(c['time'])
+        agg['last'] = max(c['time'])
+        agg['messages'] = sum(1.0 / n for n in c['message_keys'] if n)
+        for t, latency, size, action_code, error_code in zip(c['time'], c['latency'], c['size'], c['action'],
+                                                            c['error']):
+            action = dicts['action'][action_code]
+            item = agg['actions'].setdefault(action, {'count': 0, 'bytes': 0})
+            item['count'] += 1
+            item['bytes'] += size
+            histogram = agg['latency'].setdefault(action, [0] * (len(LATENCY_BOUNDS) + 1))
+            histogram[latency_bucket(latency)] += 1
+            if action == ACTION_FAILED:
+                error = dicts['error'][error_code]
+                agg['errors'][error] = agg['errors'].get(error, 0) + 1
+            elif action not in NO_TRANSFER_ACTIONS:
+                b = int(t // interval) * interval
+                agg['throughput'][b] = agg['throughput'].get(b, 0) + size
+    if failed_keys and ACTION_FAILED in dicts['action']:
+        failed = dicts['action'].index(ACTION_FAILED)
+        offset = 0
+        for bucket, action, error, length in zip(c['bucket'], c['action'], c['error'], c['key_length']):
+            if action == failed:
+                agg['failed_keys'].append((dicts['bucket'][bucket], keys[offset:offset + length].decode('utf-8'),
+                                           dicts['error'][error]))
+            offset += int(length)
+    return agg
+
+
+def latency_bucket(latency):
+    for i, bound in enumerate(LATENCY_BOUNDS):
+        if latency <= bound:
+            return i
+    return len(LATENCY_BOUNDS)
+
+
+def merge_aggregates(total, agg):
+    """
+    Merge partial aggregate agg into total.
+    """
+    total['files'] += agg['files']
+    total['rows'] += agg['rows']
+    total['messages'] += agg['messages']
+    if agg['first'] is not None:
+        total['first'] = agg['first'] if total['first'] is None else min(total['first'], agg['first'])
+        total['last'] = agg['last'] if total['last'] is None else max(total['last'], agg['last'])
+    for action, item in agg['actions'].items():
+        t = total['actions'].setdefault(action, {'count': 0, 'bytes': 0})
+        t['count'] += item['count']
+        t['bytes'] += item['bytes']
+    for error, count in agg['errors'].items():
+        total['errors'][error] = total['errors'].get(error, 0) + count
+    for b, size in agg['throughput'].items():
+        total['throughput'][b] = total['throughput'].get(b, 0) + size
+    for action, histogram in agg['latency'].items():
+        t = total['latency'].setdefault(action, [0] * len(histogram))
+        for i, n in enumerate(histogram):
+            t[i] += n
+    total['failed_keys'].extend(agg['failed_keys'])
+    return total
+
+
+def transferred_bytes(actions: dict) -> int:
+    """
+    Bytes of object data transferred of aggregated actions, keys failed, restoring or skipped are excluded.
+    """
+    return sum(item['bytes'] for action, item in actions.items() if action not in NO_TRANSFER_ACTIONS)
+
+
+def percentile(histogram, p):
+    """
+    Approximate percentile from a latency histogram, upper bound of the bucket.
+    """
+    total = sum(histogram)
+    if not total:
+        return 0.0
+    count = 0
+    for i, n in enumerate(histogram):
+        count += n
+        if count >= total * p:
+            return LATENCY_BOUNDS[i] if i < len(LATENCY_BOUNDS) else float('inf')
+    return float('inf')
+
+
+def aggregate_files(filenames, interval=60, workers=None, failed_keys=False):
+    """
+    Aggregate outcome files in parallel processes.
+
+    :param filenames: outcome file paths
+    :param interval: seconds of each throughput bucket
+    :param workers: process number, default cpu number
+    :param failed_keys: collect failed keys
+    :return: report dict
+    :rtype: dict
+    """
+    total = new_aggregate()
+    args = [(f, interval, failed_keys) for f in filenames]
+    if workers == 1 or len(args) <= 1:
+        results = (aggregate_file(*a) for a in args)
+        for agg in results:
+            merge_aggregates(total, agg)
+    else:
+        with Pool(workers) as pool:
+            for agg in pool.imap_unordered(_aggregate_file, args, chunksize=16):
+                merge_aggregates(total, agg)
+    return make_report(total, interval)
+
+
+def _aggregate_file(args):
+    return aggregate_file(*args)
+
+
+def make_report(total, interval):
+    elapsed = (total['last'] - total['first']) if total['first'] is not None else 0
+    migrated = transferred_bytes(total['actions'])
+    return {
+        'files': total['files'],
+        'keys': total['rows'],
+        'first': total['first'],
+        'last': total['last'],
+        'actions': total['actions'],
+        'errors': dict(sorted(total['errors'].items(), key=lambda item: -item[1])),
+        'bytes_per_sec': migrated / elapsed if elapsed > 0 else 0,
+        'throughput': [[b, total['throughput'][b] / interval] for b in sorted(total['throughput'])],
+        'latency': dict((action, {'p50': percentile(h, 0.5), 'p90': percentile(h, 0.9), 'p99': percentile(h, 0.99)})
+                        for action, h in total['latency'].items()),
+        'failed_keys': total['failed_keys']
+    }
+
+
+def list_outcome_files(paths, tmp_dir='tmp', s3_resource=None):
+    """
+    Outcome files in local paths, directories are listed, s3://bucket/prefix/ paths are downloaded to tmp_dir.
+
+    :param list paths: files, directories or S3 paths
+    :return: local file paths
+    :rtype: list
+    """
+    filenames = []
+    for path in paths:
+        if path.startswith('s3://'):
+            from s3_tools.aws_utils.s3 import split_s3_path
+            bucket, prefix = split_s3_path(path)
+            directory = os.path.join(tmp_dir, 'outcomes', bucket, prefix)
+            os.makedirs(directory, exist_ok=True)
+            for objs in s3_resource.list_objects_all(bucket=bucket, prefix=prefix or None):
+                for obj in objs:
+                    if not obj['Key'].endswith('.bin'):
+                        continue
+                    filename = os.path.join(directory, os.path.basename(obj['Key']))
+                    if not os.path.exists(filename) or os.path.getsize(filename) != obj['Size']:
+                        s3_resource.download_object(bucket=bucket, key=obj['Key'], filename=filename)
+                    filenames.append(filename)
+        elif os.path.isdir(path):
+            filenames.extend(os.path.join(path, name) for name in sorted(os.listdir(path)) if name.endswith('.bin'))
+        else:
+            filenames.append(path)
+    return filenames
@@ -0,0 +1,213 @@
+"""
+Staged pipeline of worker threads.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Pipeline runs stages of worker threads connected by bounded queues, so a slow stage does not stop the others:
+- each stage has its own worker number, items of a partitioned stage always go to the same worker by key
+- a worker calls func(item, emit), items emitted are put to the queue of the next stage
+- time waiting for input, waiting for output and busy are recorded per stage to find which stage limits the pipeline
+- any worker raising an exception aborts the whole pipeline, the exception is raised by run
+"""
+import time
+import queue
+import logging
+import threading
+
+STOP = object()
+
+
+class PipelineAborted(Exception):
+    pass
+
+
+class Stage:
+
+    def __init__(self, name: str, func, workers: int=1, partition=None):
+        """
+
+        :param name: stage name in summary
+        :param func: func(item, emit) called for each item, emit(item) sends item to next stage
+        :param workers: worker thread number
+        :param partition: func(item) returns a key, items with the same key go to the same worker in order,
+                          default any worker
+        """
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.partition = partition
+        self.queues = []
+        self.items = 0
+        self.busy = 0.0
+        self.idle = 0.0
+        self.blocked = 0.0
+        self._lock = threading.Lock()
+
+    def record(self, items=0, busy=0.0, idle=0.0, blocked=0.0):
+        with self._lock:
+            self.items += items
+            self.busy += busy
+            self.idle += idle
+            self.blocked += blocked
+
+    def utilisation(self, elapsed: float) -> dict:
+        """
+        Fractions of worker time.
+
+        :param elapsed: seconds since pipeline started
+        :return: dict of busy, idle (waiting for input) and blocked (waiting for next stage)
+        :rtype: dict
+        """
+        total = max(elapsed * self.workers, 1e-9)
+        return {
+            'busy': self.busy / total,
+            'idle': self.idle / total,
+            'blocked': self.blocked / total
+        }
+
+    def summary(self, elapsed: float) -> str:
+        u = self.utilisation(elapsed)
+        return '{}: {} workers, {} items, busy {:.0%}, waiting input {:.0%}, waiting output {:.0%}'.format(
+            self.name, self.workers, self.items, u['busy'], u['idle'], u['blocked'])
+
+
+class Pipeline:
+    POLL_SEC = 1
+
+    def __init__(self, stages, queue_size: int=100, report_sec: int=60, reporter=None):
+        """
+
+        :param list stages: stages in order
+        :param queue_size: max items buffered in each queue between two stages
+        :param report_sec: seconds between two reports while running
+        :param reporter: func() called every report_sec besides logging stage summaries
+        """
+        if not stages:
+            raise ValueError('no stages')
+        self._stages = stages
+        self._queue_size = queue_size
+        self._report_sec = report_sec
+        self._reporter = reporter
+        self._aborted = threading.Event()
+        self._errors = []
+        self._started = None
+        for index, stage in enumerate(stages):
+            # input of the first stage is put all before start
+            size = 0 if index == 0 else queue_size
+            num = stage.workers if stage.partition else 1
+            stage.queues = [queue.Queue(size) for _ in range(num)]
+
+    def run(self, items):
+        """
+        Put items to the first stage and wait for all stages done.
+
+        :param items: iterable of items for the first stage
+        :return: seconds elapsed
+        :rtype: float
+        """
+        self._started = time.time()
+        for item in items:
+            self.put(self._stages[0], item)
+        threads = []
+        for stage in self._stages:
+            threads.append([self.start_worker(stage, i) for i in range(stage.workers)])
+        last_report = time.time()
+        for index, stage in enumerate(self._stages):
+            try:
+                # all workers of the previous stage have exited
+                self.stop(stage)
+            except PipelineAborted:
+                pass
+            for t in threads[index]:
+                while t.is_alive():
+                    t.join(self.POLL_SEC)
+                    if self._report_sec and time.time() - last_report >= self._report_sec:
+                        last_report = time.time()
+                        self.report()
+        if self._errors:
+            raise self._errors[0]
+        return self.elapsed
+
+    def start_worker(self, stage, index):
+        t = threading.Thread(target=self.work, args=(stage, index), name='{}-{}'.format(stage.name, index))
+        t.daemon = True
+        t.start()
+        return t
+
+    def work(self, stage, index):
+        q = stage.queues[index % len(stage.queues)]
+        position = self._stages.index(stage)
+        next_stage = self._stages[position + 1] if position + 1 < len(self._stages) else None
+        blocked = [0.0]
+
+        def emit(item):
+            if next_stage is None:
+                return
+            start = time.time()
+            self.put(next_stage, item)
+            blocked[0] += time.time() - start
+
+        try:
+            while True:
+                start = time.time()
+                item = self.get(q)
+                stage.record(idle=time.time() - start)
+                if item is STOP:
+                    break
+                blocked[0] = 0.0
+                start = time.time()
+                stage.func(item, emit)
+                stage.record(items=1, busy=time.time() - start - blocked[0], blocked=blocked[0])
+        except PipelineAborted:
+            pass
+        except Exception as e:
+            logging.exception('stage {} failed'.format(stage.name))
+            self._errors.append(e)
+            self._aborted.set()
+
+    def get(self, q):
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                return q.get(timeout=self.POLL_SEC)
+            except queue.Empty:
+                pass
+
+    def put(self, stage, item):
+        if stage.partition:
+            q = stage.queues[hash(stage.partition(item)) % len(stage.queues)]
+        else:
+            q = stage.queues[0]
+        self._put(q, item)
+
+    def stop(self, stage):
+        """
+        Tell workers of stage no more items.
+        """
+        for q in stage.queues:
+            for _ in range(stage.workers // len(stage.queues)):
+                self._put(q, STOP)
+
+    def _put(self, q, item):
+        while True:
+            if self._aborted.is_set():
+                raise PipelineAborted()
+            try:
+                return q.put(item, timeout=self.POLL_SEC)
+            except queue.Full:
+                pass
+
+    def report(self):
+        for stage in self._stages:
+            logging.info(stage.summary(self.elapsed))
+        if self._reporter:
+            self._reporter()
+
+    @property
+    def elapsed(self) -> float:
+        return time.time() - self._started if self._started else 0.0
+
+    @property
+    def stages(self):
+        return self._stages
@@ -0,0 +1,184 @@
+"""
+Migration planner.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Planner scans the objects to migrate before sending any message and writes a plan:
+- messages are grouped into runs of consecutive messages of the same source (inventory file),
+  runs are assigned to queues by greedy bin-packing on bytes, so every queue holds about the same bytes
+  and each queue works on different parts of the key space instead of all queues on the same prefix
+- number of API calls and projected duration for a given executor fleet size are estimated
+
+Commander follows the plan with PlanRouter, which sends each message to the queue of its run.
+"""
+import json
+import math
+import heapq
+import logging
+from s3_tools.migration import KEYS_KEY, SIZE_KEY
+from s3_tools.migration.sharding import shard_name
+
+# part size of boto3 managed transfer for objects without known part layout
+DEFAULT_PART_SIZE = 8 * 1024 * 1024
+# max object size for copy_object and put_object API
+MAX_SINGLE_SIZE = 5000000000
+
+
+class MigrationPlanner:
+
+    def __init__(self, lister, queue_num: int, run_num: int=100):
+        """
+
+        :param lister: InventoryLister to list objects
+        :param queue_num: queue number
+        :param run_num: messages in a run, consecutive messages of a run are sent to the same queue
+        """
+        self._lister = lister
+        self._queue_num = queue_num
+        self._run_num = run_num
+
+    def plan(self, mode: str='copy', verify: bool=False, executors: int=100, call_latency: float=0.03,
+             bandwidth: float=50000000, max_receive_num: int=10, **kwargs) -> dict:
+        """
+        Scan objects and generate a plan.
+
+        :param mode: executor mode, copy or downup
+        :param verify: executor verify objects before copy
+        :param executors: executor number to estimate duration
+        :param call_latency: seconds of each API call
+        :param bandwidth: bytes per second of each executor
+        :param max_receive_num: messages received by each receive call
+        :param kwargs: arguments for lister
+        :return: plan
+        :rtype: dict
+        """
+        runs = []
+        counters = {}
+        api_calls = {'s3': 0, 'sqs': 0}
+        totals = {'messages': 0, 'keys': 0, 'bytes': 0}
+        for source_index, msg in self._lister.list_batches(**kwargs):
+            index = counters.get(source_index, 0)
+            counters[source_index] = index + 1
+            if index % self._run_num == 0:
+                runs.append({'source': source_index, 'run': index // self._run_num,
+                             'messages': 0, 'keys': 0, 'bytes': 0})
+            run = runs[-1]
+            sizes = [k.get(SIZE_KEY, 0) for k in msg[KEYS_KEY]]
+            run['messages'] += 1
+            run['keys'] += len(sizes)
+            run['bytes'] += sum(sizes)
+            api_calls['s3'] += sum(estimate_s3_calls(size, mode, verify) for size in sizes)
+            api_calls['sqs'] += 2 + 1.0 / max_receive_num
+        for run in runs:
+            for field in totals:
+                totals[field] += run[field]
+        queues = assign_runs(runs, self._queue_num, field='bytes' if totals['bytes'] else 'keys')
+        assignments = {}
+        for run in sorted(runs, key=lambda r: (r['source'], r['run'])):
+            assignments.setdefault(str(run['source']), []).append(run['queue'])
+        api_calls['s3'] = int(api_calls['s3'])
+        api_calls['sqs'] = int(math.ceil(api_calls['sqs']))
+        transfer_bytes = totals['bytes'] * (2 if mode == 'downup' else 1)
+        duration = (api_calls['s3'] * call_latency + transfer_bytes / bandwidth) / max(executors, 1)
+        plan = {
+            'batch_num': getattr(self._lister, 'batch_num', None),
+            'shard': shard_name(self._lister.shard) if getattr(self._lister, 'shard', None) else None,
+            'queue_num': self._queue_num,
+            'run_num': self._run_num,
+            'assignments': assignments,
+            'queues': queues,
+            'totals': totals,
+            'estimate': {
+                'mode': mode,
+                'verify': verify,
+                'executors': executors,
+                'api_calls': api_calls,
+                'duration_sec': int(duration)
+            }
+        }
+        logging.info('Plan {} messages, {} keys, {} bytes to {} queues, {} API calls, about {} seconds for {} executors'
+                     .format(totals['messages'], totals['keys'], totals['bytes'], self._queue_num,
+                             api_calls['s3'] + api_calls['sqs'], int(duration), executors))
+        return plan
+
+
+def assign_runs(runs, queue_num, field='bytes'):
+    """
+    Assign runs to queues by greedy bin-packing, biggest run first to the queue with least load.
+
+    :param list runs: runs to assign, queue number is set to queue of each run
+    :param int queue_num: queue number
+    :param str field: field to balance, bytes or keys if objects size unknown
+    :return: totals of each queue
+    :rtype: dict
+    """
+    heap = [(0, number) for number in range(1, queue_num + 1)]
+    queues = dict([(str(number), {'messages': 0, 'keys': 0, 'bytes': 0}) for number in range(1, queue_num + 1)])
+    for run in sorted(runs, key=lambda r: -r[field]):
+        load, number = heapq.heappop(heap)
+        run['queue'] = number
+        for name in queues[str(number)]:
+            queues[str(number)][name] += run[name]
+        heapq.heappush(heap, (load + run[field], number))
+    return queues
+
+
+def estimate_s3_calls(size, mode='copy', verify=False):
+    """
+    Estimate S3 API calls to migrate an object.
+
+    :param int size: object size
+    :param str mode: executor mode
+    :param bool verify: executor verify objects before copy
+    :return: API calls
+    :rtype: int
+    """
+    # head and get tagging of source
+    calls = 2
+    if verify:
+        calls += 2
+    if mode == 'downup':
+        # get, put
+        calls += 1
+    if size < MAX_SINGLE_SIZE:
+        calls += 1
+    else:
+        # create, parts, complete
+        calls += 2 + int(math.ceil(size / DEFAULT_PART_SIZE)) * (2 if mode == 'downup' else 1)
+    return calls
+
+
+class PlanRouter:
+
+    def __init__(self, plan: dict):
+        self._run_num = plan['run_num']
+        self._assignments = plan['assignments']
+        self._queue_num = plan['queue_num']
+        self._counters = {}
+
+    def route(self, source_index) -> int:
+        """
+        Queue number of next message of a source.
+
+        :param source_index: index of source the message comes from
+        :return: queue number, None if not in plan
+        :rtype: int
+        """
+        index = self._counters.get(source_index, 0)
+        self._counters[source_index] = index + 1
+        queues = self._assignments.get(str(source_index), [])
+        run = index // self._run_num
+        if run < len(queues):
+            return queues[run]
+        logging.warning('message {} of source {} not in plan'.format(index, source_index))
+        return None
+
+
+def load_plan(filename):
+    with open(filename) as fp:
+        return json.load(fp)
+
+
+def save_plan(plan, filename):
+    with open(filename, 'w') as fp:
+        json.dump(plan, fp, indent=2)
@@ -0,0 +1,202 @@
+"""
+Pre-fork executor workers for fast startup.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+A cold executor spends most of its startup importing boto3, loading service models, resolving credentials
+and getting queue URLs before receiving the first message. With executor --prefork N, a parent process does
+this once and forks N workers from it:
+- warm_up imports executor modules, creates S3 and queue clients from cached sessions so that service models
+  and credentials are loaded, gets the queue URL prefix, then closes connections so no socket is shared
+- workers create their own clients from the inherited sessions without loading anything again,
+  and start receiving messages within milliseconds
+- a worker exited is forked again, SIGTTIN forks one more worker, SIGTTOU stops the newest worker,
+  SIGTERM or SIGINT stops all workers, each worker hands off messages in processing as a single executor does
+- workers exiting within min_uptime seconds max_failures times in a row stop the parent, such as a config error
+Workers are processes, so each has its own journal, outcome file and staging quota as separate executors.
+"""
+import os
+import time
+import atexit
+import signal
+import logging
+from s3_tools import settings
+from s3_tools.logger import after_fork
+
+
+def warm_up():
+    """
+    Load what every worker needs before forking, only objects safe to be inherited are kept.
+    """
+    start = time.time()
+    from s3_tools.migration import executor  # noqa: F401
+    from s3_tools.aws_utils import get_aws_session
+    from s3_tools.aws_utils.s3 import S3Resource
+    from s3_tools.queues import BACKEND_SQS
+    s3 = S3Resource(settings)
+    for name in ['copy', 'copy_source']:
+        if name == 'copy' or isinstance(settings.get('aws.{}'.format(name), None), dict):
+            get_aws_session(name).get_credentials()
+    s3.close()
+    # local backend opens a database connection which can not be inherited
+    if (settings.get('sqs.backend', None) or BACKEND_SQS) == BACKEND_SQS:
+        from s3_tools.aws_utils.sqs import SqsResource
+        sqs = SqsResource(settings)
+        try:
+            # all queues share the prefix, the dead-letter queue exists for every job
+            sqs.get_queue_url(settings.get('sqs.dead_queue_name'))
+        except Exception as e:
+            logging.warning('get queue url failed, workers get it themselves: {}'.format(e))
+        sqs.close()
+    logging.info('warmed up in {:.3f} seconds'.format(time.time() - start))
+
+
+class PreforkPool:
+
+    def __init__(self, target, workers: int, warm_up=None, min_uptime: int=10, max_failures: int=5,
+                 poll_sec: float=0.5):
+        """
+
+        :param target: function run by each worker
+        :param workers: worker processes
+        :param warm_up: function run by parent before forking workers
+        :param min_uptime: seconds a worker should run, exiting earlier is a failure
+        :param max_failures: failures in a row to stop the pool
+        :param poll_sec: seconds between checks of workers
+        """
+        self._target = target
+        self._workers = max(workers, 1)
+        self._warm_up = warm_up
+        self._min_uptime = min_uptime
+        self._max_failures = max_failures
+        self._poll_sec = poll_sec
+        # pid to start time
+        self._children = {}
+        # pids stopped by SIGTTOU, their exits are not failures
+        self._retired = set()
+        self._failures = 0
+        self._stopping = False
+        self._pid = None
+
+    @property
+    def workers(self) -> int:
+        return self._workers
+
+    @property
+    def children(self) -> list:
+        return sorted(self._children)
+
+    def run(self) -> int:
+        """
+        Warm up, fork workers and keep them running until stopped.
+
+        :return: exit code of parent, 0 if stopped by signal, 1 if workers kept failing
+        :rtype: int
+        """
+        self._pid = os.getpid()
+        if self._warm_up:
+            self._warm_up()
+        handlers = dict((sig, signal.signal(sig, self._handle)) for sig in
+                        [signal.SIGTERM, signal.SIGINT, signal.SIGTTIN, signal.SIGTTOU])
+        try:
+            while True:
+                self._reap()
+                if self._stopping:
+                    if not self._children:
+                        break
+                elif self._failures >= self._max_failures:
+                    logging.error('{} workers exited within {} seconds in a row, stopping'.format(
+                        self._failures, self._min_uptime))
+                    self.stop()
+                    continue
+                else:
+                    while len(self._children) < self._workers:
+                        self._spawn()
+                    while len(self._children) - len(self._retired) > self._workers:
+                        pid = max(p for p in self._children if p not in self._retired)
+                        self._retired.add(pid)
+                        self._kill(pid)
+                time.sleep(self._poll_sec)
+        finally:
+            for sig, handler in handlers.items():
+                signal.signal(sig, handler)
+        return 1 if self._failures >= self._max_failures else 0
+
+    def stop(self):
+        """
+        Stop all workers, messages in processing are handed off by each worker.
+        """
+        self._stopping = True
+        for pid in self._children:
+            self._kill(pid)
+
+    def _handle(self, signum, frame):
+        if os.getpid() != self._pid:
+            # a worker signaled before its own handlers are set
+            raise SystemExit(0)
+        if signum == signal.SIGTTIN:
+            self._workers += 1
+            logging.info('workers increased to {}'.format(self._workers))
+        elif signum == signal.SIGTTOU:
+            self._workers = max(self._workers - 1, 1)
+            logging.info('workers decreased to {}'.format(self._workers))
+        elif not self._stopping:
+            logging.info('stopping {} workers'.format(len(self._children)))
+            self.stop()
+
+    def _spawn(self):
+        pid = os.fork()
+        if pid:
+            self._children[pid] = time.time()
+            logging.info('worker {} started'.format(pid))
+            return
+        # worker
+        code = 0
+        try:
+            for sig in [signal.SIGTERM, signal.SIGTTIN, signal.SIGTTOU]:
+                signal.signal(sig, signal.SIG_DFL)
+            # interrupt from terminal goes to the whole process group, parent stops workers by SIGTERM
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            after_fork()
+            self._target()
+        except SystemExit as e:
+            code = e.code if isinstance(e.code, int) else 1
+        except BaseException as e:
+            logging.error('worker failed: {}'.format(e), exc_info=True)
+            code = 1
+        finally:
+            try:
+                atexit._run_exitfuncs()
+                logging.shutdown()
+            finally:
+                # never return to the stack of parent
+                os._exit(code)
+
+    def _kill(self, pid):
+        try:
+            os.kill(pid, signal.SIGTERM)
+        except OSError:
+            pass
+
+    def _reap(self):
+        while self._children:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                self._children.clear()
+                return
+            if not pid:
+                return
+            started_at = self._children.pop(pid, None)
+            if started_at is None:
+                continue
+            code = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            retired = pid in self._retired
+            self._retired.discard(pid)
+            logging.info('worker {} exited with {}'.format(pid, code))
+            if self._stopping or retired:
+                continue
+            if time.time() - started_at < self._min_uptime:
+                self._failures += 1
+            else:
+                self._failures = 0
@@ -0,0 +1,393 @@
+"""
+Restore pipeline for archived source objects.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Objects in GLACIER or DEEP_ARCHIVE can not be copied until restored, copying them fails with InvalidObjectState
+on every retry. With migration.restore_archived, they do not reach copy queues before they are readable:
+- commander sends keys of archived storage classes (StorageClass of inventory or listing) to sqs.restore_queue_name
+  as restore messages, executors send keys failed with InvalidObjectState there too
+- restorer receives restore messages, issues RestoreObject for their keys with concurrency and tracks them in a
+  local SQLite state file, so restores in progress survive restarts, a message is deleted once its keys are tracked
+- tracked keys are checked by head_object only when due: the first check after restores of the storage class and
+  tier are usually done, then every check_sec seconds, so a key costs a few HEAD requests instead of one per poll
+- readable keys are batched into copy messages and sent to main queues (or queues of their job),
+  keys missing or failed to restore are sent to dead-letter queue with their error class
+- restores throttled or failed with 5xx or connection errors are tracked and requested again retry_sec later,
+  a tracked key found archived without restore in progress is requested again too
+"""
+import json
+import time
+import sqlite3
+import logging
+import threading
+from urllib import parse as urlparse
+from concurrent.futures import ThreadPoolExecutor
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, ERROR_KEY, \
+    JOB_KEY, STORAGE_CLASS_KEY
+from s3_tools.migration.outcomes import error_class
+from s3_tools.migration.deadletter import queue_name_of
+from s3_tools.migration.scaler import THROTTLE_ERRORS
+
+ARCHIVE_CLASSES = ('GLACIER', 'DEEP_ARCHIVE')
+TIERS = ('Expedited', 'Standard', 'Bulk')
+# seconds after which restores of storage class and tier are usually done, the first check of a key
+RESTORE_SEC = {
+    ('GLACIER', 'Expedited'): 60,
+    ('GLACIER', 'Standard'): 10800,
+    ('GLACIER', 'Bulk'): 18000,
+    ('DEEP_ARCHIVE', 'Standard'): 21600,
+    ('DEEP_ARCHIVE', 'Bulk'): 43200
+}
+# error of copying or downloading an archived object not restored
+ARCHIVED_ERROR = 'InvalidObjectState'
+# errors of RestoreObject meaning restore in progress or object not archived
+IN_PROGRESS_ERROR = 'RestoreAlreadyInProgress'
+ACTIVE_TIER_ERROR = 'ObjectAlreadyInActiveTierError'
+MISSING_ERRORS = ('NoSuchKey', '404', 'NotFound')
+STATE_PENDING = 'pending'
+STATE_READY = 'ready'
+# restore not requested for a transient error
+STATE_RETRY = 'retry'
+
+
+def is_archived(storage_class) -> bool:
+    return storage_class in ARCHIVE_CLASSES
+
+
+def is_restored(head: dict) -> bool:
+    """
+    Whether an object of head_object response is readable, not archived or restore completed.
+    """
+    if not is_archived(head.get('StorageClass')):
+        return True
+    return 'ongoing-request="false"' in (head.get('Restore') or '')
+
+
+def is_retryable(e) -> bool:
+    """
+    Whether a failed request may succeed later: throttled, 5xx, or no response such as a connection error.
+    """
+    if error_class(e) in THROTTLE_ERRORS:
+        return True
+    response = getattr(e, 'response', None)
+    if not isinstance(response, dict):
+        return True
+    status = response.get('ResponseMetadata', {}).get('HTTPStatusCode')
+    return bool(status) and status >= 500
+
+
+def restore_tier(storage_class, tier: str) -> str:
+    # DEEP_ARCHIVE does not support Expedited
+    if storage_class == 'DEEP_ARCHIVE' and tier == 'Expedited':
+        return 'Standard'
+    return tier
+
+
+class RestoreTracker:
+
+    def __init__(self, filename: str):
+        """
+
+        :param filename: SQLite database file path
+        """
+        self._filename = filename
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(filename, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS restores ('
+                           'source_bucket TEXT NOT NULL, '
+                           'target_bucket TEXT NOT NULL, '
+                           'source_key TEXT NOT NULL, '
+                           'job TEXT, '
+                           'item TEXT NOT NULL, '
+                           'requested_at REAL NOT NULL, '
+                           'next_check_at REAL NOT NULL, '
+                           'checks INTEGER NOT NULL DEFAULT 0)')
+        self._conn.execute('CREATE UNIQUE INDEX IF NOT EXISTS restores_key ON restores '
+                           '(source_bucket, target_bucket, source_key)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS restores_next_check ON restores (next_check_at)')
+        self._conn.commit()
+
+    def add(self, source_bucket: str, target_bucket: str, job, keys, next_check_at: float):
+        """
+        Track keys restore requested, keys tracked before keep their schedule.
+
+        :param keys: key items of message
+        :param next_check_at: time of the first check
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                'INSERT OR IGNORE INTO restores (source_bucket, target_bucket, source_key, job, item, requested_at, '
+                'next_check_at) VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(source_bucket, target_bucket, k[SOURCE_KEY_KEY], job, json.dumps(k), now, next_check_at)
+                 for k in keys])
+            self._conn.commit()
+
+    def due(self, now: float, limit: int=1000) -> list:
+        """
+        Keys to check, earliest first.
+
+        :return: list of (source_bucket, target_bucket, job, key item, checks)
+        :rtype: list
+        """
+        with self._lock:
+            rows = self._conn.execute('SELECT source_bucket, target_bucket, job, item, checks FROM restores '
+                                      'WHERE next_check_at <= ? ORDER BY next_check_at LIMIT ?',
+                                      (now, limit)).fetchall()
+        return [(r[0], r[1], r[2], json.loads(r[3]), r[4]) for r in rows]
+
+    def reschedule(self, rows, next_check_at: float):
+        with self._lock:
+            self._conn.executemany('UPDATE restores SET next_check_at=?, checks=checks+1 '
+                                   'WHERE source_bucket=? AND target_bucket=? AND source_key=?',
+                                   [(next_check_at, r[0], r[1], r[3][SOURCE_KEY_KEY]) for r in rows])
+            self._conn.commit()
+
+    def remove(self, rows):
+        with self._lock:
+            self._conn.executemany('DELETE FROM restores WHERE source_bucket=? AND target_bucket=? AND source_key=?',
+                                   [(r[0], r[1], r[3][SOURCE_KEY_KEY]) for r in rows])
+            self._conn.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM restores').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class Restorer:
+
+    def __init__(self, sqs, s3, tracker, queue_name: str, days: int=7, tier: str='Bulk', concurrency: int=20,
+                 check_sec: int=1800, max_checks: int=1000, batch_num: int=500, queue_num: int=None, jobs=None,
+                 report_sec: int=60, retry_sec: int=60):
+        """
+
+        :param sqs: QueueBackend
+        :param s3: S3Resource of source objects
+        :param tracker: RestoreTracker
+        :param queue_name: restore queue
+        :param days: days restored copies are kept
+        :param tier: retrieval tier, Expedited, Standard or Bulk
+        :param concurrency: threads to restore and check keys
+        :param check_sec: seconds between two checks of a key not yet restored
+        :param max_checks: keys checked in one round
+        :param batch_num: keys number in one copy message
+        :param queue_num: main queue to send copy messages, default random pick
+        :param dict jobs: job name to Job, keys of a job are sent to queues of the job
+        :param report_sec: seconds between two progress reports
+        :param retry_sec: seconds to request again a restore failed for a transient error
+        """
+        if tier not in TIERS:
+            raise ValueError('restore tier {} not supported'.format(tier))
+        self._sqs = sqs
+        self._s3 = s3
+        self._tracker = tracker
+        self._queue_name = queue_name
+        self._days = days
+        self._tier = tier
+        self._concurrency = concurrency
+        self._check_sec = check_sec
+        self._max_checks = max_checks
+        self._batch_num = batch_num
+        self._queue_num = queue_num
+        self._jobs = jobs or {}
+        self._report_sec = report_sec
+        self._retry_sec = retry_sec
+        self._lock = threading.Lock()
+        self._summary = {'requested': 0, 'ready': 0, 'failed': 0, 'checks': 0, 'retries': 0}
+
+    def run(self, stopping: threading.Event, sleep_sec: int=5):
+        """
+        Restore keys received and send keys restored until stopping is set.
+        """
+        reported_at = time.time()
+        while not stopping.is_set():
+            if not self.run_once():
+                stopping.wait(sleep_sec)
+            if time.time() - reported_at >= self._report_sec:
+                self.report()
+                reported_at = time.time()
+        self.report()
+
+    def run_once(self) -> int:
+        """
+        Receive restore messages once and check keys due.
+
+        :return: messages received and keys checked
+        :rtype: int
+        """
+        return self.receive() + self.check()
+
+    def receive(self) -> int:
+        """
+        Issue restores of keys in messages received, track them and delete the messages.
+
+        :return: messages received
+        :rtype: int
+        """
+        messages, queue_url = self._sqs.receive_message(queue_name=self._queue_name, max_num=10)
+        for message in messages:
+            body = json.loads(message['Body'])
+            source_bucket, target_bucket, job = body[SOURCE_BUCKET_KEY], body[TARGET_BUCKET_KEY], body.get(JOB_KEY)
+            keys = body[KEYS_KEY]
+            with ThreadPoolExecutor(self._concurrency) as pool:
+                states = list(pool.map(lambda k: self.restore(source_bucket, k), keys))
+            now = time.time()
+            pending = {}
+            retries = []
+            for key, state in zip(keys, states):
+                if state == STATE_PENDING:
+                    storage_class = key.get(STORAGE_CLASS_KEY) or 'GLACIER'
+                    restore_sec = RESTORE_SEC.get((storage_class, restore_tier(storage_class, self._tier)), 0)
+                    pending.setdefault(restore_sec, []).append(key)
+                elif state == STATE_RETRY:
+                    retries.append(key)
+            for restore_sec, items in pending.items():
+                self._tracker.add(source_bucket, target_bucket, job, items, now + restore_sec)
+            if retries:
+                # checked retry_sec later, restore is requested again as the key is found not restoring
+                self._tracker.add(source_bucket, target_bucket, job, retries, now + self._retry_sec)
+            self.send_ready(source_bucket, target_bucket, job,
+                            [k for k, state in zip(keys, states) if state == STATE_READY])
+            self.send_failed(source_bucket, target_bucket, job,
+                             [dict(k, **{ERROR_KEY: state}) for k, state in zip(keys, states)
+                              if state not in (STATE_PENDING, STATE_READY, STATE_RETRY)])
+            with self._lock:
+                self._summary['requested'] += sum(len(items) for items in pending.values())
+                self._summary['retries'] += len(retries)
+            self._sqs.delete_message(queue_url, message['ReceiptHandle'])
+        return len(messages)
+
+    def restore(self, bucket: str, key: dict) -> str:
+        """
+        Request restore of a key.
+
+        :return: pending, ready, retry if failed for a transient error, or error class if failed
+        :rtype: str
+        """
+        try:
+            response = self._s3.restore_object(bucket=bucket, key=urlparse.unquote(key[SOURCE_KEY_KEY]),
+                                               days=self._days,
+                                               tier=restore_tier(key.get(STORAGE_CLASS_KEY), self._tier))
+        except Exception as e:
+            error = error_class(e)
+            if error == IN_PROGRESS_ERROR:
+                return STATE_PENDING
+            if error == ACTIVE_TIER_ERROR:
+                return STATE_READY
+            logging.warning('restore object {}/{} failed: {}'.format(bucket, key[SOURCE_KEY_KEY], e))
+            if is_retryable(e):
+                return STATE_RETRY
+            return error
+        # 200 if a restored copy exists, 202 if restore started
+        if response.get('ResponseMetadata', {}).get('HTTPStatusCode') == 200:
+            return STATE_READY
+        return STATE_PENDING
+
+    def check(self) -> int:
+        """
+        Check keys due by head_object, send keys restored and schedule the others.
+
+        :return: keys checked
+        :rtype: int
+        """
+        rows = self._tracker.due(time.time(), self._max_checks)
+        if not rows:
+            return 0
+        with ThreadPoolExecutor(self._concurrency) as pool:
+            states = list(pool.map(self.check_key, rows))
+        ready, pending, retries, failed = [], [], [], []
+        for row, state in zip(rows, states):
+            if state == STATE_READY:
+                ready.append(row)
+            elif state == STATE_PENDING:
+                pending.append(row)
+            elif state == STATE_RETRY:
+                retries.append(row)
+            else:
+                failed.append((row, state))
+        self._tracker.reschedule(pending, time.time() + self._check_sec)
+        self._tracker.reschedule(retries, time.time() + self._retry_sec)
+        groups = {}
+        for row in ready:
+            groups.setdefault(row[:3], []).append(row[3])
+        for (source_bucket, target_bucket, job), keys in groups.items():
+            self.send_ready(source_bucket, target_bucket, job, keys)
+        groups = {}
+        for row, error in failed:
+            groups.setdefault(row[:3], []).append(dict(row[3], **{ERROR_KEY: error}))
+        for (source_bucket, target_bucket, job), keys in groups.items():
+            self.send_failed(source_bucket, target_bucket, job, keys)
+        self._tracker.remove(ready + [row for row, _ in failed])
+        with self._lock:
+            self._summary['checks'] += len(rows)
+            self._summary['retries'] += len(retries)
+        return len(rows)
+
+    def check_key(self, row) -> str:
+        """
+        Restore state of a tracked key.
+
+        :return: pending, ready, retry if restore failed again for a transient error, or error class if missing
+        :rtype: str
+        """
+        bucket, key = row[0], row[3][SOURCE_KEY_KEY]
+        try:
+            head = self._s3.head_object(bucket=bucket, key=urlparse.unquote(key))
+        except Exception as e:
+            error = error_class(e)
+            if error in MISSING_ERRORS:
+                return 'NoSuchKey'
+            logging.warning('check object {}/{} failed: {}'.format(bucket, key, e))
+            return STATE_PENDING
+        if is_restored(head):
+            return STATE_READY
+        if not head.get('Restore'):
+            # restore failed before, or restored copy expired
+            return self.restore(bucket, row[3])
+        return STATE_PENDING
+
+    def send_ready(self, source_bucket: str, target_bucket: str, job, keys):
+        """
+        Send keys readable to copy queues by messages of batch_num keys.
+        """
+        keys = [dict((k, v) for k, v in key.items() if k != STORAGE_CLASS_KEY) for key in keys]
+        for i in range(0, len(keys), self._batch_num):
+            msg = make_message(source_bucket, target_bucket, job, keys[i:i + self._batch_num])
+            self._sqs.send_message(msg, queue_name=queue_name_of(self._sqs, msg, self._queue_num, self._jobs))
+        with self._lock:
+            self._summary['ready'] += len(keys)
+
+    def send_failed(self, source_bucket: str, target_bucket: str, job, keys):
+        """
+        Send keys failed to dead-letter queue, each key has the error class it failed with.
+        """
+        if not keys:
+            return
+        self._sqs.send_message(make_message(source_bucket, target_bucket, job, keys), to_dead=True)
+        with self._lock:
+            self._summary['failed'] += len(keys)
+
+    @property
+    def summary(self) -> dict:
+        with self._lock:
+            return dict(self._summary)
+
+    def report(self):
+        summary = self.summary
+        logging.info('{} keys restoring, {} restore requested, {} restored and sent to copy, {} failed, '
+                     '{} checks, {} retries'.format(len(self._tracker), summary['requested'], summary['ready'],
+                                                    summary['failed'], summary['checks'], summary['retries']))
+
+
+def make_message(source_bucket: str, target_bucket: str, job, keys) -> dict:
+    msg = {SOURCE_BUCKET_KEY: source_bucket, TARGET_BUCKET_KEY: target_bucket, KEYS_KEY: keys}
+    if job:
+        msg[JOB_KEY] = job
+    return msg
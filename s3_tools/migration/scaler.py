@@ -0,0 +1,242 @@
+"""
+Autoscaling signal for executor fleets.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Scaler samples visible and in-flight messages of all queues and computes the executors needed
+to empty the queues within a target time:
+- net drain rate is the decrease of backlog (visible plus in-flight) between two samples, the previous
+  sample is kept in a state file so scaler can be run periodically, such as by cron or a scheduled task
+- gross drain rate is the messages processed per second in recent outcome files, each key row counts as
+  1 / keys in its message so it holds with adaptive batch, keys divided by batch_num if rows have no message keys,
+  arrival rate is gross minus net, net is used as gross if there are no outcome files
+- current executors are given, or counted by recent outcome files of different processes,
+  or estimated by in-flight messages divided by sqs.max_receive_num
+- needed executors = (backlog / target seconds + arrival rate) / drain rate of each executor
+More executors do not help if throttling is the bottleneck, needed executors are capped by current executors:
+- throttled: throttling errors (SlowDown, ...) in recent outcome files are more than throttle_ratio of keys
+- saturated: executors increased since last sample but gross drain rate did not
+"""
+import os
+import math
+import time
+import json
+import logging
+from s3_tools.migration.outcomes import aggregate_file
+
+# error classes of throttled requests
+THROTTLE_ERRORS = ('SlowDown', 'Throttling', 'ThrottlingException', 'RequestLimitExceeded', 'RequestThrottled',
+                   'TooManyRequestsException', 'ServiceUnavailable', 'ProvisionedThroughputExceededException')
+# executors increased by this ratio should increase gross drain rate by at least SATURATED_GAIN of it
+SATURATED_GROWTH = 1.1
+SATURATED_GAIN = 0.25
+METRIC_NAMESPACE = 'S3Migration'
+
+
+class FleetScaler:
+
+    def __init__(self, sqs, queue_names, dead_queue_name=None, target_sec: int=3600, min_executors: int=0,
+                 max_executors: int=0, batch_num: int=500, max_receive_num: int=10, outcome_files=None,
+                 window_sec: int=600, throttle_ratio: float=0.01, including_dead: bool=False):
+        """
+
+        :param sqs: QueueBackend
+        :param list queue_names: main queues
+        :param dead_queue_name: dead-letter queue, always reported
+        :param target_sec: seconds to empty the queues
+        :param min_executors: min executors to suggest
+        :param max_executors: max executors to suggest, 0 for no limit
+        :param batch_num: keys in one message, to convert keys in outcome files without message keys to messages
+        :param max_receive_num: messages received by an executor at once, to estimate executors by in-flight messages
+        :param outcome_files: function returning recent outcome file paths, outcomes are not used if not provided
+        :param window_sec: seconds of outcomes counted as recent
+        :param throttle_ratio: ratio of throttled keys to be throttled
+        :param including_dead: count dead-letter queue in backlog, such as executors run with -d
+        """
+        self._sqs = sqs
+        self._queue_names = list(queue_names)
+        self._dead_queue_name = dead_queue_name
+        self._target_sec = target_sec
+        self._min_executors = min_executors
+        self._max_executors = max_executors
+        self._batch_num = batch_num
+        self._max_receive_num = max_receive_num
+        self._outcome_files = outcome_files
+        self._window_sec = window_sec
+        self._throttle_ratio = throttle_ratio
+        self._including_dead = including_dead
+
+    def sample(self) -> dict:
+        """
+        Sample visible and in-flight messages of every queue.
+
+        :return: sample with time, queues, backlog and in_flight
+        :rtype: dict
+        """
+        queues = {}
+        names = self._queue_names + ([self._dead_queue_name] if self._dead_queue_name else [])
+        for name in names:
+            attrs = self._sqs.get_queue_attributes(
+                name, ['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])
+            queues[name] = {'visible': int(attrs.get('ApproximateNumberOfMessages', 0)),
+                            'in_flight': int(attrs.get('ApproximateNumberOfMessagesNotVisible', 0))}
+        counted = [name for name in names if name != self._dead_queue_name or self._including_dead]
+        return {
+            'time': time.time(),
+            'queues': queues,
+            'backlog': sum(queues[n]['visible'] + queues[n]['in_flight'] for n in counted),
+            'in_flight': sum(queues[n]['in_flight'] for n in counted)
+        }
+
+    def outcomes(self, now: float) -> dict:
+        """
+        Keys, messages, throttled keys and processes of outcome files written in recent window_sec seconds.
+
+        :return: dict with keys, messages, throttled, processes and seconds covered, empty if no recent outcomes
+        :rtype: dict
+        """
+        if not self._outcome_files:
+            return {}
+        keys = 0
+        messages = 0.0
+        throttled = 0
+        processes = set()
+        first = None
+        for filename in self._outcome_files():
+            try:
+                if os.path.getmtime(filename) < now - self._window_sec:
+                    continue
+                agg = aggregate_file(filename)
+            except (OSError, ValueError) as e:
+                logging.warning('read outcome file {} failed: {}'.format(filename, e))
+                continue
+            if not agg['rows'] or agg['last'] < now - self._window_sec:
+                continue
+            keys += agg['rows']
+            messages += agg['messages']
+            throttled += sum(n for error, n in agg['errors'].items() if error in THROTTLE_ERRORS)
+            # outcomes-<host>-<pid>-<time>-<seq>.bin
+            processes.add(os.path.basename(filename).rsplit('-', 2)[0])
+            first = agg['first'] if first is None else min(first, agg['first'])
+        if not keys:
+            return {}
+        return {'keys': keys, 'messages': messages, 'throttled': throttled, 'processes': len(processes),
+                'seconds': max(now - max(first, now - self._window_sec), 1.0)}
+
+    def evaluate(self, sample: dict, previous: dict=None, executors: int=None) -> dict:
+        """
+        Compute drain rates, time to empty and executors needed.
+
+        :param sample: current sample
+        :param previous: previous evaluation, rates are unknown without it
+        :param executors: current executors, counted or estimated if not provided
+        :return: evaluation, also the previous evaluation of next call
+        :rtype: dict
+        """
+        result = dict(sample)
+        now = sample['time']
+        outcomes = self.outcomes(now)
+        if executors is not None:
+            result['executors_source'] = 'given'
+        elif outcomes.get('processes'):
+            executors = outcomes['processes']
+            result['executors_source'] = 'outcomes'
+        else:
+            executors = int(math.ceil(sample['in_flight'] / float(self._max_receive_num or 1)))
+            result['executors_source'] = 'in_flight'
+        result['executors'] = executors
+        net = None
+        if previous and now > previous['time']:
+            net = (previous['backlog'] - sample['backlog']) / (now - previous['time'])
+        gross = None
+        if outcomes:
+            gross = (outcomes['messages'] or outcomes['keys'] / float(self._batch_num or 1)) / outcomes['seconds']
+        elif net is not None:
+            gross = max(net, 0.0)
+        result['net_drain_rate'] = net
+        result['drain_rate'] = gross
+        result['arrival_rate'] = max(gross - net, 0.0) if gross is not None and net is not None else None
+        result['eta_sec'] = sample['backlog'] / net if net and net > 0 else (0 if not sample['backlog'] else None)
+        result['throttle_ratio'] = outcomes['throttled'] / float(outcomes['keys']) if outcomes else 0.0
+        result['throttled'] = result['throttle_ratio'] > self._throttle_ratio
+        result['saturated'] = bool(
+            previous and previous.get('drain_rate') and gross is not None and previous.get('executors')
+            and executors >= previous['executors'] * SATURATED_GROWTH
+            and gross < previous['drain_rate'] * (1 + (executors / float(previous['executors']) - 1) * SATURATED_GAIN))
+        needed = None
+        if not sample['backlog']:
+            needed = 0
+        elif gross and executors:
+            required = sample['backlog'] / float(self._target_sec) + (result['arrival_rate'] or 0.0)
+            needed = int(math.ceil(required / (gross / executors)))
+        result['needed_executors'] = needed
+        result['bottleneck'] = None
+        if result['throttled']:
+            result['bottleneck'] = 'throttling'
+        elif result['saturated']:
+            result['bottleneck'] = 'saturation'
+        desired = executors if needed is None else needed
+        if result['bottleneck'] and desired > executors:
+            desired = executors
+        desired = max(desired, self._min_executors)
+        if self._max_executors:
+            desired = min(desired, self._max_executors)
+        result['desired_executors'] = desired
+        result['target_sec'] = self._target_sec
+        return result
+
+
+def load_state(filename: str, max_age: int) -> dict:
+    """
+    Previous evaluation saved in state file, None if missing or older than max_age seconds.
+    """
+    if not filename or not os.path.exists(filename):
+        return None
+    try:
+        with open(filename) as fp:
+            state = json.load(fp)
+    except ValueError:
+        return None
+    if time.time() - state.get('time', 0) > max_age:
+        return None
+    return state
+
+
+def save_json(obj, filename: str):
+    with open(filename + '.tmp', 'w') as fp:
+        json.dump(obj, fp, indent=2)
+    os.replace(filename + '.tmp', filename)
+
+
+def make_metric_data(result: dict, namespace: str=METRIC_NAMESPACE, dimensions: dict=None) -> dict:
+    """
+    CloudWatch PutMetricData payload of an evaluation, can be sent by
+    `aws cloudwatch put-metric-data --cli-input-json file://<file>`.
+
+    :param result: evaluation
+    :param namespace: metric namespace
+    :param dimensions: dimension name to value
+    :return: payload
+    :rtype: dict
+    """
+    metrics = [
+        ('Backlog', result['backlog'], 'Count'),
+        ('InFlight', result['in_flight'], 'Count'),
+        ('Executors', result['executors'], 'Count'),
+        ('DesiredExecutors', result['desired_executors'], 'Count'),
+        ('DrainRate', result['drain_rate'], 'Count/Second'),
+        ('ArrivalRate', result['arrival_rate'], 'Count/Second'),
+        ('TimeToEmpty', result['eta_sec'], 'Seconds'),
+        ('ThrottleRatio', result['throttle_ratio'], 'None'),
+        ('Throttled', int(result['bottleneck'] is not None), 'Count'),
+    ]
+    dims = [{'Name': k, 'Value': str(v)} for k, v in sorted((dimensions or {}).items())]
+    data = []
+    for name, value, unit in metrics:
+        if value is None:
+            continue
+        item = {'MetricName': name, 'Value': float(value), 'Unit': unit, 'Timestamp': int(result['time'])}
+        if dims:
+            item['Dimensions'] = dims
+        data.append(item)
+    return {'Namespace': namespace, 'MetricData': data}
@@ -0,0 +1,271 @@
+"""
+Queue scheduler for executors.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Scheduler samples the approximate depth of every queue periodically and picks queues
+for receiving weighted by their depth.
+- empty queues are backed off, a queue that returns no message is skipped for a growing period
+- dead-letter queue is low priority, its depth is multiplied by dead_weight
+- drain rate of every queue is reported on each sample
+JobScheduler applies weighted fair scheduling across jobs sharing the executor fleet:
+- every job has a virtual time advanced by seconds spent on its messages divided by its weight,
+  the job with messages and the least virtual time is picked
+- a job which was idle starts from the current virtual time, so it does not get credits for idle time
+- a job with max_in_flight messages in processing (ApproximateNumberOfMessagesNotVisible of its queues) is skipped
+"""
+import time
+import random
+import logging
+
+
+class QueueScheduler:
+
+    def __init__(self, sqs, queue_names, dead_queue_name=None, sample_sec=30, dead_weight=0.1,
+                 backoff_sec=5, max_backoff_sec=300):
+        """
+
+        :param sqs: queue resource which provides get_queue_depth(queue_name)
+        :param list queue_names: queue names to schedule, may include dead-letter queue
+        :param str dead_queue_name: dead-letter queue name
+        :param int sample_sec: seconds between two depth samples
+        :param float dead_weight: weight multiplier of dead-letter queue
+        :param int backoff_sec: initial seconds to skip a queue which returned no message
+        :param int max_backoff_sec: max seconds to skip an empty queue
+        """
+        if not queue_names:
+            raise ValueError('no queues to schedule')
+        self._sqs = sqs
+        self._queue_names = list(queue_names)
+        self._dead_queue_name = dead_queue_name
+        self._sample_sec = sample_sec
+        self._dead_weight = dead_weight
+        self._backoff_sec = backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._depths = dict([(name, 0) for name in self._queue_names])
+        self._samples = dict(self._depths)
+        self._rates = dict([(name, 0.0) for name in self._queue_names])
+        self._backoffs = {}
+        self._sampled_at = None
+
+    def pick(self):
+        """
+        Pick a queue to receive from.
+
+        :return: queue name, None if all queues are empty or backed off
+        :rtype: str
+        """
+        now = time.time()
+        if self._sampled_at is None or now - self._sampled_at >= self._sample_sec:
+            self.sample()
+        candidates = [name for name in self._queue_names if self._backoffs.get(name, (0, 0))[1] <= now]
+        if not candidates:
+            return None
+        weights = [self.weight(name) for name in candidates]
+        if sum(weights) > 0:
+            return weighted_choice(candidates, weights)
+        # depth is approximate and may lag, keep polling main queues which are not backed off
+        mains = [name for name in candidates if name != self._dead_queue_name]
+        if mains:
+            return random.choice(mains)
+        return None
+
+    def weight(self, queue_name):
+        depth = self._depths.get(queue_name, 0)
+        if queue_name == self._dead_queue_name:
+            return depth * self._dead_weight
+        return depth
+
+    def report(self, queue_name, received):
+        """
+        Report received message number of a queue, back off if nothing received.
+
+        :param str queue_name:
+        :param int received: received message number
+        """
+        if received:
+            self._backoffs.pop(queue_name, None)
+            return
+        delay, _ = self._backoffs.get(queue_name, (0, 0))
+        delay = min(delay * 2, self._max_backoff_sec) if delay else self._backoff_sec
+        self._backoffs[queue_name] = (delay, time.time() + delay)
+        self._depths[queue_name] = 0
+        logging.debug('queue {} empty, back off {} seconds'.format(queue_name, delay))
+
+    def sample(self):
+        """
+        Sample approximate depth of all queues and compute drain rates.
+        """
+        now = time.time()
+        for name in self._queue_names:
+            try:
+                depth = self._sqs.get_queue_depth(name)
+            except Exception as e:
+                logging.warning('sample queue {} failed: {}'.format(name, e))
+                continue
+            if self._sampled_at is not None and now > self._sampled_at:
+                self._rates[name] = (self._samples[name] - depth) / (now - self._sampled_at)
+            self._samples[name] = depth
+            self._depths[name] = depth
+        self._sampled_at = now
+        logging.info('queue depths: {}'.format(', '.join(
+            '{}={} ({:.2f} msg/s)'.format(name, self._samples[name], self._rates[name]) for name in self._queue_names)))
+
+    def drain_rates(self):
+        """
+        Drain rate of every queue since last sample, in messages per second.
+
+        :return: queue name to rate
+        :rtype: dict
+        """
+        return dict(self._rates)
+
+    @property
+    def depths(self):
+        return dict(self._depths)
+
+
+class JobScheduler:
+    # pseudo job of dead-letter queue
+    DEAD_JOB = ''
+
+    def __init__(self, sqs, jobs, queue_names, dead_queue_name=None, dead_weight=0.1, sample_sec=30,
+                 backoff_sec=5, max_backoff_sec=300, min_cost=0.01):
+        """
+
+        :param sqs: queue resource which provides get_queue_attributes(queue_name, attribute_names)
+        :param list jobs: Job to schedule
+        :param dict queue_names: job name to its queue names
+        :param str dead_queue_name: dead-letter queue name, scheduled as a job weighted by dead_weight
+        :param float dead_weight: weight of dead-letter queue, 0 to skip it
+        :param int sample_sec: seconds between two queue samples
+        :param int backoff_sec: initial seconds to skip a queue which returned no message
+        :param int max_backoff_sec: max seconds to skip an empty queue
+        :param float min_cost: min seconds charged for a message
+        """
+        if not jobs:
+            raise ValueError('no jobs to schedule')
+        self._sqs = sqs
+        self._queues = dict([(job.name, list(queue_names[job.name])) for job in jobs])
+        self._weights = dict([(job.name, job.weight) for job in jobs])
+        self._limits = dict([(job.name, job.max_in_flight) for job in jobs])
+        if dead_queue_name and dead_weight > 0:
+            self._queues[self.DEAD_JOB] = [dead_queue_name]
+            self._weights[self.DEAD_JOB] = dead_weight
+            self._limits[self.DEAD_JOB] = 0
+        self._dead_queue_name = dead_queue_name
+        self._queue_jobs = dict([(q, name) for name, queues in self._queues.items() for q in queues])
+        self._sample_sec = sample_sec
+        self._backoff_sec = backoff_sec
+        self._max_backoff_sec = max_backoff_sec
+        self._min_cost = min_cost
+        self._depths = dict([(q, None) for q in self._queue_jobs])
+        self._in_flight = dict([(name, 0) for name in self._queues])
+        self._passes = dict([(name, 0.0) for name in self._queues])
+        self._vtime = 0.0
+        self._backoffs = {}
+        self._sampled_at = None
+
+    def pick(self):
+        """
+        Pick a queue of the job with messages and the least virtual time.
+
+        :return: queue name, None if no job has messages or all are at their in-flight limit
+        :rtype: str
+        """
+        now = time.time()
+        if self._sampled_at is None or now - self._sampled_at >= self._sample_sec:
+            self.sample()
+        candidates = {}
+        for name, queues in self._queues.items():
+            if self._limits[name] and self._in_flight[name] >= self._limits[name]:
+                continue
+            queues = [q for q in queues if self._backoffs.get(q, (0, 0))[1] <= now]
+            if queues:
+                candidates[name] = queues
+        # depth is approximate and may lag, keep polling main queues not backed off if no queue has messages
+        backlogged = dict([(name, [q for q in queues if self._depths[q] is None or self._depths[q] > 0])
+                           for name, queues in candidates.items()])
+        backlogged = dict([(name, queues) for name, queues in backlogged.items() if queues])
+        if not backlogged:
+            backlogged = dict([(name, queues) for name, queues in candidates.items() if name != self.DEAD_JOB])
+        if not backlogged:
+            return None
+        # jobs back from idle start from current virtual time
+        self._vtime = max(self._vtime, min(self._passes[name] for name in backlogged))
+        for name in backlogged:
+            self._passes[name] = max(self._passes[name], self._vtime)
+        job = min(sorted(backlogged), key=lambda name: self._passes[name])
+        queues = backlogged[job]
+        weights = [self._depths[q] or 0 for q in queues]
+        if sum(weights) > 0:
+            return weighted_choice(queues, weights)
+        return random.choice(queues)
+
+    def report(self, queue_name, received):
+        """
+        Report received message number of a queue, back off if nothing received.
+
+        :param str queue_name:
+        :param int received: received message number
+        """
+        job = self._queue_jobs[queue_name]
+        if received:
+            self._backoffs.pop(queue_name, None)
+            # counted until next sample, so this executor does not exceed the limit by itself
+            self._in_flight[job] += received
+            return
+        delay, _ = self._backoffs.get(queue_name, (0, 0))
+        delay = min(delay * 2, self._max_backoff_sec) if delay else self._backoff_sec
+        self._backoffs[queue_name] = (delay, time.time() + delay)
+        self._depths[queue_name] = 0
+        logging.debug('queue {} empty, back off {} seconds'.format(queue_name, delay))
+
+    def charge(self, queue_name, cost):
+        """
+        Advance virtual time of the job of a queue by seconds spent on a message.
+
+        :param str queue_name:
+        :param float cost: seconds to process the message
+        """
+        job = self._queue_jobs.get(queue_name)
+        if job is None:
+            return
+        self._passes[job] += max(cost, self._min_cost) / self._weights[job]
+
+    def sample(self):
+        """
+        Sample approximate visible and in-flight messages of all queues.
+        """
+        in_flight = dict([(name, 0) for name in self._queues])
+        for queue_name, job in self._queue_jobs.items():
+            try:
+                attrs = self._sqs.get_queue_attributes(
+                    queue_name, ['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'])
+            except Exception as e:
+                logging.warning('sample queue {} failed: {}'.format(queue_name, e))
+                in_flight[job] = max(in_flight[job], self._in_flight[job])
+                continue
+            self._depths[queue_name] = int(attrs.get('ApproximateNumberOfMessages', 0))
+            in_flight[job] += int(attrs.get('ApproximateNumberOfMessagesNotVisible', 0))
+        self._in_flight = in_flight
+        self._sampled_at = time.time()
+        logging.info('jobs: {}'.format(', '.join(
+            '{}={} messages, {} in flight'.format(name or 'dead', sum(self._depths[q] or 0 for q in queues),
+                                                  self._in_flight[name])
+            for name, queues in sorted(self._queues.items()))))
+
+    @property
+    def passes(self):
+        return dict(self._passes)
+
+
+def weighted_choice(items, weights):
+    total = sum(weights)
+    r = random.uniform(0, total)
+    upto = 0
+    for item, weight in zip(items, weights):
+        upto += weight
+        if weight > 0 and r <= upto:
+            return item
+    return [item for item, weight in zip(items, weights) if weight > 0][-1]
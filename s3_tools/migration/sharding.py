@@ -0,0 +1,89 @@
+"""
+Commander sharding.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Commander processes on different nodes started with --shard i/N each send a disjoint part of the objects,
+no coordination is needed besides the shard option:
+- S3InventoryLister: list files of manifest are taken by file index modulo N
+- S3ObjectLister: the keyspace is split into units by delimiter (/) prefixes down to a depth, every shard
+  discovers the same units and takes units by hash of unit name modulo N, a unit is either objects directly
+  under a prefix or all objects under a prefix at the max depth
+Each shard keeps its own checkpoint (the shard is a part of the checkpoint identity) and reports its own totals.
+"""
+import re
+import zlib
+from collections import namedtuple
+
+Shard = namedtuple('Shard', ['index', 'count'])
+
+SHARD_PATTERN = re.compile(r'^(\d+)/(\d+)$')
+# objects directly under a prefix, or all objects under a prefix
+UNIT_DIRECT = 'direct'
+UNIT_TREE = 'tree'
+
+
+def parse_shard(value: str) -> Shard:
+    """
+    Shard of i/N, 1 <= i <= N.
+    """
+    match = SHARD_PATTERN.match(value or '')
+    if not match:
+        raise ValueError('invalid shard {}, should be i/N'.format(value))
+    shard = Shard(int(match.group(1)), int(match.group(2)))
+    if not 1 <= shard.index <= shard.count:
+        raise ValueError('invalid shard {}, i should be between 1 and N'.format(value))
+    return shard
+
+
+def shard_name(shard: Shard) -> str:
+    return '{}/{}'.format(shard.index, shard.count)
+
+
+def owns_index(shard: Shard, index: int) -> bool:
+    """
+    Whether source of index, such as list file in manifest, belongs to shard.
+    """
+    return index % shard.count == shard.index - 1
+
+
+def owns_unit(shard: Shard, unit: str) -> bool:
+    """
+    Whether keyspace unit belongs to shard, by CRC32 of unit name which is the same on every node.
+    """
+    return zlib.crc32(unit.encode('utf-8')) % shard.count == shard.index - 1
+
+
+def unit_name(kind: str, prefix: str) -> str:
+    return '{}:{}'.format(kind, prefix)
+
+
+def split_unit(unit: str):
+    """
+    Kind and prefix of a unit name.
+    """
+    kind, prefix = unit.split(':', 1)
+    return kind, prefix
+
+
+def list_units(s3, bucket: str, prefix: str='', depth: int=1) -> list:
+    """
+    Units of keyspace under prefix, the same for all shards as long as prefixes are not changed while discovering.
+
+    :param s3: S3Resource
+    :param bucket: bucket to list
+    :param prefix: prefix of objects
+    :param depth: levels of prefixes to split
+    :return: sorted unit names
+    :rtype: list
+    """
+    units = []
+    level = [prefix or '']
+    for _ in range(depth):
+        children = []
+        for p in level:
+            units.append(unit_name(UNIT_DIRECT, p))
+            children.extend(s3.list_common_prefixes(bucket, prefix=p))
+        level = children
+    units.extend(unit_name(UNIT_TREE, p) for p in level)
+    return sorted(units)
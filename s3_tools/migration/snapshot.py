@@ -0,0 +1,162 @@
+"""
+Object list snapshots for incremental sync.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+A snapshot is a gzip TSV file of (key, etag, last modified, size, storage class) sorted by key.
+Snapshots of two runs are compared by streaming both files, so only objects added or changed
+since the previous run (and optionally objects deleted) are sent to queues. Storage class is kept
+for filters and restores of the rows listed, it is not compared.
+SnapshotStore keeps snapshots in a directory with a LATEST pointer file to the snapshot of the last run.
+"""
+import os
+import gzip
+import heapq
+import logging
+import tempfile
+from datetime import datetime
+
+SNAPSHOT_FIELDS = ('Key', 'ETag', 'LastModifiedDate', 'Size', 'StorageClass')
+
+CHANGE_ADDED = 'added'
+CHANGE_CHANGED = 'changed'
+CHANGE_DELETED = 'deleted'
+
+
+def build_snapshot(rows, filename, chunk_size=1000000):
+    """
+    Write rows to a snapshot file sorted by key, sorted in chunks then merged to limit memory.
+
+    :param rows: iterable of dict with Key, ETag, LastModifiedDate, Size and StorageClass
+    :param str filename: snapshot file path
+    :param int chunk_size: rows sorted in memory
+    :return: row number
+    :rtype: int
+    """
+    chunks = []
+    count = 0
+    tmp_dir = os.path.dirname(os.path.abspath(filename))
+    try:
+        lines = []
+        for row in rows:
+            lines.append('\t'.join('' if row.get(f) is None else str(row[f]) for f in SNAPSHOT_FIELDS) + '\n')
+            count += 1
+            if len(lines) >= chunk_size:
+                chunks.append(write_chunk(lines, tmp_dir))
+                lines = []
+        if lines or not chunks:
+            chunks.append(write_chunk(lines, tmp_dir))
+        files = [open(chunk) for chunk in chunks]
+        try:
+            with gzip.open(filename, 'wt') as fout:
+                fout.writelines(heapq.merge(*files))
+        finally:
+            for fp in files:
+                fp.close()
+    finally:
+        for chunk in chunks:
+            os.unlink(chunk)
+    logging.info('Build snapshot {} with {} objects'.format(filename, count))
+    return count
+
+
+def write_chunk(lines, tmp_dir):
+    lines.sort()
+    fd, path = tempfile.mkstemp(prefix='chunk-', suffix='.tsv', dir=tmp_dir)
+    with os.fdopen(fd, 'w') as fp:
+        fp.writelines(lines)
+    return path
+
+
+def read_snapshot(filename):
+    """
+    Read rows of a snapshot file in key order.
+
+    :param filename: snapshot file path
+    :return: generator of dict
+    """
+    with gzip.open(filename, 'rt') as fp:
+        for line in fp:
+            yield dict(zip(SNAPSHOT_FIELDS, line.rstrip('\n').split('\t')))
+
+
+def diff_snapshots(old_file, new_file):
+    """
+    Compare two snapshots by merge join on key.
+
+    :param old_file: snapshot of previous run, None to treat all objects as added
+    :param new_file: snapshot of current run
+    :return: generator of (change, row), row is from new snapshot except for deleted objects
+    """
+    old_rows = read_snapshot(old_file) if old_file else iter(())
+    new_rows = read_snapshot(new_file)
+    old = next(old_rows, None)
+    new = next(new_rows, None)
+    while old is not None or new is not None:
+        if old is None or (new is not None and new['Key'] < old['Key']):
+            yield CHANGE_ADDED, new
+            new = next(new_rows, None)
+        elif new is None or old['Key'] < new['Key']:
+            yield CHANGE_DELETED, old
+            old = next(old_rows, None)
+        else:
+            if is_changed(old, new):
+                yield CHANGE_CHANGED, new
+            old = next(old_rows, None)
+            new = next(new_rows, None)
+
+
+def is_changed(old, new):
+    for field in ('ETag', 'LastModifiedDate', 'Size'):
+        if old.get(field) and new.get(field) and old[field] != new[field]:
+            return True
+    return False
+
+
+class SnapshotStore:
+    LATEST_FILENAME = 'LATEST'
+
+    def __init__(self, directory):
+        self._directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def latest(self):
+        """
+        Snapshot of the last run.
+
+        :return: snapshot file path, None if no snapshot
+        :rtype: str
+        """
+        pointer = os.path.join(self._directory, self.LATEST_FILENAME)
+        if not os.path.exists(pointer):
+            return None
+        with open(pointer) as fp:
+            name = fp.read().strip()
+        return os.path.join(self._directory, name) if name else None
+
+    def new_snapshot(self):
+        """
+        Path for snapshot of current run.
+
+        :rtype: str
+        """
+        return os.path.join(self._directory, 'snapshot-{}.tsv.gz'.format(datetime.utcnow().strftime('%Y%m%d%H%M%S')))
+
+    def commit(self, filename):
+        """
+        Point LATEST to snapshot, old snapshots except the previous one are removed.
+
+        :param filename: snapshot file path
+        """
+        previous = self.latest()
+        pointer = os.path.join(self._directory, self.LATEST_FILENAME)
+        with open(pointer + '.tmp', 'w') as fp:
+            fp.write(os.path.basename(filename))
+            fp.flush()
+            os.fsync(fp.fileno())
+        os.replace(pointer + '.tmp', pointer)
+        keep = set([os.path.basename(filename), os.path.basename(previous or '')])
+        for name in os.listdir(self._directory):
+            if name.startswith('snapshot-') and name not in keep:
+                os.unlink(os.path.join(self._directory, name))
+        logging.info('Snapshot {} committed'.format(filename))
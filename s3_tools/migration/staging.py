@@ -0,0 +1,111 @@
+"""
+Staging manager for downup mode.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Staging manager gives out unique preallocated files under tmp_dir for downloaded objects:
+- downloads are admitted only if the quota and the free disk space allow, otherwise wait until they do
+- files are preallocated so ranged downloads can write parts directly at their offsets
+- staged files are always removed when leaving the stage context, even on failure
+"""
+import os
+import time
+import shutil
+import logging
+import tempfile
+import threading
+from contextlib import contextmanager
+
+
+class StagingManager:
+
+    def __init__(self, tmp_dir: str, quota: int=0, min_free: int=0, timeout: int=600):
+        """
+
+        :param tmp_dir: directory to stage files
+        :param quota: max bytes staged at the same time, 0 for no limit
+        :param min_free: min free bytes to keep in the disk
+        :param timeout: seconds to wait for space, raise if no space after timeout
+        """
+        self._tmp_dir = tmp_dir
+        self._quota = quota
+        self._min_free = min_free
+        self._timeout = timeout
+        self._used = 0
+        self._cond = threading.Condition()
+        os.makedirs(tmp_dir, exist_ok=True)
+
+    def admit(self, size: int) -> bool:
+        if self._quota and self._used + size > self._quota:
+            return False
+        return shutil.disk_usage(self._tmp_dir).free - size >= self._min_free
+
+    def acquire(self, size: int) -> str:
+        """
+        Wait for space and create a unique preallocated file.
+
+        :param size: file size
+        :return: file path
+        :rtype: str
+        """
+        if self._quota and size > self._quota:
+            raise ValueError('object size {} exceeds staging quota {}'.format(size, self._quota))
+        deadline = time.time() + self._timeout
+        with self._cond:
+            while not self.admit(size):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise IOError('no space to stage {} bytes in {}'.format(size, self._tmp_dir))
+                logging.info('wait for space to stage {} bytes'.format(size))
+                # free disk space may be released by other processes, check again periodically
+                self._cond.wait(min(remaining, 5))
+            self._used += size
+        try:
+            fd, path = tempfile.mkstemp(prefix='stage-', dir=self._tmp_dir)
+            try:
+                preallocate(fd, size)
+            finally:
+                os.close(fd)
+        except Exception:
+            self.release(None, size)
+            raise
+        return path
+
+    def release(self, path, size: int):
+        """
+        Remove staged file and release its space.
+
+        :param path: file path
+        :param size: file size
+        """
+        if path and os.path.exists(path):
+            os.unlink(path)
+        with self._cond:
+            self._used -= size
+            self._cond.notify_all()
+
+    @contextmanager
+    def stage(self, size: int):
+        """
+        Context of a staged file, file is removed when leaving the context.
+
+        :param size: file size
+        """
+        path = self.acquire(size)
+        try:
+            yield path
+        finally:
+            self.release(path, size)
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+
+def preallocate(fd, size):
+    if size <= 0:
+        return
+    if hasattr(os, 'posix_fallocate'):
+        os.posix_fallocate(fd, 0, size)
+    else:
+        os.ftruncate(fd, size)
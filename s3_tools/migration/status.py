@@ -0,0 +1,228 @@
+"""
+Migration progress and ETA.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Status combines what each part of the fleet already records, without any extra work for commander or executors:
+- queues: visible and in-flight messages of main queues and dead-letter queue, one GetQueueAttributes call each
+- commander checkpoint: messages, keys and bytes enqueued, and if commander finished
+- executor outcome files: keys done and failed, bytes transferred and failed
+Polling is cheap enough to leave running for weeks: the checkpoint is read only when it changed,
+and outcome files are aggregated once, only new or changed files are read on each refresh.
+Rates are computed over samples of the last window_sec seconds, the ETA is remaining keys divided by key rate,
+or backlog divided by message drain rate without checkpoint or outcome files. Keys in queued messages are
+estimated by average keys per message of the checkpoint or outcome files, which vary with adaptive batch.
+"""
+import os
+import json
+import time
+import logging
+from collections import deque
+from s3_tools.migration.scaler import FleetScaler
+from s3_tools.migration.outcomes import ACTION_FAILED, ACTION_RESTORING, aggregate_file, merge_aggregates, \
+    new_aggregate, transferred_bytes
+
+
+class MigrationStatus:
+
+    def __init__(self, sqs, queue_names, dead_queue_name=None, batch_num: int=500, checkpoint_file: str=None,
+                 outcome_files=None, window_sec: int=600):
+        """
+
+        :param sqs: QueueBackend
+        :param list queue_names: main queues
+        :param dead_queue_name: dead-letter queue
+        :param batch_num: keys in one message, to estimate keys in queues without checkpoint or outcome files
+        :param checkpoint_file: commander checkpoint file
+        :param outcome_files: function returning outcome file paths, outcomes are not used if not provided
+        :param window_sec: seconds of samples to compute rates
+        """
+        self._scaler = FleetScaler(sqs, queue_names, dead_queue_name=dead_queue_name)
+        self._dead_queue_name = dead_queue_name
+        self._batch_num = batch_num
+        self._checkpoint_file = checkpoint_file
+        self._checkpoint = None
+        self._checkpoint_mtime = None
+        self._outcome_files = outcome_files
+        # outcome file path to (mtime, size, aggregate)
+        self._aggregates = {}
+        self._window_sec = window_sec
+        self._samples = deque()
+
+    def checkpoint(self) -> dict:
+        """
+        Commander checkpoint, read again only if file changed.
+        """
+        if not self._checkpoint_file or not os.path.exists(self._checkpoint_file):
+            return None
+        mtime = os.path.getmtime(self._checkpoint_file)
+        if mtime != self._checkpoint_mtime:
+            try:
+                with open(self._checkpoint_file) as fp:
+                    self._checkpoint = json.load(fp)
+                self._checkpoint_mtime = mtime
+            except ValueError as e:
+                logging.warning('read checkpoint {} failed: {}'.format(self._checkpoint_file, e))
+        return self._checkpoint
+
+    def outcomes(self) -> dict:
+        """
+        Aggregate of all outcome files, only new or changed files are aggregated.
+        """
+        if not self._outcome_files:
+            return None
+        total = new_aggregate()
+        aggregates = {}
+        for filename in self._outcome_files():
+            try:
+                stat = os.stat(filename)
+                cached = self._aggregates.get(filename)
+                if cached and cached[:2] == (stat.st_mtime, stat.st_size):
+                    agg = cached[2]
+                else:
+                    agg = aggregate_file(filename)
+                    # throughput and latency are not used, keep cached aggregates small
+                    agg['throughput'] = {}
+                    agg['latency'] = {}
+            except (OSError, ValueError) as e:
+                logging.warning('read outcome file {} failed: {}'.format(filename, e))
+                continue
+            aggregates[filename] = (stat.st_mtime, stat.st_size, agg)
+            merge_aggregates(total, agg)
+        self._aggregates = aggregates
+        return total
+
+    def refresh(self) -> dict:
+        """
+        Sample queues, checkpoint and outcome files.
+
+        :return: status
+        :rtype: dict
+        """
+        sample = self._scaler.sample()
+        now = sample['time']
+        dead = self._dead_queue_name
+        status = {
+            'time': now,
+            'queued': sample['backlog'] - sample['in_flight'],
+            'in_flight': sample['in_flight'],
+            'dead': sum(sample['queues'][dead].values()) if dead else 0,
+            'queues': sample['queues'],
+            'enqueued': None,
+            'done': None,
+            'failed': None
+        }
+        checkpoint = self.checkpoint()
+        if checkpoint:
+            status['enqueued'] = {'messages': checkpoint['messages'], 'keys': checkpoint['keys'],
+                                  'bytes': checkpoint['bytes']}
+            status['commander_finished'] = checkpoint.get('finished', False)
+        outcomes = self.outcomes()
+        if outcomes is not None:
+            # keys restoring are done when they are copied after restored
+            done = [item for action, item in outcomes['actions'].items()
+                    if action not in (ACTION_FAILED, ACTION_RESTORING)]
+            failed = outcomes['actions'].get(ACTION_FAILED, {'count': 0, 'bytes': 0})
+            # bytes of keys skipped are not transferred, they do not count in byte rate
+            status['done'] = {'keys': sum(item['count'] for item in done),
+                              'bytes': transferred_bytes(outcomes['actions'])}
+            status['failed'] = {'keys': failed['count'], 'bytes': failed['bytes'],
+                                'errors': dict(sorted(outcomes['errors'].items(), key=lambda item: -item[1]))}
+        self._samples.append((now, sample['backlog'], status['done']))
+        while len(self._samples) > 2 and self._samples[1][0] <= now - self._window_sec:
+            self._samples.popleft()
+        status.update(self.rates(status, outcomes))
+        return status
+
+    def rates(self, status: dict, outcomes: dict) -> dict:
+        """
+        Rates over samples in window, or average rates of outcome files for the first sample, and ETA.
+        """
+        first_time, first_backlog, first_done = self._samples[0]
+        now, backlog, done = self._samples[-1]
+        elapsed = now - first_time
+        rates = {'key_rate': None, 'byte_rate': None, 'message_rate': None, 'eta_sec': None}
+        if elapsed > 0:
+            rates['message_rate'] = (first_backlog - backlog) / elapsed
+            if done and first_done:
+                rates['key_rate'] = (done['keys'] - first_done['keys']) / elapsed
+                rates['byte_rate'] = (done['bytes'] - first_done['bytes']) / elapsed
+        elif outcomes and outcomes['first'] is not None and outcomes['last'] > outcomes['first']:
+            rates['key_rate'] = done['keys'] / (outcomes['last'] - outcomes['first'])
+            rates['byte_rate'] = done['bytes'] / (outcomes['last'] - outcomes['first'])
+        remaining = None
+        if status['enqueued'] and done:
+            remaining = max(status['enqueued']['keys'] - done['keys'], 0)
+        elif backlog:
+            remaining = int(round(backlog * self.keys_per_message(status, outcomes)))
+        rates['remaining_keys'] = remaining
+        if not backlog and remaining == 0:
+            rates['eta_sec'] = 0
+        elif remaining is not None and rates['key_rate']:
+            rates['eta_sec'] = remaining / rates['key_rate'] if rates['key_rate'] > 0 else None
+        elif rates['message_rate'] and rates['message_rate'] > 0:
+            rates['eta_sec'] = backlog / rates['message_rate']
+        return rates
+
+    def keys_per_message(self, status: dict, outcomes: dict) -> float:
+        """
+        Average keys per message enqueued by commander, or processed by executors, batch_num if unknown.
+        """
+        enqueued = status['enqueued']
+        if enqueued and enqueued['messages']:
+            return enqueued['keys'] / float(enqueued['messages'])
+        if outcomes and outcomes['messages']:
+            return outcomes['rows'] / outcomes['messages']
+        return self._batch_num
+
+
+def format_status(status: dict) -> str:
+    """
+    Status as text lines for terminal.
+    """
+    lines = ['{}'.format(time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(status['time'])))]
+    enqueued = status['enqueued']
+    if enqueued:
+        lines.append('enqueued   {:>14,} keys {:>12} {:>12,} messages{}'.format(
+            enqueued['keys'], format_bytes(enqueued['bytes']), enqueued['messages'],
+            ', commander finished' if status.get('commander_finished') else ''))
+    lines.append('queued     {:>14,} messages'.format(status['queued']))
+    lines.append('in flight  {:>14,} messages'.format(status['in_flight']))
+    lines.append('dead       {:>14,} messages'.format(status['dead']))
+    if status['done']:
+        done = status['done']
+        lines.append('done       {:>14,} keys {:>12}{}'.format(
+            done['keys'], format_bytes(done['bytes']),
+            '  {:.1%}'.format(done['keys'] / float(enqueued['keys'])) if enqueued and enqueued['keys'] else ''))
+        lines.append('failed     {:>14,} keys {:>12}  {}'.format(
+            status['failed']['keys'], format_bytes(status['failed']['bytes']),
+            ', '.join('{} {}'.format(error, n) for error, n in list(status['failed']['errors'].items())[:3])))
+    rate = []
+    if status['key_rate'] is not None:
+        rate.append('{:,.1f} keys/s'.format(status['key_rate']))
+    if status['byte_rate'] is not None:
+        rate.append('{}/s'.format(format_bytes(status['byte_rate'])))
+    if status['message_rate'] is not None:
+        rate.append('{:,.2f} messages/s'.format(status['message_rate']))
+    lines.append('rate       {}'.format(', '.join(rate) or '-'))
+    lines.append('eta        {}'.format(format_duration(status['eta_sec'])))
+    return '\n'.join(lines)
+
+
+def format_bytes(size) -> str:
+    size = float(size)
+    for unit in ['B', 'KB', 'MB', 'GB', 'TB']:
+        if abs(size) < 1024:
+            return '{:.1f} {}'.format(size, unit)
+        size /= 1024
+    return '{:.1f} PB'.format(size)
+
+
+def format_duration(seconds) -> str:
+    if seconds is None:
+        return '-'
+    seconds = int(seconds)
+    days, seconds = divmod(seconds, 86400)
+    hours, seconds = divmod(seconds, 3600)
+    minutes, seconds = divmod(seconds, 60)
+    return '{}{:02d}:{:02d}:{:02d}'.format('{}d '.format(days) if days else '', hours, minutes, seconds)
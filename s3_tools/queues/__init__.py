@@ -0,0 +1,237 @@
+"""
+Queue backends for migration tasks.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+QueueBackend is the interface commander and executors use to exchange messages:
+- send a message or a batch of messages, receive a batch of messages
+- ack (delete) messages, extend or reset visibility of in-flight messages
+- queue attributes for visible (depth) and in-flight messages
+Backends, selected by sqs.backend in config:
+- sqs: Amazon SQS queues, see s3_tools.aws_utils.sqs.SqsResource
+- local: durable queues in a local SQLite file, for single host or offline migrations,
+  see s3_tools.queues.local.LocalQueueResource
+Queue names, visibility timeout, retention and dead-letter queue are configured in sqs section for both backends.
+"""
+import time
+import random
+import logging
+
+BACKEND_SQS = 'sqs'
+BACKEND_LOCAL = 'local'
+# messages received more than this are moved to dead-letter queue
+MAX_RECEIVE_COUNT = 3
+
+
+class QueueBackend:
+
+    def __init__(self, settings):
+        self._settings = settings
+
+    def init_queues(self, queue_names=None):
+        """
+        Create dead-letter queue and queues redriven to it.
+
+        :param list queue_names: queues to create, default sqs.queue_num queues named by sqs.queue_name_pattern
+        """
+        raise NotImplementedError()
+
+    def send_message(self, message: dict, number: int=None, to_dead: bool=False, queue_name: str=None):
+        raise NotImplementedError()
+
+    def send_message_batch(self, messages, number: int=None, to_dead: bool=False, queue_name: str=None) -> list:
+        """
+        Send messages to one queue.
+
+        :param list messages: message bodies
+        :return: messages failed to send
+        :rtype: list
+        """
+        raise NotImplementedError()
+
+    def receive_message(self, number: int=None, including_dead: bool=False, queue_name: str=None,
+                        max_num: int=None, **kwargs):
+        """
+
+        :param max_num: max messages to receive, default sqs.max_receive_num
+        :param kwargs: extra arguments, WaitTimeSeconds and VisibilityTimeout are supported by all backends
+        :return: messages and queue url
+        :rtype: tuple
+        """
+        raise NotImplementedError()
+
+    def delete_message(self, queue_url, receipt_handle):
+        raise NotImplementedError()
+
+    def delete_message_batch(self, queue_url, receipt_handles):
+        """
+        Delete messages.
+
+        :param queue_url:
+        :param list receipt_handles:
+        :return: receipt handles failed to delete
+        :rtype: list
+        """
+        failed = []
+        for handle in receipt_handles:
+            try:
+                self.delete_message(queue_url, handle)
+            except Exception as e:
+                logging.warning('delete message failed: {}'.format(e))
+                failed.append(handle)
+        return failed
+
+    def change_message_visibility(self, queue_url, receipt_handle, visibility_timeout):
+        raise NotImplementedError()
+
+    def get_queue_attributes(self, queue_name, attribute_names=None):
+        """
+        Queue attributes named as SQS attributes, at least ApproximateNumberOfMessages
+        and ApproximateNumberOfMessagesNotVisible.
+
+        :return: attribute name to value
+        :rtype: dict
+        """
+        raise NotImplementedError()
+
+    def get_queue_url(self, queue_name):
+        """
+        Url of a queue, the queue name is the last part after /.
+        """
+        raise NotImplementedError()
+
+    def receive_message_loop(self, number: int=None, include_dead: bool=False, sleep_sec: int=5, scheduler=None,
+                             stopping=None):
+        """
+        Receive messages until stopping.
+
+        :param number: queue number, None for random pick, -1 for none
+        :param include_dead: receive from dead-letter queue too
+        :param sleep_sec: sleep seconds if no messages
+        :param scheduler: QueueScheduler to pick queues by depth, random pick if not provided
+        :param stopping: threading.Event to stop receiving, received messages not yet yielded are released,
+            also when the loop is closed
+        """
+        while not (stopping and stopping.is_set()):
+            if scheduler:
+                queue_name = scheduler.pick()
+                if not queue_name:
+                    logging.info('all queues empty, sleep for %s seconds', sleep_sec)
+                    time.sleep(sleep_sec)
+                    continue
+                messages, queue_url = self.receive_message(queue_name=queue_name)
+                scheduler.report(queue_name, len(messages))
+            else:
+                messages, queue_url = self.receive_message(number=number, including_dead=include_dead)
+            if messages:
+                logging.info('Receive %s messages from %s', len(messages), queue_url, extra={'event': 'receive'})
+                yielded = 0
+                try:
+                    for msg in messages:
+                        if stopping and stopping.is_set():
+                            return
+                        yielded += 1
+                        yield msg, queue_url
+                finally:
+                    # also when the loop is closed at yield, such as break on stopping
+                    self.release_messages(queue_url, messages[yielded:])
+            else:
+                logging.info('no message, sleep for %s seconds', sleep_sec)
+                time.sleep(sleep_sec)
+
+    def release_messages(self, queue_url, messages):
+        """
+        Make received messages visible again at once, so other executors receive them.
+        """
+        for msg in messages:
+            try:
+                self.change_message_visibility(queue_url, msg['ReceiptHandle'], 0)
+            except Exception as e:
+                logging.warning('release message failed: {}'.format(e))
+
+    def is_redelivered(self, message: dict, queue_url: str) -> bool:
+        """
+        Whether message has been received before, or comes from dead-letter queue after receives failed.
+
+        :param message: message received with ApproximateReceiveCount attribute
+        :param queue_url: queue url which the message received from
+        """
+        if queue_url and queue_url.rsplit('/', 1)[-1] == self.settings.get('sqs.dead_queue_name'):
+            return True
+        return int(message.get('Attributes', {}).get('ApproximateReceiveCount', 1)) > 1
+
+    def resolve_queue_name(self, number: int=None, to_dead: bool=False, queue_name: str=None) -> str:
+        """
+        Queue to send, queue_name if provided, otherwise dead-letter queue or a main queue.
+        """
+        if to_dead:
+            return self.settings.get('sqs.dead_queue_name')
+        return queue_name or self.get_queue_name(number)
+
+    def pick_queue_name(self, number: int=None, including_dead: bool=False) -> str:
+        """
+        Queue to receive, dead-letter queue is picked by half chance if including dead.
+        """
+        if including_dead and (number == -1 or random.randint(0, 1) == 0):
+            return self.settings.get('sqs.dead_queue_name')
+        return self.get_queue_name(number)
+
+    def get_queue_name(self, number: int=None):
+        pattern = self.settings.get('sqs.queue_name_pattern')
+        if not number:
+            num = self.settings.get('sqs.queue_num')
+            number = random.randint(1, num)
+        return pattern.format(number)
+
+    def get_queue_names(self, number: int=None, including_dead: bool=False):
+        """
+        Queue names an executor may receive from.
+
+        :param number: queue number, None for all queues, -1 for none
+        :param including_dead: include dead-letter queue
+        :return: list of queue names
+        :rtype: list
+        """
+        pattern = self.settings.get('sqs.queue_name_pattern')
+        if number == -1:
+            names = []
+        elif number:
+            names = [pattern.format(number)]
+        else:
+            names = [pattern.format(i) for i in range(1, self.settings.get('sqs.queue_num') + 1)]
+        if including_dead:
+            names.append(self.settings.get('sqs.dead_queue_name'))
+        return names
+
+    def get_queue_depth(self, queue_name):
+        """
+        Approximate number of visible messages in queue.
+
+        :param queue_name:
+        :return: message number
+        :rtype: int
+        """
+        attrs = self.get_queue_attributes(queue_name, ['ApproximateNumberOfMessages'])
+        return int(attrs.get('ApproximateNumberOfMessages', 0))
+
+    @property
+    def settings(self):
+        return self._settings
+
+
+def get_queue_backend(settings) -> QueueBackend:
+    """
+    Queue backend configured by sqs.backend, sqs by default.
+
+    :param settings:
+    :return: QueueBackend
+    :rtype: QueueBackend
+    """
+    backend = settings.get('sqs.backend', None) or BACKEND_SQS
+    if backend == BACKEND_SQS:
+        from s3_tools.aws_utils.sqs import SqsResource
+        return SqsResource(settings)
+    if backend == BACKEND_LOCAL:
+        from s3_tools.queues.local import LocalQueueResource
+        return LocalQueueResource(settings)
+    raise ValueError('queue backend {} not supported'.format(backend))
@@ -0,0 +1,192 @@
+"""
+Local queue backend.
+
+:Author: wuwentao <wuwentao@patsnap.com>
+
+Durable queues in a local SQLite file (sqs.local_file), with the semantics of SQS standard queues:
+- a received message is invisible for the visibility timeout, it is received again unless deleted
+- a message received more than MAX_RECEIVE_COUNT times is moved to the dead-letter queue
+- messages older than the retention period are dropped
+- long polling with WaitTimeSeconds
+Several processes on the same host can share the file, SQLite WAL mode and immediate transactions
+keep a message from being received by two consumers at the same time.
+"""
+import json
+import time
+import uuid
+import sqlite3
+import logging
+import threading
+from s3_tools.queues import QueueBackend, MAX_RECEIVE_COUNT
+
+URL_SCHEME = 'local://'
+# seconds between two polls of an empty queue while long polling
+POLL_SEC = 0.1
+
+
+class QueueDoesNotExist(Exception):
+    pass
+
+
+class LocalQueueResource(QueueBackend):
+
+    def __init__(self, settings, filename: str=None):
+        """
+
+        :param settings: settings with sqs section
+        :param filename: SQLite database file path, default sqs.local_file
+        """
+        super().__init__(settings)
+        self._filename = filename or settings.get('sqs.local_file', None) or 'queues.db'
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self._filename, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS queues ('
+                           'name TEXT PRIMARY KEY, '
+                           'visibility_timeout INTEGER NOT NULL, '
+                           'wait_time INTEGER NOT NULL, '
+                           'retention_period INTEGER NOT NULL, '
+                           'dead_queue TEXT)')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS messages ('
+                           'id INTEGER PRIMARY KEY AUTOINCREMENT, '
+                           'queue TEXT NOT NULL, '
+                           'body TEXT NOT NULL, '
+                           'sent_at REAL NOT NULL, '
+                           'visible_at REAL NOT NULL, '
+                           'receive_count INTEGER NOT NULL DEFAULT 0, '
+                           'receipt_handle TEXT)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_visible ON messages (queue, visible_at)')
+        self._conn.execute('CREATE INDEX IF NOT EXISTS messages_receipt ON messages (receipt_handle)')
+        self._queues = {}
+
+    def init_queues(self, queue_names=None):
+        vt = int(self.settings.get('sqs.visibility_timeout'))
+        wt = int(self.settings.get('sqs.receive_message_wait_time'))
+        rp = int(self.settings.get('sqs.message_retention_period'))
+        dead_queue = self.settings.get('sqs.dead_queue_name')
+        if queue_names is None:
+            pattern = self.settings.get('sqs.queue_name_pattern')
+            queue_names = [pattern.format(i) for i in range(1, self.settings.get('sqs.queue_num') + 1)]
+        with self._lock:
+            for queue_name, dead in [(dead_queue, None)] + [(name, dead_queue) for name in queue_names]:
+                logging.info('Create queue {} in {}'.format(queue_name, self._filename))
+                self._conn.execute('INSERT OR IGNORE INTO queues (name, visibility_timeout, wait_time, '
+                                   'retention_period, dead_queue) VALUES (?, ?, ?, ?, ?)',
+                                   (queue_name, vt, wt, rp, dead))
+
+    def send_message(self, message: dict, number: int=None, to_dead: bool=False, queue_name: str=None):
+        queue_name = self.resolve_queue_name(number, to_dead, queue_name)
+        logging.info('Send message to queue %s', queue_name, extra={'event': 'send'})
+        self._insert(queue_name, [json.dumps(message)])
+
+    def send_message_batch(self, messages, number: int=None, to_dead: bool=False, queue_name: str=None) -> list:
+        queue_name = self.resolve_queue_name(number, to_dead, queue_name)
+        logging.info('Send %s messages to queue %s', len(messages), queue_name, extra={'event': 'send'})
+        self._insert(queue_name, [json.dumps(m) for m in messages])
+        return []
+
+    def _insert(self, queue_name, bodies):
+        self._get_queue(queue_name)
+        now = time.time()
+        with self._lock:
+            self._conn.executemany('INSERT INTO messages (queue, body, sent_at, visible_at) VALUES (?, ?, ?, ?)',
+                                   [(queue_name, body, now, now) for body in bodies])
+
+    def receive_message(self, number: int=None, including_dead: bool=False, queue_name: str=None,
+                        max_num: int=None, **kwargs):
+        if not queue_name:
+            queue_name = self.pick_queue_name(number, including_dead)
+        queue = self._get_queue(queue_name)
+        max_num = max_num or self.settings.get('sqs.max_receive_num')
+        wait_time = kwargs.get('WaitTimeSeconds', queue['wait_time'])
+        visibility_timeout = kwargs.get('VisibilityTimeout', queue['visibility_timeout'])
+        deadline = time.time() + wait_time
+        while True:
+            messages = self._receive(queue, max_num, visibility_timeout)
+            if messages or time.time() >= deadline:
+                return messages, self.get_queue_url(queue_name)
+            time.sleep(POLL_SEC)
+
+    def _receive(self, queue, max_num, visibility_timeout):
+        now = time.time()
+        messages = []
+        with self._lock:
+            self._conn.execute('BEGIN IMMEDIATE')
+            try:
+                self._conn.execute('DELETE FROM messages WHERE queue=? AND sent_at<?',
+                                   (queue['name'], now - queue['retention_period']))
+                rows = self._conn.execute('SELECT id, body, receive_count FROM messages '
+                                          'WHERE queue=? AND visible_at<=? ORDER BY visible_at, id LIMIT ?',
+                                          (queue['name'], now, max_num)).fetchall()
+                for message_id, body, receive_count in rows:
+                    if receive_count >= MAX_RECEIVE_COUNT and queue['dead_queue']:
+                        # redrive like SQS, received count is reset in dead-letter queue
+                        self._conn.execute('UPDATE messages SET queue=?, visible_at=?, receive_count=0, '
+                                           'receipt_handle=NULL WHERE id=?', (queue['dead_queue'], now, message_id))
+                        continue
+                    receipt_handle = '{}:{}'.format(message_id, uuid.uuid4().hex)
+                    self._conn.execute('UPDATE messages SET visible_at=?, receive_count=?, receipt_handle=? '
+                                       'WHERE id=?', (now + visibility_timeout, receive_count + 1, receipt_handle,
+                                                      message_id))
+                    messages.append({
+                        'MessageId': str(message_id),
+                        'ReceiptHandle': receipt_handle,
+                        'Body': body,
+                        'Attributes': {'ApproximateReceiveCount': str(receive_count + 1)}
+                    })
+                self._conn.execute('COMMIT')
+            except Exception:
+                self._conn.execute('ROLLBACK')
+                raise
+        return messages
+
+    def delete_message(self, queue_url, receipt_handle):
+        logging.info('Delete message %s', receipt_handle, extra={'event': 'delete_message'})
+        with self._lock:
+            self._conn.execute('DELETE FROM messages WHERE receipt_handle=?', (receipt_handle,))
+
+    def delete_message_batch(self, queue_url, receipt_handles):
+        with self._lock:
+            self._conn.executemany('DELETE FROM messages WHERE receipt_handle=?', [(h,) for h in receipt_handles])
+        logging.info('Delete %s messages', len(receipt_handles), extra={'event': 'delete_message'})
+        return []
+
+    def change_message_visibility(self, queue_url, receipt_handle, visibility_timeout):
+        logging.debug('Change message visibility %s to %s seconds', receipt_handle, visibility_timeout)
+        with self._lock:
+            self._conn.execute('UPDATE messages SET visible_at=? WHERE receipt_handle=?',
+                               (time.time() + int(visibility_timeout), receipt_handle))
+
+    def get_queue_attributes(self, queue_name, attribute_names=None):
+        queue = self._get_queue(queue_name)
+        now = time.time()
+        with self._lock:
+            visible, not_visible = self._conn.execute(
+                'SELECT COALESCE(SUM(visible_at<=?), 0), COALESCE(SUM(visible_at>?), 0) FROM messages WHERE queue=?',
+                (now, now, queue_name)).fetchone()
+        return {
+            'QueueArn': self.get_queue_url(queue_name),
+            'ApproximateNumberOfMessages': str(visible),
+            'ApproximateNumberOfMessagesNotVisible': str(not_visible),
+            'ApproximateNumberOfMessagesDelayed': '0',
+            'VisibilityTimeout': str(queue['visibility_timeout']),
+            'ReceiveMessageWaitTimeSeconds': str(queue['wait_time']),
+            'MessageRetentionPeriod': str(queue['retention_period'])
+        }
+
+    def get_queue_url(self, queue_name):
+        return URL_SCHEME + queue_name
+
+    def _get_queue(self, queue_name) -> dict:
+        queue = self._queues.get(queue_name)
+        if queue is None:
+            with self._lock:
+                row = self._conn.execute('SELECT name, visibility_timeout, wait_time, retention_period, dead_queue '
+                                         'FROM queues WHERE name=?', (queue_name,)).fetchone()
+            if not row:
+                raise QueueDoesNotExist('queue {} does not exist in {}, run init first'.format(
+                    queue_name, self._filename))
+            queue = dict(zip(['name', 'visibility_timeout', 'wait_time', 'retention_period', 'dead_queue'], row))
+            self._queues[queue_name] = queue
+        return queue
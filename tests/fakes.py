@@ -0,0 +1,111 @@
+"""
+In memory SQS and S3 resources shared by tests
+"""
+import json
+
+
+class ClientError(Exception):
+
+    def __init__(self, code, status=400):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}
+
+
+class FakeSqs:
+    """
+    Queue resource recording sent, dead-lettered and deleted messages
+
+    :param messages: bodies of messages to receive
+    :param depths: queue name to visible count, or (visible, in flight) tuple
+    """
+
+    def __init__(self, messages=None, depths=None):
+        self.settings = {'sqs.dead_queue_name': 'dead'}
+        self.messages = [{'Body': json.dumps(m), 'ReceiptHandle': str(i)} for i, m in enumerate(messages or [])]
+        self.depths = depths or {}
+        # (queue name, message)
+        self.sent = []
+        self.dead = []
+        self.deleted = []
+        self.changed = []
+
+    def receive_message(self, queue_name=None, max_num=10, **kwargs):
+        batch, self.messages = self.messages[:max_num], self.messages[max_num:]
+        return batch, queue_name
+
+    def send_message(self, message, number=None, to_dead=False, queue_name=None):
+        (self.dead if to_dead else self.sent).append((queue_name, message))
+
+    def send_message_batch(self, messages, number=None, queue_name=None):
+        self.sent.extend((queue_name, m) for m in messages)
+        return []
+
+    def get_queue_name(self, number=None):
+        return 'main'
+
+    def delete_message(self, queue_url, receipt_handle):
+        self.deleted.append(receipt_handle)
+
+    def delete_message_batch(self, queue_url, receipt_handles):
+        self.deleted.extend(receipt_handles)
+        return []
+
+    def change_message_visibility(self, queue_url, receipt_handle, visibility_timeout):
+        self.changed.append(visibility_timeout)
+
+    def depth(self, queue_name) -> tuple:
+        depth = self.depths[queue_name]
+        return depth if isinstance(depth, tuple) else (depth, 0)
+
+    def get_queue_depth(self, queue_name):
+        return self.depth(queue_name)[0]
+
+    def get_queue_attributes(self, queue_name, attribute_names=None):
+        visible, in_flight = self.depth(queue_name)
+        return {'ApproximateNumberOfMessages': str(visible), 'ApproximateNumberOfMessagesNotVisible': str(in_flight)}
+
+
+class FakeS3:
+    """
+    Object resource over a dict of key to head, restores of archived objects start at once
+
+    :param objects: key to head, None if missing
+    """
+
+    def __init__(self, objects):
+        self.objects = objects
+        self.restores = []
+        self.heads = []
+        # errors raised by next restores
+        self.errors = []
+
+    def restore_object(self, bucket, key, days=7, tier='Bulk', **kwargs):
+        self.restores.append((key, tier))
+        if self.errors:
+            raise self.errors.pop(0)
+        head = self.objects.get(key)
+        if head is None:
+            raise ClientError('NoSuchKey', 404)
+        if 'Restore' in head:
+            if 'ongoing-request="true"' in head['Restore']:
+                raise ClientError('RestoreAlreadyInProgress', 409)
+            return {'ResponseMetadata': {'HTTPStatusCode': 200}}
+        head['Restore'] = 'ongoing-request="true"'
+        return {'ResponseMetadata': {'HTTPStatusCode': 202}}
+
+    def head_object(self, bucket, key, **kwargs):
+        self.heads.append(key)
+        head = self.objects.get(key)
+        if head is None:
+            raise ClientError('404', 404)
+        return head
+
+    def list_common_prefixes(self, bucket, prefix=None, delimiter='/'):
+        prefix = prefix or ''
+        return sorted(set(prefix + k[len(prefix):].split(delimiter)[0] + delimiter for k in self.objects
+                          if k.startswith(prefix) and delimiter in k[len(prefix):]))
+
+    def list_objects_all(self, bucket, prefix=None, batch_num=1000, delimiter=None):
+        prefix = prefix or ''
+        keys = [k for k in self.objects if k.startswith(prefix) and not (delimiter and delimiter in k[len(prefix):])]
+        yield [dict(self.objects[k], Key=k) for k in keys]
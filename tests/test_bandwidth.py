@@ -0,0 +1,55 @@
+import os
+import json
+import time
+from s3_tools.aws_utils.bandwidth import TokenBucket, FleetBudget
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def sleep(self, sec):
+        self.now += sec
+
+
+class TestTokenBucket:
+
+    def test_rate(self):
+        clock = FakeClock()
+        bucket = TokenBucket(100, clock=clock.time, sleep=clock.sleep)
+        for _ in range(10):
+            bucket.consume(50)
+        assert abs(clock.now - 5) < 1e-9
+        assert bucket.consumed == 500
+
+    def test_no_limit(self):
+        clock = FakeClock()
+        bucket = TokenBucket(0, clock=clock.time, sleep=clock.sleep)
+        bucket.consume(10 ** 9)
+        bucket.callback(bytes_transferred=-10)
+        assert clock.now == 0
+        assert bucket.consumed == 10 ** 9
+
+
+class TestFleetBudget:
+
+    def test_share_budget(self, tmpdir):
+        directory = str(tmpdir)
+        bucket = TokenBucket(0)
+        budget = FleetBudget(bucket, directory, default_budget=300)
+        for name, updated_at, active in [('a', time.time(), True), ('b', time.time(), False), ('c', 0, True)]:
+            with open(os.path.join(directory, name + '.json'), 'w') as fp:
+                json.dump({'updated_at': updated_at, 'active': active}, fp)
+        budget.update()
+        assert bucket.rate == 150
+        assert not os.path.exists(os.path.join(directory, 'c.json'))
+        with open(os.path.join(directory, FleetBudget.BUDGET_FILENAME), 'w') as fp:
+            fp.write('1000\n')
+        budget.update()
+        assert bucket.rate == 500
+        FleetBudget(bucket, directory, max_rate=100).update()
+        assert bucket.rate == 100
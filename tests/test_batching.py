@@ -0,0 +1,118 @@
+import time
+from s3_tools.migration import outcomes
+from s3_tools.migration import batching
+from s3_tools.migration.batching import BatchSizer, fit_sums, file_sums, MAX_MESSAGE_BYTES
+from s3_tools.migration.commander import MessageBatcher
+from s3_tools.migration.outcomes import OutcomeWriter
+
+
+class FakeLister:
+    batch_num = 10
+
+    def make_message(self, keys, **kwargs):
+        return dict(keys=keys, **kwargs)
+
+
+class PastClock:
+
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def time(self):
+        return time.time() - self.seconds
+
+    def strftime(self, *args):
+        return time.strftime(*args)
+
+
+def write_outcomes(directory, sizes, per_key=0.01, per_byte=1e-8):
+    writer = OutcomeWriter(str(directory))
+    for i, size in enumerate(sizes):
+        writer.record('bucket', str(i), 'copied', size=size, latency=per_key + size * per_byte)
+    writer.record('bucket', 'x', 'failed', size=10 ** 9, latency=100.0, error='SlowDown')
+    writer.close()
+
+
+def new_sizer(directory, **kwargs):
+    return BatchSizer(100, target_ratio=0.5, batch_num=10, max_num=1000,
+                      outcome_files=lambda: [str(f) for f in directory.listdir()], **kwargs)
+
+
+class TestBatchSizer:
+
+    def test_fit(self):
+        rows = [(1000, 2.0), (3000, 4.0)]
+        sums = (2, sum(s for s, _ in rows), sum(l for _, l in rows), sum(s * s for s, _ in rows),
+                sum(s * l for s, l in rows))
+        per_key, per_byte = fit_sums(sums)
+        assert abs(per_key - 1.0) < 1e-9 and abs(per_byte - 0.001) < 1e-12
+        # latency decreasing with size is not a negative cost
+        assert fit_sums((2, 3000, 3, 5000000, 2000))[1] == 0.0
+
+    def test_update(self, tmpdir):
+        write_outcomes(tmpdir, [i * 1000000 for i in range(200)])
+        sizer = new_sizer(tmpdir)
+        # batch_num keys until fitted
+        assert not sizer.full(9, 0.0, 100) and sizer.full(10, 0.0, 100)
+        sizer.update()
+        per_key, per_byte = sizer.model
+        assert abs(per_key - 0.01) < 1e-3 and abs(per_byte - 1e-8) < 1e-10
+        # 50 seconds per message, at most max_num keys
+        assert sizer.keys_for(0) == 1000
+        assert sizer.keys_for(10 ** 9) == 5
+        assert sizer.full(1, 0.0, MAX_MESSAGE_BYTES)
+
+    def test_file_sums(self, tmpdir, monkeypatch):
+        write_outcomes(tmpdir, [i * 1000000 for i in range(200)])
+        filename = str(tmpdir.listdir()[0])
+        sums, last = file_sums(filename)
+        # failed row is ignored
+        assert sums[0] == 200 and sums[1] == sum(i * 1000000 for i in range(200))
+        monkeypatch.setattr(batching, 'np', None)
+        expected_sums, expected_last = file_sums(filename)
+        assert all(abs(a - b) <= 1e-9 * max(abs(b), 1) for a, b in zip(sums, expected_sums))
+        assert last == expected_last
+
+    def test_not_enough_rows(self, tmpdir):
+        write_outcomes(tmpdir, [1000] * 10)
+        sizer = new_sizer(tmpdir)
+        sizer.update()
+        assert sizer.model is None and sizer.cost(1000) == 0.0
+
+    def test_old_files(self, tmpdir):
+        write_outcomes(tmpdir, [1000] * 200)
+        sizer = new_sizer(tmpdir, window_sec=-10)
+        sizer.update()
+        assert sizer.model is None
+
+    def test_old_rows(self, tmpdir, monkeypatch):
+        # files downloaded from S3 are modified recently, their rows are not
+        monkeypatch.setattr(outcomes, 'time', PastClock(7200))
+        write_outcomes(tmpdir, [1000] * 200)
+        monkeypatch.undo()
+        sizer = new_sizer(tmpdir, window_sec=1800)
+        sizer.update()
+        assert sizer.model is None
+        sizer = new_sizer(tmpdir, window_sec=10800)
+        sizer.update()
+        assert sizer.model is not None
+
+
+class TestMessageBatcher:
+
+    def test_adaptive(self, tmpdir):
+        write_outcomes(tmpdir, [i * 1000000 for i in range(200)])
+        sizer = new_sizer(tmpdir)
+        sizer.update()
+        batcher = MessageBatcher(FakeLister(), sizer=sizer)
+        messages = [batcher.add(0, {'Key': str(i), 'Size': 10 ** 9}) for i in range(10)]
+        assert [len(m['keys']) for m in messages if m] == [5, 5]
+        assert [len(m['keys']) for m in batcher.flush(0)] == []
+        messages = [batcher.add(0, {'Key': str(i), 'Size': 1}) for i in range(2500)]
+        assert [len(m['keys']) for m in messages if m] == [1000, 1000]
+
+    def test_fixed(self):
+        batcher = MessageBatcher(FakeLister())
+        messages = [batcher.add(0, {'Key': str(i), 'Size': 10 ** 9}) for i in range(25)]
+        assert [len(m['keys']) for m in messages if m] == [10, 10]
+        assert [len(m['keys']) for m in batcher.flush(0)] == [5]
@@ -0,0 +1,46 @@
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY, \
+    SIZE_KEY, ERROR_KEY, ACTION_KEY, ACTION_DELETE
+from s3_tools.migration.deadletter import DeadLetterTriage, key_prefix, replay_held
+from tests.fakes import FakeSqs
+
+
+def make_key(key, error=None, size=1):
+    item = {SOURCE_KEY_KEY: key, TARGET_KEY_KEY: key, SIZE_KEY: size}
+    if error:
+        item[ERROR_KEY] = error
+    return item
+
+
+class TestDeadLetter:
+
+    def test_key_prefix(self):
+        assert key_prefix('a/b/c', 1) == 'a/'
+        assert key_prefix('a/b/c', 5) == 'a/b/'
+        assert key_prefix('%E4%B8%AD/c', 1) == '中/'
+        assert key_prefix('c', 1) == ''
+
+    def test_triage(self, tmpdir):
+        hold_file = str(tmpdir.join('held.jsonl'))
+        messages = [
+            {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't',
+             KEYS_KEY: [make_key('a/{}'.format(i), 'SlowDown') for i in range(3)] + [make_key('b/1', 'AccessDenied')]},
+            {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't', KEYS_KEY: [make_key('a/3'), make_key('b/2', 'AccessDenied')]},
+            {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't', ACTION_KEY: ACTION_DELETE, KEYS_KEY: [make_key('c')]},
+        ]
+        sqs = FakeSqs(messages)
+        triage = DeadLetterTriage(sqs, batch_num=2, hold_errors=['AccessDenied'], hold_file=hold_file,
+                                  concurrency=2)
+        summary = triage.run()
+        assert sorted(sqs.deleted) == ['0', '1', '2']
+        assert [len(m[KEYS_KEY]) for _, m in sqs.sent if ACTION_KEY not in m] == [2, 2]
+        assert [m[KEYS_KEY][0][SOURCE_KEY_KEY] for _, m in sqs.sent if m.get(ACTION_KEY) == ACTION_DELETE] == ['c']
+        assert all(ERROR_KEY not in k for _, m in sqs.sent for k in m[KEYS_KEY])
+        assert summary['keys'] == 7 and summary['retried_keys'] == 5 and summary['held_keys'] == 2
+        assert summary['errors']['SlowDown'] == {'keys': 3, 'bytes': 3, 'retry': True, 'top_prefixes': {'a/': 3}}
+        assert summary['errors']['AccessDenied']['top_prefixes'] == {'b/': 2}
+        assert summary['errors']['Unknown']['keys'] == 2
+
+        replay = FakeSqs([])
+        assert replay_held(replay, hold_file) == 2
+        assert [k[SOURCE_KEY_KEY] for k in replay.sent[0][1][KEYS_KEY]] == ['b/1', 'b/2']
+        assert ERROR_KEY not in replay.sent[0][1][KEYS_KEY][0]
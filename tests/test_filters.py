@@ -0,0 +1,53 @@
+import pytest
+from datetime import datetime, timezone
+from s3_tools.migration.commander import InventoryLister
+from s3_tools.migration.executor import Executor
+from s3_tools.migration.filters import RowFilter, FILTER_MODIFIED, FILTER_NOT_MODIFIED, FILTER_SIZE, \
+    FILTER_STORAGE_CLASS, iso_second
+
+ROWS = [
+    {'Key': 'old', 'Size': '10', 'LastModifiedDate': '2020-12-31T23:59:59.000Z', 'StorageClass': 'STANDARD'},
+    {'Key': 'new', 'Size': '10', 'LastModifiedDate': '2021-01-01T00:00:00.000Z', 'StorageClass': 'STANDARD'},
+    {'Key': 'listed', 'Size': 10, 'LastModifiedDate': '2021-01-01T08:00:00+00:00', 'StorageClass': 'STANDARD'},
+    {'Key': 'later', 'Size': '10', 'LastModifiedDate': '2021-02-01T00:00:00.000Z', 'StorageClass': 'STANDARD'},
+    {'Key': 'big', 'Size': '1000', 'LastModifiedDate': '2021-01-02T00:00:00.000Z', 'StorageClass': 'STANDARD'},
+    {'Key': 'cold', 'Size': '10', 'LastModifiedDate': '2021-01-02T00:00:00.000Z', 'StorageClass': 'GLACIER'},
+    {'Key': 'unknown', 'Size': ''},
+]
+
+
+class FakeLister(InventoryLister):
+
+    def list_source_rows(self, source_index, **kwargs):
+        for row in ROWS:
+            yield row
+
+
+class TestRowFilter:
+
+    def test_filters(self):
+        row_filter = RowFilter(modified_since='2021-01-01', not_modified_since='2021-02-01T08:00:00+08:00',
+                               max_size=100, storage_classes=['STANDARD', 'STANDARD_IA'])
+        assert [row['Key'] for row in ROWS if row_filter.accept(row)] == ['new', 'listed', 'unknown']
+        assert row_filter.rejected == {FILTER_MODIFIED: 1, FILTER_NOT_MODIFIED: 1, FILTER_SIZE: 1,
+                                       FILTER_STORAGE_CLASS: 1}
+
+    def test_lister(self):
+        lister = FakeLister('source', 'target', modified_since=None, min_size=100)
+        keys = [k['source_key'] for _, msg in lister.list_batches() for k in msg['keys']]
+        assert keys == ['big', 'unknown']
+        assert FakeLister('source', 'target').row_filter is None
+        with pytest.raises(ValueError):
+            lister.row_filter.check_schema(['Bucket', 'Key'])
+        assert lister.row_filter.spec == {'min_size': 100}
+
+    def test_executor_same_window(self):
+        # commander and executor apply both bounds of the window the same way
+        since, before = '2021-01-01', '2021-02-01T08:00:00+08:00'
+        row_filter = RowFilter(modified_since=since, not_modified_since=before)
+        for value in ['2020-12-31T23:59:59', '2021-01-01T00:00:00', '2021-01-31T23:59:59', '2021-02-01T00:00:00']:
+            modified = datetime.strptime(value, '%Y-%m-%dT%H:%M:%S').replace(tzinfo=timezone.utc)
+            accepted = row_filter.accept({'LastModifiedDate': value + '.000Z'})
+            assert Executor.verify_modified({'LastModified': modified}, iso_second(since), iso_second(before)) \
+                == accepted
+        assert Executor.verify_modified({'LastModified': datetime(2000, 1, 1, tzinfo=timezone.utc)})
@@ -0,0 +1,47 @@
+import threading
+from s3_tools.migration.heartbeat import VisibilityHeartbeat
+from tests.fakes import FakeSqs
+
+
+class TestVisibilityHeartbeat:
+
+    queue_url = 'https://sqs.cn-north-1.amazonaws.com.cn/123456789012/s3-migration-01'
+    body = {
+        'source_bucket': 'source',
+        'target_bucket': 'target',
+        'keys': [{'source_key': k, 'target_key': k} for k in ['a', 'b', 'c']]
+    }
+
+    def test_handoff_keys_not_done(self):
+        sqs = FakeSqs()
+        stopping = threading.Event()
+        heartbeat = VisibilityHeartbeat(sqs, self.queue_url, 'handle', self.body, stopping=stopping)
+        assert heartbeat.begin() is True
+        stopping.set()
+        # key in progress is not handed off while it is still being copied
+        heartbeat.beat()
+        assert heartbeat.handed_off is False and not sqs.sent
+        heartbeat.done(0)
+        assert heartbeat.begin() is False
+        assert heartbeat.handed_off is True
+        queue_name, message = sqs.sent[0]
+        assert queue_name == 's3-migration-01'
+        assert [k['source_key'] for k in message['keys']] == ['b', 'c']
+        assert sqs.deleted == ['handle']
+
+    def test_extend_visibility(self):
+        sqs = FakeSqs()
+        heartbeat = VisibilityHeartbeat(sqs, self.queue_url, 'handle', self.body, visibility_timeout=30)
+        heartbeat._visible_at -= 15
+        heartbeat.beat()
+        assert sqs.changed == [30]
+        heartbeat.beat()
+        assert sqs.changed == [30]
+
+    def test_handoff_before_deadline(self):
+        sqs = FakeSqs()
+        heartbeat = VisibilityHeartbeat(sqs, self.queue_url, 'handle', self.body, visibility_timeout=30,
+                                        deadline_sec=20)
+        heartbeat.beat()
+        assert heartbeat.handed_off is True
+        assert len(sqs.sent[0][1]['keys']) == 3
@@ -0,0 +1,48 @@
+import os
+from s3_tools.migration.journal import CompletionJournal
+
+
+class TestCompletionJournal:
+
+    param = {
+        'source_bucket': 'source',
+        'source_key': 'test/test.txt',
+        'target_bucket': 'target',
+        'target_key': 'test/test.txt'
+    }
+
+    def test_record(self, tmpdir):
+        journal = CompletionJournal(os.path.join(str(tmpdir), 'journal.db'))
+        assert journal.contains(**self.param) is False
+        journal.record(etag='"abc"', size=10, **self.param)
+        # without ETag, a record of any version only matches if accepted
+        assert journal.contains(**self.param) is False
+        assert journal.contains(any_version=True, **self.param) is True
+        assert journal.contains(size=11, any_version=True, **self.param) is False
+        assert journal.contains(etag='"abc"', **self.param) is True
+        assert journal.contains(etag='"abc"', size=10, **self.param) is True
+        assert journal.contains(etag='"def"', any_version=True, **self.param) is False
+        journal.close()
+        journal = CompletionJournal(os.path.join(str(tmpdir), 'journal.db'))
+        assert journal.contains(any_version=True, **self.param) is True
+
+    def test_evict(self, tmpdir):
+        journal = CompletionJournal(os.path.join(str(tmpdir), 'journal.db'), max_entries=10)
+        for i in range(20):
+            journal.record(source_bucket='source', source_key=str(i), target_bucket='target', target_key=str(i))
+        journal.evict()
+        assert len(journal) == 10
+        assert journal.contains(source_bucket='source', source_key='0', target_bucket='target', target_key='0',
+                                any_version=True) is False
+        assert journal.contains(source_bucket='source', source_key='19', target_bucket='target', target_key='19',
+                                any_version=True) is True
+
+    def test_export_merge(self, tmpdir):
+        journal1 = CompletionJournal(os.path.join(str(tmpdir), 'journal1.db'))
+        journal1.record(etag='abc', size=10, **self.param)
+        export_file = os.path.join(str(tmpdir), 'journal1.jsonl')
+        assert journal1.export(export_file) == 1
+        journal2 = CompletionJournal(os.path.join(str(tmpdir), 'journal2.db'))
+        assert journal2.merge(export_file) == 1
+        assert journal2.contains(etag='abc', **self.param) is True
+        assert journal2.contains(etag='abc', size=11, **self.param) is False
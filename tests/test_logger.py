@@ -0,0 +1,46 @@
+import json
+import queue
+import logging
+from s3_tools.logger import BackgroundHandler, JsonFormatter, EventSampler, EventRateLimiter
+
+
+def make_record(level=logging.INFO, event=None, msg='copy object %s/%s successfully', args=('bucket', 'key')):
+    record = logging.LogRecord('root', level, __file__, 1, msg, args, None)
+    if event:
+        record.event = event
+    return record
+
+
+class TestLogger:
+
+    def test_json_formatter(self):
+        data = json.loads(JsonFormatter().format(make_record(event='copied')))
+        assert data['message'] == 'copy object bucket/key successfully'
+        assert data['event'] == 'copied'
+        assert data['level'] == 'INFO'
+
+    def test_sampler(self):
+        sampler = EventSampler({'copied': 3})
+        passed = [sampler.filter(make_record(event='copied')) for _ in range(7)]
+        assert passed == [True, False, False, True, False, False, True]
+        assert sampler.filter(make_record(event='receive'))
+        assert sampler.filter(make_record(level=logging.WARNING, event='copied'))
+
+    def test_rate_limiter(self):
+        now = [0.0]
+        limiter = EventRateLimiter(2, clock=lambda: now[0])
+        assert [limiter.filter(make_record(event='copied')) for _ in range(3)] == [True, True, False]
+        assert limiter.filter(make_record(event='skipped'))
+        assert limiter.filter(make_record(level=logging.ERROR, event='copied'))
+        now[0] = 0.5
+        assert limiter.filter(make_record(event='copied'))
+        assert not limiter.filter(make_record(event='copied'))
+
+    def test_background_handler_drops_info(self):
+        handler = BackgroundHandler(queue.Queue(1))
+        handler.handle(make_record())
+        handler.handle(make_record())
+        assert handler.dropped == 1
+        record = handler.queue.get_nowait()
+        # formatted by listener thread
+        assert record.args == ('bucket', 'key')
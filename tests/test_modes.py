@@ -0,0 +1,48 @@
+import json
+from s3_tools.migration.modes import ModeSelector, PATH_COPY, PATH_DOWNUP, size_class, is_denied
+
+
+class FakeClientError(Exception):
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class TestModeSelector:
+
+    def test_denied_pair(self, tmpdir):
+        cache_file = str(tmpdir.join('modes.json'))
+        selector = ModeSelector(cache_file=cache_file, deny_after=2)
+        assert is_denied(FakeClientError('AccessDenied')) and not is_denied(FakeClientError('SlowDown'))
+        assert selector.choose('a', 'b', 100) == PATH_COPY
+        selector.denied('a', 'b', 100)
+        selector.succeeded('a', 'b', PATH_DOWNUP, 100, 1.0)
+        assert selector.copy_allowed('a', 'b') is None
+        selector.denied('a', 'b', 100)
+        assert selector.copy_allowed('a', 'b') is False
+        assert selector.choose('a', 'b', 100) == PATH_DOWNUP
+        # cached for other executors
+        assert ModeSelector(cache_file=cache_file).choose('a', 'b', 100) == PATH_DOWNUP
+        assert json.load(open(cache_file))['a->b']['copy'] is False
+        report = selector.report()['size_classes']['<1MB'][PATH_DOWNUP]
+        assert report['objects'] == 1 and report['fallbacks'] == 2
+
+    def test_faster_path(self):
+        selector = ModeSelector(min_samples=2, explore_every=5)
+        selector.succeeded('a', 'b', PATH_COPY, 100, 1.0)
+        assert selector.copy_allowed('a', 'b') is True
+        size = 100 * 1048576
+        assert size_class(size) == '16MB-128MB'
+        paths = []
+        for _ in range(4):
+            path = selector.choose('a', 'b', size)
+            paths.append(path)
+            selector.succeeded('a', 'b', path, size, 1.0 if path == PATH_COPY else 4.0)
+        assert paths == [PATH_COPY, PATH_COPY, PATH_DOWNUP, PATH_DOWNUP]
+        paths = [selector.choose('a', 'b', size) for _ in range(5)]
+        assert paths == [PATH_COPY] * 4 + [PATH_DOWNUP]
+        # downup faster for small objects
+        for path, seconds in [(PATH_COPY, 2.0), (PATH_COPY, 2.0), (PATH_DOWNUP, 1.0), (PATH_DOWNUP, 1.0)]:
+            selector.succeeded('a', 'b', path, 1000, seconds)
+        assert selector.choose('a', 'b', 1000) == PATH_DOWNUP
@@ -0,0 +1,204 @@
+import hashlib
+import threading
+from datetime import datetime, timedelta, timezone
+from s3_tools.aws_utils.s3 import S3Resource, multipart_etag
+from s3_tools.migration.cleanup import cleanup_uploads
+from s3_tools.migration.executor import Executor
+
+NOW = datetime(2021, 1, 10, tzinfo=timezone.utc)
+DATA = b'abcdefghij'
+PART_SIZES = [4, 4, 2]
+
+
+def md5(data):
+    return '"{}"'.format(hashlib.md5(data).hexdigest())
+
+
+class FakeClientError(Exception):
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class FakeClient:
+
+    def __init__(self, source_etag=None):
+        self.source_etag = source_etag
+        self.uploads = {}
+        self.created = 0
+        self.copied = []
+        self.ranges = {}
+        self.etags = []
+        self.completed = []
+        self.aborted = []
+        self.lock = threading.Lock()
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        self.created += 1
+        upload_id = 'u{}'.format(self.created)
+        self.uploads[upload_id] = {'Key': Key, 'UploadId': upload_id, 'Initiated': NOW, 'Parts': {}}
+        return {'UploadId': upload_id}
+
+    def list_multipart_uploads(self, Bucket, Prefix='', **kwargs):
+        return {'Uploads': [dict((k, u[k]) for k in ('Key', 'UploadId', 'Initiated'))
+                            for u in self.uploads.values() if u['Key'].startswith(Prefix)]}
+
+    def list_parts(self, Bucket, Key, UploadId, **kwargs):
+        parts = self.uploads[UploadId]['Parts']
+        return {'Parts': [dict(PartNumber=n, **p) for n, p in sorted(parts.items())]}
+
+    def upload_part_copy(self, Bucket, Key, UploadId, PartNumber, CopySource, CopySourceRange, **kwargs):
+        if kwargs.get('CopySourceIfMatch') != self.source_etag:
+            raise FakeClientError('PreconditionFailed')
+        start, end = [int(i) for i in CopySourceRange[len('bytes='):].split('-')]
+        data = DATA[start:end + 1]
+        with self.lock:
+            self.copied.append(PartNumber)
+            self.ranges[PartNumber] = CopySourceRange
+            self.uploads[UploadId]['Parts'][PartNumber] = {'ETag': md5(data), 'Size': len(data)}
+        return {'CopyPartResult': {'ETag': md5(data)}}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        self.completed.append((UploadId, [p['PartNumber'] for p in MultipartUpload['Parts']]))
+        self.etags.append('"{}"'.format(multipart_etag(p['ETag'] for p in MultipartUpload['Parts'])))
+        del self.uploads[UploadId]
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.aborted.append(UploadId)
+        self.uploads.pop(UploadId, None)
+
+
+def make_s3(client):
+    s3 = S3Resource({})
+    s3._client = client
+    return s3
+
+
+class TestMultipartCopy:
+    source_etag = '"{}"'.format(multipart_etag([md5(DATA[0:4]), md5(DATA[4:8]), md5(DATA[8:10])]))
+
+    def copy(self, s3):
+        s3.multipart_copy('source', 'target', 'key', 'key', PART_SIZES, source_etag=self.source_etag, resume=True)
+
+    def test_keep_layout(self):
+        client = FakeClient(self.source_etag)
+        s3 = make_s3(client)
+        s3.multipart_copy('source', 'target', 'key', 'key', PART_SIZES, source_etag=self.source_etag)
+        assert client.ranges == {1: 'bytes=0-3', 2: 'bytes=4-7', 3: 'bytes=8-9'}
+        # target has the same part layout, so the same ETag as source
+        assert client.etags == [self.source_etag]
+
+    def test_resume(self):
+        client = FakeClient(self.source_etag)
+        s3 = make_s3(client)
+        upload_id = s3.create_multipart_upload('target', 'key')
+        client.uploads[upload_id]['Parts'][1] = {'ETag': md5(DATA[0:4]), 'Size': 4}
+        # part of another layout is copied again
+        client.uploads[upload_id]['Parts'][3] = {'ETag': md5(DATA[8:9]), 'Size': 1}
+        self.copy(s3)
+        assert sorted(client.copied) == [2, 3]
+        assert client.completed == [(upload_id, [1, 2, 3])]
+
+    def test_source_changed(self):
+        client = FakeClient(self.source_etag)
+        s3 = make_s3(client)
+        upload_id = s3.create_multipart_upload('target', 'key')
+        client.uploads[upload_id]['Parts'][1] = {'ETag': md5(b'old!'), 'Size': 4}
+        self.copy(s3)
+        assert client.aborted == [upload_id]
+        assert sorted(client.copied) == [1, 2, 2, 3, 3]
+        assert client.completed[0][1] == [1, 2, 3] and client.completed[0][0] != upload_id
+        # source changed while copying, upload is aborted instead of kept to resume
+        client = FakeClient('"other"')
+        s3 = make_s3(client)
+        try:
+            self.copy(s3)
+            assert False
+        except FakeClientError:
+            pass
+        assert client.aborted and not client.uploads
+
+
+class HeadClient:
+
+    def __init__(self, part_sizes):
+        self.part_sizes = part_sizes
+        self.heads = []
+
+    def head_object(self, Bucket, Key, PartNumber=None, **kwargs):
+        self.heads.append(PartNumber)
+        if len(self.part_sizes) == 1:
+            return {'ContentLength': self.part_sizes[0]}
+        return {'PartsCount': len(self.part_sizes), 'ContentLength': self.part_sizes[PartNumber - 1],
+                'ContentRange': 'bytes 0-{}/{}'.format(self.part_sizes[0] - 1, sum(self.part_sizes))}
+
+
+class TestPartSizes:
+
+    def test_same_size_parts(self):
+        client = HeadClient([8, 8, 3])
+        assert make_s3(client).get_part_sizes('source', 'key') == [8, 8, 3]
+        assert client.heads == [1]
+
+    def test_different_size_parts(self):
+        client = HeadClient([8, 2, 2])
+        assert make_s3(client).get_part_sizes('source', 'key') == [8, 2, 2]
+        assert client.heads == [1, 2, 3]
+
+    def test_single_part(self):
+        assert make_s3(HeadClient([10])).get_part_sizes('source', 'key') == []
+
+
+class TestVerifyObject:
+    source = {'ETag': '"abc-3"', 'ContentLength': 10, 'ChecksumSHA256': 'x-3'}
+
+    def test_same_etag(self):
+        assert Executor.verify_object(self.source, dict(self.source)) is True
+        assert Executor.verify_object(self.source, None) is False
+
+    def test_checksum_fallback(self):
+        # another part layout, same content by checksum
+        assert Executor.verify_object(self.source, {'ETag': '"def-2"', 'ContentLength': 10,
+                                                    'ChecksumSHA256': 'x-3'}) is True
+        assert Executor.verify_object(self.source, {'ETag': '"def-3"', 'ContentLength': 10,
+                                                    'ChecksumSHA256': 'y-3'}) is False
+        assert Executor.verify_object(self.source, {'ETag': '"def-3"', 'ContentLength': 11,
+                                                    'ChecksumSHA256': 'x-3'}) is False
+        # target copied in another layout without checksum is copied again
+        assert Executor.verify_object(self.source, {'ETag': '"def-2"', 'ContentLength': 10}) is False
+
+
+class TestCleanup:
+
+    def test_cleanup(self):
+        client = FakeClient()
+        s3 = make_s3(client)
+        stale = s3.create_multipart_upload('target', 'a/1')
+        client.uploads[stale]['Initiated'] = NOW - timedelta(days=8)
+        s3.create_multipart_upload('target', 'a/2')
+        other = s3.create_multipart_upload('target', 'b/1')
+        client.uploads[other]['Initiated'] = NOW - timedelta(days=8)
+        summary = cleanup_uploads(s3, 'target', prefix='a/', dry_run=True, now=NOW)
+        assert (summary['uploads'], summary['stale'], summary['aborted']) == (2, 1, 0)
+        summary = cleanup_uploads(s3, 'target', now=NOW)
+        assert (summary['uploads'], summary['stale'], summary['aborted']) == (3, 2, 2)
+        assert sorted(client.aborted) == sorted([stale, other])
+
+
+class TaggingClient:
+
+    def __init__(self):
+        self.calls = []
+
+    def put_object_tagging(self, **kwargs):
+        self.calls.append(kwargs)
+        return {'VersionId': 'v1'}
+
+
+def test_put_object_tagging():
+    client = TaggingClient()
+    s3 = make_s3(client)
+    tags = [{'Key': 'team', 'Value': 'data'}]
+    assert s3.put_object_tagging('target', 'key', tags) == {'VersionId': 'v1'}
+    assert client.calls == [{'Bucket': 'target', 'Key': 'key', 'Tagging': {'TagSet': tags}}]
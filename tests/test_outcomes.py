@@ -0,0 +1,76 @@
+import os
+import time
+import threading
+from s3_tools.migration import outcomes
+from s3_tools.migration.outcomes import OutcomeWriter, aggregate_file, aggregate_files, error_class
+
+
+class FakeClientError(Exception):
+
+    def __init__(self, code):
+        super().__init__(code)
+        self.response = {'Error': {'Code': code}}
+
+
+class SlowS3:
+
+    def __init__(self):
+        self.release = threading.Event()
+        self.uploaded = []
+
+    def upload_object(self, bucket, key, filename):
+        self.release.wait(10)
+        self.uploaded.append((bucket, key))
+
+
+class TestOutcomes:
+
+    def write(self, directory):
+        writer = OutcomeWriter(directory, rotate_rows=3)
+        writer.record('bucket', 'a', 'copied', size=100, latency=0.01, message_keys=2)
+        writer.record('bucket', 'b/中', 'failed', latency=0.5, error=error_class(FakeClientError('AccessDenied')),
+                      message_keys=2)
+        writer.record('bucket', 'c', 'skipped', size=10, latency=0.002)
+        writer.record('other', 'd', 'failed', error=error_class(ValueError()))
+        writer.close()
+        return sorted(os.path.join(directory, name) for name in os.listdir(directory))
+
+    def test_rotate_and_aggregate(self, tmpdir):
+        filenames = self.write(str(tmpdir))
+        assert len(filenames) == 2
+        report = aggregate_files(filenames, workers=1, failed_keys=True)
+        assert report['keys'] == 4
+        assert sum(aggregate_file(f)['messages'] for f in filenames) == 1
+        assert report['actions'] == {'copied': {'count': 1, 'bytes': 100}, 'skipped': {'count': 1, 'bytes': 10},
+                                     'failed': {'count': 2, 'bytes': 0}}
+        assert report['errors'] == {'AccessDenied': 1, 'ValueError': 1}
+        assert sorted(report['failed_keys']) == [('bucket', 'b/中', 'AccessDenied'), ('other', 'd', 'ValueError')]
+        assert report['latency']['copied']['p50'] >= 0.01
+        # skipped keys are done without transferring bytes
+        assert sum(v for _, v in report['throughput']) * 60 == 100
+        assert report['bytes_per_sec'] == 100 / (report['last'] - report['first'])
+
+    def test_python_fallback(self, tmpdir, monkeypatch):
+        filenames = self.write(str(tmpdir))
+        expected = [aggregate_file(f, failed_keys=True) for f in filenames]
+        monkeypatch.setattr(outcomes, 'np', None)
+        assert [aggregate_file(f, failed_keys=True) for f in filenames] == expected
+
+    def test_idle_flush_and_upload(self, tmpdir):
+        s3 = SlowS3()
+        writer = OutcomeWriter(str(tmpdir), rotate_sec=0.2, s3_path='s3://bucket/outcomes/', s3_resource=s3)
+        writer.record('bucket', 'a', 'copied', size=1)
+        # rows of an idle writer are written after rotate_sec
+        deadline = time.time() + 10
+        while not tmpdir.listdir(lambda f: f.ext == '.bin') and time.time() < deadline:
+            time.sleep(0.01)
+        assert len(tmpdir.listdir(lambda f: f.ext == '.bin')) == 1
+        # recording does not wait on the upload in progress
+        start = time.time()
+        writer.record('bucket', 'b', 'copied', size=1)
+        writer.flush()
+        assert time.time() - start < 1
+        s3.release.set()
+        writer.close()
+        assert len(s3.uploaded) == 2 and all(key.startswith('outcomes/') for _, key in s3.uploaded)
+        assert tmpdir.listdir() == []
@@ -0,0 +1,103 @@
+import os
+import sys
+import pytest
+from s3_tools.migration.pipeline import Pipeline, Stage
+from s3_tools.migration.checkpoint import CommanderCheckpoint
+from s3_tools.migration import commander
+from s3_tools.migration.commander import Commander, InventoryLister
+from tests.fakes import FakeSqs
+
+
+class FakeLister(InventoryLister):
+
+    def __init__(self, sources):
+        super().__init__('source', 'target')
+        self._batch_num = 2
+        self._sources = sources
+
+    def list_sources(self, **kwargs):
+        return list(range(len(self._sources)))
+
+    def list_source_rows(self, source_index, **kwargs):
+        for key in self._sources[source_index]:
+            yield {'Key': key, 'Size': 1}
+
+
+class TestPipeline:
+
+    def test_partition_keeps_order(self):
+        results = []
+
+        def expand(item, emit):
+            for i in range(5):
+                emit((item, i))
+
+        stages = [
+            Stage('expand', expand, workers=3),
+            Stage('collect', lambda item, emit: results.append(item), workers=2, partition=lambda item: item[0])
+        ]
+        pipeline = Pipeline(stages, queue_size=2, report_sec=0)
+        pipeline.run(range(4))
+        assert sorted(results) == [(s, i) for s in range(4) for i in range(5)]
+        for s in range(4):
+            assert [i for source, i in results if source == s] == list(range(5))
+        assert stages[0].items == 4
+        assert stages[1].items == 20
+
+    def test_error_aborts(self):
+        def fail(item, emit):
+            raise RuntimeError(item)
+
+        stages = [Stage('pass', lambda item, emit: emit(item), workers=2), Stage('fail', fail)]
+        with pytest.raises(RuntimeError):
+            Pipeline(stages, queue_size=1, report_sec=0).run(range(100))
+
+
+class TestCommander:
+
+    def test_batch_workers(self, monkeypatch):
+        sqs = FakeSqs()
+        monkeypatch.setattr(commander, 'get_queue_backend', lambda settings: sqs)
+        sources = [['{}/{}'.format(s, i) for i in range(s % 7)] for s in range(3000)]
+        cmd = Commander(FakeLister(sources))
+        # batch workers share the batcher, a flush of a source runs while others add keys
+        cmd._batch_workers = 4
+        cmd._list_workers = 8
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        try:
+            cmd.run()
+        finally:
+            sys.setswitchinterval(interval)
+        keys = [k['source_key'] for _, msg in sqs.sent for k in msg['keys']]
+        assert sorted(keys) == sorted(k for keys in sources for k in keys)
+        assert all(len(msg['keys']) <= 2 for _, msg in sqs.sent)
+        assert cmd._checkpoint.keys == len(keys)
+
+
+class TestCheckpoint:
+
+    def test_resume(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'checkpoint.json')
+        checkpoint = CommanderCheckpoint(filename, batch_num=2)
+        checkpoint.queued(0)
+        checkpoint.listed(0)
+        checkpoint.listed(1)
+        checkpoint.queued(2)
+        checkpoint.sent(0, 2, 10)
+        checkpoint.save(force=True)
+        checkpoint = CommanderCheckpoint(filename, batch_num=2)
+        assert checkpoint.done_sources == [1, 0]
+        assert not checkpoint.is_done(2)
+        assert checkpoint.keys == 2
+        assert checkpoint.bytes == 10
+        with pytest.raises(ValueError):
+            CommanderCheckpoint(filename, batch_num=3)
+
+
+class TestInventoryLister:
+
+    def test_list_batches_per_source(self):
+        lister = FakeLister([['a', 'b', 'c'], ['d']])
+        batches = [(i, [k['source_key'] for k in msg['keys']]) for i, msg in lister.list_batches()]
+        assert batches == [(0, ['a', 'b']), (0, ['c']), (1, ['d'])]
@@ -0,0 +1,48 @@
+from s3_tools.migration.planner import MigrationPlanner, PlanRouter, assign_runs, estimate_s3_calls
+
+
+class FakeLister:
+
+    batch_num = 2
+
+    def __init__(self, sources):
+        self.sources = sources
+
+    def list_batches(self, **kwargs):
+        for index, sizes in enumerate(self.sources):
+            for i in range(0, len(sizes), self.batch_num):
+                yield index, {
+                    'source_bucket': 'source',
+                    'target_bucket': 'target',
+                    'keys': [{'source_key': str(s), 'target_key': str(s), 'size': s} for s in sizes[i:i + 2]]
+                }
+
+
+class TestMigrationPlanner:
+
+    def test_assign_runs(self):
+        runs = [{'messages': 1, 'keys': 1, 'bytes': b} for b in [10, 7, 5, 3, 3, 2]]
+        queues = assign_runs(runs, 2)
+        assert sorted(q['bytes'] for q in queues.values()) == [15, 15]
+
+    def test_plan_and_route(self):
+        lister = FakeLister([[100, 100, 1, 1, 1, 1], [50, 50]])
+        planner = MigrationPlanner(lister, queue_num=2, run_num=1)
+        plan = planner.plan(executors=1)
+        assert plan['totals'] == {'messages': 4, 'keys': 8, 'bytes': 304}
+        assert plan['batch_num'] == 2
+        assert len(plan['assignments']['0']) == 3
+        assert sum(q['bytes'] for q in plan['queues'].values()) == 304
+        router = PlanRouter(plan)
+        # the biggest run is alone in its queue
+        big = router.route(0)
+        assert router.route(0) != big
+        assert router.route(0) != big
+        assert router.route(1) != big
+        assert router.route(1) is None
+
+    def test_estimate_s3_calls(self):
+        assert estimate_s3_calls(100) == 3
+        assert estimate_s3_calls(100, verify=True) == 5
+        assert estimate_s3_calls(100, mode='downup') == 4
+        assert estimate_s3_calls(6000000000) > 700
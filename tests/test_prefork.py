@@ -0,0 +1,52 @@
+import os
+import time
+import signal
+import threading
+from s3_tools.aws_utils import get_aws_session
+from s3_tools.migration.prefork import PreforkPool
+
+
+def wait_files(directory, n, timeout=10):
+    deadline = time.time() + timeout
+    while len(directory.listdir()) < n and time.time() < deadline:
+        time.sleep(0.05)
+    return sorted(f.basename for f in directory.listdir())
+
+
+class TestPreforkPool:
+
+    def test_workers(self, tmpdir):
+        warmed = []
+
+        def work():
+            tmpdir.join(str(os.getpid())).write(str(len(warmed)))
+            time.sleep(60)
+
+        def control():
+            wait_files(tmpdir, 2)
+            os.kill(os.getpid(), signal.SIGTTIN)
+            wait_files(tmpdir, 3)
+            os.kill(os.getpid(), signal.SIGTERM)
+
+        pool = PreforkPool(work, 2, warm_up=lambda: warmed.append(1), poll_sec=0.05)
+        threading.Thread(target=control, daemon=True).start()
+        assert pool.run() == 0
+        assert pool.workers == 3 and not pool.children
+        pids = [f.basename for f in tmpdir.listdir()]
+        assert len(pids) == 3 and str(os.getpid()) not in pids
+        # workers are forked after warm up
+        assert all(f.read() == '1' for f in tmpdir.listdir())
+
+    def test_failing_workers(self, tmpdir):
+        def work():
+            tmpdir.join(str(os.getpid())).write('')
+            raise ValueError('bad config')
+
+        pool = PreforkPool(work, 1, max_failures=3, poll_sec=0.01)
+        assert pool.run() == 1
+        assert len(tmpdir.listdir()) == 3
+
+
+def test_cached_session():
+    assert get_aws_session(region_name='us-east-1') is get_aws_session(region_name='us-east-1')
+    assert get_aws_session(region_name='us-east-1') is not get_aws_session(region_name='us-west-2')
@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+import pytest
+from s3_tools.queues import MAX_RECEIVE_COUNT
+from s3_tools.queues.local import LocalQueueResource, QueueDoesNotExist
+
+
+class FakeSettings(dict):
+
+    def get(self, key, default=None):
+        return super().get(key, default)
+
+
+class TestLocalQueue:
+
+    def make_queue(self, tmpdir):
+        settings = FakeSettings({
+            'sqs.queue_name_pattern': 'q-{}',
+            'sqs.queue_num': 2,
+            'sqs.dead_queue_name': 'dead',
+            'sqs.visibility_timeout': '1800',
+            'sqs.receive_message_wait_time': '0',
+            'sqs.message_retention_period': '1209600',
+            'sqs.max_receive_num': 10
+        })
+        sqs = LocalQueueResource(settings, filename=str(tmpdir.join('queues.db')))
+        sqs.init_queues()
+        return sqs
+
+    def test_send_receive_ack(self, tmpdir):
+        sqs = self.make_queue(tmpdir)
+        sqs.send_message({'n': 0}, number=1)
+        assert sqs.send_message_batch([{'n': i} for i in range(1, 4)], queue_name='q-1') == []
+        messages, queue_url = sqs.receive_message(number=1, max_num=3)
+        assert [json.loads(m['Body'])['n'] for m in messages] == [0, 1, 2]
+        assert queue_url.rsplit('/', 1)[-1] == 'q-1'
+        attrs = sqs.get_queue_attributes('q-1')
+        assert attrs['ApproximateNumberOfMessages'] == '1'
+        assert attrs['ApproximateNumberOfMessagesNotVisible'] == '3'
+        sqs.delete_message(queue_url, messages[0]['ReceiptHandle'])
+        assert sqs.delete_message_batch(queue_url, [m['ReceiptHandle'] for m in messages[1:]]) == []
+        assert sqs.get_queue_depth('q-1') == 1
+        # a reopened file keeps messages
+        sqs = LocalQueueResource(sqs.settings, filename=str(tmpdir.join('queues.db')))
+        messages, _ = sqs.receive_message(queue_name='q-1')
+        assert [json.loads(m['Body'])['n'] for m in messages] == [3]
+        with pytest.raises(QueueDoesNotExist):
+            sqs.send_message({}, queue_name='other')
+
+    def test_visibility_and_dead_letter(self, tmpdir):
+        sqs = self.make_queue(tmpdir)
+        sqs.send_message({'n': 0}, number=2)
+        messages, queue_url = sqs.receive_message(number=2, VisibilityTimeout=0)
+        assert len(messages) == 1
+        # released message is received again with a new receipt handle
+        for i in range(1, MAX_RECEIVE_COUNT):
+            again, _ = sqs.receive_message(number=2)
+            assert again[0]['Attributes']['ApproximateReceiveCount'] == str(i + 1)
+            sqs.change_message_visibility(queue_url, again[0]['ReceiptHandle'], 0)
+        sqs.delete_message(queue_url, messages[0]['ReceiptHandle'])
+        assert sqs.get_queue_depth('q-2') == 1
+        assert sqs.receive_message(number=2) == ([], queue_url)
+        dead, _ = sqs.receive_message(queue_name='dead')
+        assert json.loads(dead[0]['Body']) == {'n': 0}
+
+    def test_long_polling(self, tmpdir):
+        sqs = self.make_queue(tmpdir)
+        start = time.time()
+        assert sqs.receive_message(number=1, WaitTimeSeconds=0.3)[0] == []
+        assert time.time() - start >= 0.3
+
+    def test_loop_closed_releases_batch(self, tmpdir):
+        sqs = self.make_queue(tmpdir)
+        sqs.send_message_batch([{'n': i} for i in range(3)], queue_name='q-1')
+        stopping = threading.Event()
+        received = []
+        for msg, queue_url in sqs.receive_message_loop(number=1, sleep_sec=0, stopping=stopping):
+            received.append(json.loads(msg['Body'])['n'])
+            stopping.set()
+            break
+        # messages of the batch not yielded are visible again
+        assert received == [0]
+        attrs = sqs.get_queue_attributes('q-1')
+        assert (attrs['ApproximateNumberOfMessages'], attrs['ApproximateNumberOfMessagesNotVisible']) == ('2', '1')
+
+    def test_redelivered(self, tmpdir):
+        sqs = self.make_queue(tmpdir)
+        sqs.send_message({'n': 0}, number=1)
+        sqs.send_message({'n': 1}, to_dead=True)
+        messages, queue_url = sqs.receive_message(number=1)
+        assert sqs.is_redelivered(messages[0], queue_url) is False
+        sqs.change_message_visibility(queue_url, messages[0]['ReceiptHandle'], 0)
+        messages, queue_url = sqs.receive_message(number=1)
+        assert sqs.is_redelivered(messages[0], queue_url) is True
+        dead, dead_url = sqs.receive_message(queue_name='dead')
+        assert sqs.is_redelivered(dead[0], dead_url) is True
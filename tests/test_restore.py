@@ -0,0 +1,125 @@
+import time
+from s3_tools.migration import SOURCE_BUCKET_KEY, TARGET_BUCKET_KEY, KEYS_KEY, SOURCE_KEY_KEY, TARGET_KEY_KEY, \
+    ERROR_KEY, ACTION_KEY, ACTION_RESTORE, JOB_KEY, STORAGE_CLASS_KEY
+from s3_tools.migration.restore import RestoreTracker, Restorer, is_restored, restore_tier
+from tests.fakes import ClientError, FakeSqs, FakeS3
+
+
+def make_key(key, storage_class='GLACIER'):
+    return {SOURCE_KEY_KEY: key, TARGET_KEY_KEY: key, STORAGE_CLASS_KEY: storage_class}
+
+
+def test_restore_state():
+    assert is_restored({'StorageClass': 'STANDARD'})
+    assert not is_restored({'StorageClass': 'GLACIER'})
+    assert not is_restored({'StorageClass': 'GLACIER', 'Restore': 'ongoing-request="true"'})
+    assert is_restored({'StorageClass': 'DEEP_ARCHIVE', 'Restore': 'ongoing-request="false", expiry-date="x"'})
+    assert restore_tier('DEEP_ARCHIVE', 'Expedited') == 'Standard'
+    assert restore_tier('GLACIER', 'Expedited') == 'Expedited'
+
+
+class TestRestorer:
+
+    def test_tracker(self, tmpdir):
+        filename = str(tmpdir.join('restore.db'))
+        tracker = RestoreTracker(filename)
+        tracker.add('s', 't', None, [make_key('a'), make_key('b')], 100)
+        # tracked keys keep their schedule
+        tracker.add('s', 't', None, [make_key('a')], 10)
+        tracker.add('s', 't', 'urgent', [make_key('c')], 200)
+        assert len(tracker) == 3
+        assert tracker.due(50) == []
+        rows = tracker.due(150)
+        assert sorted(r[3][SOURCE_KEY_KEY] for r in rows) == ['a', 'b']
+        rescheduled = rows[0][3][SOURCE_KEY_KEY]
+        tracker.reschedule(rows[:1], 300)
+        tracker.remove(rows[1:])
+        tracker.close()
+        # state survives restarts
+        tracker = RestoreTracker(filename)
+        rows = tracker.due(1000)
+        assert [(r[2], r[3][SOURCE_KEY_KEY], r[4]) for r in rows] == [('urgent', 'c', 0), (None, rescheduled, 1)]
+        tracker.close()
+
+    def test_restore_and_send(self, tmpdir):
+        objects = {
+            'a': {'StorageClass': 'GLACIER'},
+            'b': {'StorageClass': 'DEEP_ARCHIVE'},
+            'c': {'StorageClass': 'GLACIER', 'Restore': 'ongoing-request="false"'},
+            'd': {'StorageClass': 'GLACIER', 'Restore': 'ongoing-request="true"'},
+        }
+        message = {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't', ACTION_KEY: ACTION_RESTORE, JOB_KEY: 'urgent',
+                   KEYS_KEY: [make_key('a'), make_key('b', 'DEEP_ARCHIVE'), make_key('c'), make_key('d'),
+                              make_key('e')]}
+        sqs = FakeSqs([message])
+        s3 = FakeS3(objects)
+        tracker = RestoreTracker(str(tmpdir.join('restore.db')))
+        restorer = Restorer(sqs, s3, tracker, 'restore', tier='Expedited', concurrency=2, check_sec=60,
+                            batch_num=2)
+        assert restorer.receive() == 1
+        assert sqs.deleted == ['0']
+        assert sorted(s3.restores) == [('a', 'Expedited'), ('b', 'Standard'), ('c', 'Expedited'),
+                                       ('d', 'Expedited'), ('e', 'Expedited')]
+        # restored copy exists, sent to copy without storage class
+        assert sqs.sent == [('main', {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't', JOB_KEY: 'urgent',
+                                      KEYS_KEY: [{SOURCE_KEY_KEY: 'c', TARGET_KEY_KEY: 'c'}]})]
+        assert [k[SOURCE_KEY_KEY] for k in sqs.dead[0][1][KEYS_KEY]] == ['e']
+        assert sqs.dead[0][1][KEYS_KEY][0][ERROR_KEY] == 'NoSuchKey'
+        assert len(tracker) == 3
+
+        # first check is after restores usually done, GLACIER Expedited but not DEEP_ARCHIVE Standard
+        assert restorer.check() == 0
+        now = time.time()
+        rows = tracker.due(now + 120)
+        assert sorted(r[3][SOURCE_KEY_KEY] for r in rows) == ['a', 'd']
+        tracker.reschedule(tracker.due(now + 86400), now - 1)
+        objects['a']['Restore'] = 'ongoing-request="false"'
+        objects['b']['Restore'] = 'ongoing-request="false"'
+        del objects['d']
+        sqs.sent = []
+        assert restorer.check() == 3
+        assert len(tracker) == 0
+        assert [sorted(k[SOURCE_KEY_KEY] for k in msg[KEYS_KEY]) for _, msg in sqs.sent] == [['a', 'b']]
+        assert [k[SOURCE_KEY_KEY] for k in sqs.dead[1][1][KEYS_KEY]] == ['d']
+        assert restorer.summary == {'requested': 3, 'ready': 3, 'failed': 2, 'checks': 3, 'retries': 0}
+        tracker.close()
+
+    def test_pending_rescheduled(self, tmpdir):
+        objects = {'a': {'StorageClass': 'GLACIER'}}
+        sqs = FakeSqs([])
+        tracker = RestoreTracker(str(tmpdir.join('restore.db')))
+        tracker.add('s', 't', None, [make_key('a')], 0)
+        restorer = Restorer(sqs, FakeS3(objects), tracker, 'restore', check_sec=60)
+        assert restorer.run_once() == 1
+        assert not sqs.sent and not sqs.dead
+        rows = tracker.due(time.time() + 120)
+        assert len(rows) == 1 and rows[0][4] == 1
+        assert restorer.run_once() == 0
+        tracker.close()
+
+    def test_transient_errors_retried(self, tmpdir):
+        objects = {'a': {'StorageClass': 'GLACIER'}, 'b': {'StorageClass': 'GLACIER'}, 'c': {'StorageClass': 'GLACIER'}}
+        message = {SOURCE_BUCKET_KEY: 's', TARGET_BUCKET_KEY: 't', ACTION_KEY: ACTION_RESTORE,
+                   KEYS_KEY: [make_key('a'), make_key('b'), make_key('c')]}
+        sqs = FakeSqs([message])
+        s3 = FakeS3(objects)
+        s3.errors = [ClientError('SlowDown', 503), ClientError('InternalError', 500), ConnectionError('reset')]
+        tracker = RestoreTracker(str(tmpdir.join('restore.db')))
+        restorer = Restorer(sqs, s3, tracker, 'restore', concurrency=1, retry_sec=0)
+        assert restorer.receive() == 1
+        # not dead-lettered, restores requested again when due
+        assert not sqs.dead and len(tracker) == 3
+        assert all('Restore' not in head for head in objects.values())
+        assert restorer.check() == 3
+        assert all(head['Restore'] == 'ongoing-request="true"' for head in objects.values())
+        assert len(s3.restores) == 6 and not sqs.dead
+        assert restorer.summary['retries'] == 3 and restorer.summary['checks'] == 3
+        # permanent errors of the retry are dead-lettered
+        tracker.reschedule(tracker.due(time.time() + 86400), 0)
+        for head in objects.values():
+            del head['Restore']
+        s3.errors = [ClientError('AccessDenied', 403)]
+        assert restorer.check() == 3
+        assert [k[ERROR_KEY] for _, msg in sqs.dead for k in msg[KEYS_KEY]] == ['AccessDenied']
+        assert len(tracker) == 2
+        tracker.close()
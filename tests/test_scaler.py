@@ -0,0 +1,65 @@
+import pytest
+from s3_tools.migration.outcomes import OutcomeWriter
+from s3_tools.migration.scaler import FleetScaler, make_metric_data
+from tests.fakes import FakeSqs
+
+
+class TestFleetScaler:
+
+    def test_needed_executors(self):
+        sqs = FakeSqs(depths={'q1': (900, 50), 'q2': (1000, 50), 'dead': (10, 0)})
+        scaler = FleetScaler(sqs, ['q1', 'q2'], dead_queue_name='dead', target_sec=100, max_receive_num=10)
+        previous = scaler.evaluate(scaler.sample())
+        assert previous['backlog'] == 2000 and previous['executors'] == 10
+        assert previous['needed_executors'] is None and previous['desired_executors'] == 10
+        sqs.depths.update({'q1': (400, 50), 'q2': (500, 50)})
+        sample = scaler.sample()
+        sample['time'] = previous['time'] + 100
+        result = scaler.evaluate(sample, previous=previous)
+        assert result['net_drain_rate'] == 10 and result['eta_sec'] == 100
+        # 10 messages per second by 10 executors, 10 messages per second needed to empty in 100 seconds
+        assert result['needed_executors'] == 10
+        payload = make_metric_data(result)
+        assert {'MetricName': 'DesiredExecutors', 'Value': 10.0, 'Unit': 'Count',
+                'Timestamp': int(result['time'])} in payload['MetricData']
+
+    def test_throttled(self, tmpdir):
+        writer = OutcomeWriter(str(tmpdir))
+        for i in range(100):
+            writer.record('bucket', str(i), 'copied', size=1)
+        for i in range(10):
+            writer.record('bucket', str(i), 'failed', error='SlowDown')
+        writer.close()
+        sqs = FakeSqs(depths={'q1': (10000, 10)})
+        scaler = FleetScaler(sqs, ['q1'], target_sec=10, batch_num=1,
+                             outcome_files=lambda: [str(f) for f in tmpdir.listdir()])
+        result = scaler.evaluate(scaler.sample())
+        assert result['executors'] == 1 and result['executors_source'] == 'outcomes'
+        assert result['needed_executors'] > 1
+        assert result['throttled'] and result['bottleneck'] == 'throttling'
+        assert result['desired_executors'] == 1
+
+    def test_adaptive_batch(self, tmpdir):
+        # a message of 10 keys and two messages of 100 keys
+        writer = OutcomeWriter(str(tmpdir))
+        for i in range(10):
+            writer.record('bucket', str(i), 'copied', size=1, message_keys=10)
+        for i in range(200):
+            writer.record('bucket', str(i), 'copied', size=1, message_keys=100)
+        writer.close()
+        sqs = FakeSqs(depths={'q1': (100, 0)})
+        scaler = FleetScaler(sqs, ['q1'], batch_num=500, outcome_files=lambda: [str(f) for f in tmpdir.listdir()])
+        sample = scaler.sample()
+        outcomes = scaler.outcomes(sample['time'])
+        assert outcomes['keys'] == 210 and outcomes['messages'] == pytest.approx(3)
+        result = scaler.evaluate(sample)
+        assert result['drain_rate'] == pytest.approx(3 / outcomes['seconds'])
+
+    def test_saturated(self):
+        sqs = FakeSqs(depths={'q1': (10000, 0)})
+        scaler = FleetScaler(sqs, ['q1'], target_sec=10)
+        previous = dict(scaler.sample(), executors=10, drain_rate=10.0, backlog=10100)
+        sample = scaler.sample()
+        sample['time'] = previous['time'] + 10
+        result = scaler.evaluate(sample, previous=previous, executors=20)
+        assert result['saturated'] and result['desired_executors'] == 20
@@ -0,0 +1,94 @@
+import pytest
+from s3_tools.migration.scheduler import QueueScheduler, JobScheduler
+from s3_tools.migration.jobs import load_jobs, job_queue_names
+from tests.fakes import FakeSqs
+
+
+class FakeSettings(dict):
+
+    def get(self, key, default=None):
+        return super().get(key, default)
+
+
+class TestQueueScheduler:
+
+    def test_pick_by_depth(self):
+        sqs = FakeSqs(depths={'q1': 0, 'q2': 100, 'dead': 0})
+        scheduler = QueueScheduler(sqs, ['q1', 'q2', 'dead'], dead_queue_name='dead')
+        for _ in range(20):
+            assert scheduler.pick() == 'q2'
+
+    def test_dead_queue_low_priority(self):
+        sqs = FakeSqs(depths={'q1': 0, 'dead': 100})
+        scheduler = QueueScheduler(sqs, ['q1', 'dead'], dead_queue_name='dead', dead_weight=0.1)
+        assert scheduler.weight('dead') == 0
+        scheduler.sample()
+        assert scheduler.weight('dead') == 10
+
+    def test_back_off_empty_queue(self):
+        sqs = FakeSqs(depths={'q1': 0, 'q2': 0})
+        scheduler = QueueScheduler(sqs, ['q1', 'q2'])
+        scheduler.report('q1', 0)
+        scheduler.report('q2', 0)
+        assert scheduler.pick() is None
+        scheduler.report('q2', 10)
+        assert scheduler.pick() == 'q2'
+
+    def test_drain_rates(self):
+        sqs = FakeSqs(depths={'q1': 100})
+        scheduler = QueueScheduler(sqs, ['q1'])
+        scheduler.sample()
+        sqs.depths['q1'] = 50
+        scheduler._sampled_at -= 10
+        scheduler.sample()
+        assert abs(scheduler.drain_rates()['q1'] - 5) < 0.1
+
+
+class TestJobScheduler:
+
+    def make_scheduler(self, sqs, jobs, **kwargs):
+        settings = FakeSettings({'jobs': jobs, 'sqs.queue_name_pattern': 'q-{}', 'sqs.queue_num': 1})
+        jobs = list(load_jobs(settings).values())
+        return JobScheduler(sqs, jobs, dict([(job.name, job_queue_names(job)) for job in jobs]), **kwargs)
+
+    def run(self, scheduler, picks, costs):
+        counts = {}
+        for _ in range(picks):
+            queue_name = scheduler.pick()
+            scheduler.report(queue_name, 1)
+            scheduler.charge(queue_name, costs.get(queue_name, 1))
+            counts[queue_name] = counts.get(queue_name, 0) + 1
+        return counts
+
+    def test_load_jobs(self):
+        settings = FakeSettings({'jobs': {'big': {'queue_num': 3}, 'small': None},
+                                 'sqs.queue_name_pattern': 'q-{}', 'sqs.queue_num': 2})
+        jobs = load_jobs(settings)
+        assert job_queue_names(jobs['big']) == ['big-q-1', 'big-q-2', 'big-q-3']
+        assert jobs['small'].weight == 1 and jobs['small'].queue_num == 2
+        with pytest.raises(ValueError):
+            load_jobs(FakeSettings({'jobs': {'a.b': {}}}))
+
+    def test_weighted_fair(self):
+        sqs = FakeSqs(depths={'big-q-1': 10 ** 9, 'urgent-q-1': 100})
+        scheduler = self.make_scheduler(sqs, {'big': {'weight': 1}, 'urgent': {'weight': 3}})
+        counts = self.run(scheduler, 400, {})
+        assert counts == {'big-q-1': 100, 'urgent-q-1': 300}
+        # service time is charged, slow messages of a job get fewer picks
+        scheduler = self.make_scheduler(sqs, {'big': {}, 'urgent': {}})
+        counts = self.run(scheduler, 300, {'big-q-1': 2})
+        assert counts == {'big-q-1': 100, 'urgent-q-1': 200}
+
+    def test_idle_job_no_credits(self):
+        sqs = FakeSqs(depths={'big-q-1': 10 ** 9, 'urgent-q-1': 0})
+        scheduler = self.make_scheduler(sqs, {'big': {}, 'urgent': {}}, sample_sec=0)
+        assert self.run(scheduler, 100, {}) == {'big-q-1': 100}
+        sqs.depths['urgent-q-1'] = 1000
+        assert self.run(scheduler, 100, {}) == {'big-q-1': 50, 'urgent-q-1': 50}
+
+    def test_max_in_flight(self):
+        sqs = FakeSqs(depths={'big-q-1': (100, 0), 'urgent-q-1': (100, 5), 'dead': 10})
+        scheduler = self.make_scheduler(sqs, {'big': {}, 'urgent': {'max_in_flight': 5}}, dead_queue_name='dead')
+        assert self.run(scheduler, 100, {'dead': 10}) == {'big-q-1': 99, 'dead': 1}
+        scheduler.report('big-q-1', 0)
+        assert scheduler.pick() == 'dead'
@@ -0,0 +1,37 @@
+import pytest
+from datetime import datetime
+from s3_tools.migration.commander import S3ObjectLister
+from s3_tools.migration.sharding import parse_shard, owns_index, list_units, Shard
+from tests.fakes import FakeS3
+
+KEYS = ['root.txt', 'a/1', 'a/2', 'a/x/3', 'b/1', 'b/y/z/2', 'c/1', 'd/1', 'e/1', 'f/1']
+
+
+def make_s3():
+    return FakeS3({k: {'Size': 1, 'LastModified': datetime(2021, 1, 1), 'ETag': '"e"'} for k in KEYS})
+
+
+class TestSharding:
+
+    def test_parse_shard(self):
+        assert parse_shard('2/4') == Shard(2, 4)
+        for value in ['0/4', '5/4', '1', 'a/b']:
+            with pytest.raises(ValueError):
+                parse_shard(value)
+        assert [i for i in range(10) if owns_index(Shard(2, 4), i)] == [1, 5, 9]
+
+    def test_units(self):
+        assert list_units(make_s3(), 'bucket', depth=1) == [
+            'direct:', 'tree:a/', 'tree:b/', 'tree:c/', 'tree:d/', 'tree:e/', 'tree:f/']
+        assert list_units(make_s3(), 'bucket', prefix='a/', depth=2) == ['direct:a/', 'direct:a/x/']
+
+    @pytest.mark.parametrize('depth', [1, 2])
+    def test_object_lister_shards(self, depth):
+        listed = []
+        for i in range(1, 4):
+            lister = S3ObjectLister('source', 'target', shard='{}/3'.format(i))
+            lister._resource = make_s3()
+            keys = [row['Key'] for _, row in lister.list_rows(shard_depth=depth)]
+            assert keys
+            listed.extend(keys)
+        assert sorted(listed) == sorted(KEYS)
@@ -0,0 +1,107 @@
+import os
+from s3_tools.migration import KEYS_KEY, SOURCE_KEY_KEY, ETAG_KEY, CHANGED_KEY, ACTION_KEY, ACTION_RESTORE
+from s3_tools.migration import commander
+from s3_tools.migration.commander import Commander, InventoryLister, IncrementalLister
+from s3_tools.migration.filters import FILTER_STORAGE_CLASS
+from s3_tools.migration.journal import CompletionJournal
+from s3_tools.migration.snapshot import build_snapshot, read_snapshot, diff_snapshots, SnapshotStore
+from tests.fakes import FakeSqs
+
+
+class FakeLister(InventoryLister):
+
+    def __init__(self, rows, **kwargs):
+        super().__init__('source', 'target', **kwargs)
+        self.rows = rows
+
+    def list_source_rows(self, source_index, **kwargs):
+        return iter([dict(row) for row in self.rows])
+
+
+class FakeSettings(dict):
+
+    def get(self, key, default=None):
+        return super().get(key, default)
+
+
+class TestSnapshot:
+
+    def rows(self, items):
+        return [{'Key': k, 'ETag': e, 'LastModifiedDate': '2020-01-01T00:00:00', 'Size': 1} for k, e in items]
+
+    def test_build_snapshot_sorted(self, tmpdir):
+        filename = os.path.join(str(tmpdir), 'snapshot.tsv.gz')
+        count = build_snapshot(self.rows([('c', '1'), ('a', '1'), ('b', '1'), ('a%20b', '1')]), filename, chunk_size=2)
+        assert count == 4
+        assert [row['Key'] for row in read_snapshot(filename)] == ['a', 'a%20b', 'b', 'c']
+        assert os.listdir(str(tmpdir)) == ['snapshot.tsv.gz']
+
+    def test_diff_snapshots(self, tmpdir):
+        old_file = os.path.join(str(tmpdir), 'old.tsv.gz')
+        new_file = os.path.join(str(tmpdir), 'new.tsv.gz')
+        build_snapshot(self.rows([('a', '1'), ('b', '1'), ('c', '1')]), old_file)
+        build_snapshot(self.rows([('b', '2'), ('c', '1'), ('d', '1')]), new_file)
+        changes = [(change, row['Key']) for change, row in diff_snapshots(old_file, new_file)]
+        assert changes == [('deleted', 'a'), ('changed', 'b'), ('added', 'd')]
+        changes = [(change, row['Key']) for change, row in diff_snapshots(None, new_file)]
+        assert changes == [('added', 'b'), ('added', 'c'), ('added', 'd')]
+
+    def test_snapshot_store(self, tmpdir):
+        store = SnapshotStore(str(tmpdir))
+        assert store.latest() is None
+        filename = store.new_snapshot()
+        build_snapshot(self.rows([('a', '1')]), filename)
+        store.commit(filename)
+        assert store.latest() == filename
+
+    def test_changed_keys_without_etag(self, tmpdir):
+        # snapshot of last run and inventory without ETag column
+        store = SnapshotStore(str(tmpdir.join('snapshots')))
+        old_file = str(tmpdir.join('snapshots', 'snapshot-old.tsv.gz'))
+        build_snapshot([{'Key': 'a', 'LastModifiedDate': '2020-01-01T00:00:00', 'Size': 1},
+                        {'Key': 'b', 'LastModifiedDate': '2020-01-01T00:00:00', 'Size': 1}], old_file)
+        store.commit(old_file)
+        lister = FakeLister([{'Key': 'a', 'LastModifiedDate': '2020-01-02T00:00:00', 'Size': '1'},
+                             {'Key': 'b', 'LastModifiedDate': '2020-01-01T00:00:00', 'Size': '1'},
+                             {'Key': 'c', 'LastModifiedDate': '2020-01-01T00:00:00', 'Size': '1'}])
+        incremental = IncrementalLister(lister, str(tmpdir.join('snapshots')))
+        keys = [k for _, msg in incremental.list_batches() for k in msg[KEYS_KEY]]
+        assert [(k[SOURCE_KEY_KEY], k.get(CHANGED_KEY)) for k in keys] == [('a', True), ('c', None)]
+        assert all(ETAG_KEY not in k for k in keys)
+        # executor journal recorded the old version of a, changed key is not skipped
+        journal = CompletionJournal(str(tmpdir.join('journal.db')))
+        param = dict(source_bucket='source', source_key='a', target_bucket='target', target_key='a')
+        journal.record(etag='old', size=1, **param)
+        assert journal.contains(size=keys[0].get('size'), any_version=not keys[0].get(CHANGED_KEY), **param) is False
+        assert journal.contains(size=1, any_version=True, **param) is True
+        journal.close()
+
+    def test_changed_keys_filtered_by_storage_class(self, tmpdir):
+        store = SnapshotStore(str(tmpdir.join('snapshots')))
+        old_file = str(tmpdir.join('snapshots', 'snapshot-old.tsv.gz'))
+        build_snapshot(self.rows([('a', '1'), ('b', '1')]), old_file)
+        store.commit(old_file)
+        lister = FakeLister([dict(row, StorageClass=c) for row, c in
+                             zip(self.rows([('a', '2'), ('b', '2'), ('c', '1')]), ['GLACIER', 'STANDARD', 'GLACIER'])],
+                            storage_class=['STANDARD'])
+        incremental = IncrementalLister(lister, str(tmpdir.join('snapshots')))
+        keys = [k[SOURCE_KEY_KEY] for _, msg in incremental.list_batches() for k in msg[KEYS_KEY]]
+        assert keys == ['b']
+        assert lister.row_filter.rejected == {FILTER_STORAGE_CLASS: 2}
+
+    def test_archived_changed_keys_restored(self, tmpdir, monkeypatch):
+        sqs = FakeSqs()
+        monkeypatch.setattr(commander, 'settings', FakeSettings({'migration.restore_archived': True,
+                                                                 'sqs.restore_queue_name': 'restore'}))
+        monkeypatch.setattr(commander, 'get_queue_backend', lambda settings: sqs)
+        store = SnapshotStore(str(tmpdir.join('snapshots')))
+        old_file = str(tmpdir.join('snapshots', 'snapshot-old.tsv.gz'))
+        build_snapshot(self.rows([('a', '1'), ('b', '1')]), old_file)
+        store.commit(old_file)
+        lister = FakeLister([dict(row, StorageClass=c) for row, c in
+                             zip(self.rows([('a', '2'), ('b', '2')]), ['DEEP_ARCHIVE', 'STANDARD'])])
+        Commander(IncrementalLister(lister, str(tmpdir.join('snapshots')))).run()
+        sent = sorted(([k[SOURCE_KEY_KEY] for k in msg[KEYS_KEY]], queue_name, msg.get(ACTION_KEY))
+                      for queue_name, msg in sqs.sent)
+        # archived object is restored before copy, it is not sent to copy queues to fail
+        assert sent == [(['a'], 'restore', ACTION_RESTORE), (['b'], None, None)]
@@ -0,0 +1,32 @@
+import os
+import pytest
+from s3_tools.migration.staging import StagingManager
+
+
+class TestStagingManager:
+
+    def test_stage_unique_preallocated(self, tmpdir):
+        staging = StagingManager(str(tmpdir), quota=100)
+        with staging.stage(10) as path1, staging.stage(20) as path2:
+            assert path1 != path2
+            assert os.path.getsize(path1) == 10
+            assert os.path.getsize(path2) == 20
+            assert staging.used == 30
+        assert staging.used == 0
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_cleanup_on_failure(self, tmpdir):
+        staging = StagingManager(str(tmpdir))
+        with pytest.raises(RuntimeError):
+            with staging.stage(10):
+                raise RuntimeError()
+        assert staging.used == 0
+        assert os.listdir(str(tmpdir)) == []
+
+    def test_quota(self, tmpdir):
+        staging = StagingManager(str(tmpdir), quota=100, timeout=0)
+        with pytest.raises(ValueError):
+            staging.acquire(101)
+        with staging.stage(60):
+            with pytest.raises(IOError):
+                staging.acquire(60)
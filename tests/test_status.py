@@ -0,0 +1,78 @@
+import json
+from s3_tools.migration import scaler
+from s3_tools.migration.outcomes import OutcomeWriter
+from s3_tools.migration.status import MigrationStatus, format_status, format_duration
+from tests.fakes import FakeSqs
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        return self.now
+
+
+class TestMigrationStatus:
+
+    def test_progress(self, tmpdir, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(scaler, 'time', clock)
+        checkpoint = tmpdir.join('checkpoint.json')
+        checkpoint.write(json.dumps({'messages': 20, 'keys': 2001, 'bytes': 2000000, 'finished': True}))
+        outcome_dir = tmpdir.mkdir('outcomes')
+        writer = OutcomeWriter(str(outcome_dir))
+        for i in range(500):
+            writer.record('bucket', str(i), 'copied', size=1000)
+        writer.record('bucket', 'x', 'failed', error='SlowDown')
+        writer.record('bucket', 'y', 'journaled', size=1000)
+        writer.flush()
+        sqs = FakeSqs(depths={'q1': (10, 5), 'dead': (1, 0)})
+        status = MigrationStatus(sqs, ['q1'], dead_queue_name='dead', batch_num=100,
+                                 checkpoint_file=str(checkpoint),
+                                 outcome_files=lambda: [str(f) for f in outcome_dir.listdir()])
+        first = status.refresh()
+        assert (first['queued'], first['in_flight'], first['dead']) == (10, 5, 1)
+        assert first['enqueued']['keys'] == 2001 and first['commander_finished']
+        # journaled key is done but not transferred
+        assert first['done'] == {'keys': 501, 'bytes': 500000}
+        assert first['failed']['errors'] == {'SlowDown': 1}
+        assert first['remaining_keys'] == 1500
+        for i in range(1000):
+            writer.record('bucket', str(i), 'copied', size=1000)
+        writer.close()
+        clock.now += 100
+        sqs.depths['q1'] = (0, 5)
+        second = status.refresh()
+        assert second['key_rate'] == 10 and second['byte_rate'] == 10000 and second['message_rate'] == 0.1
+        assert second['remaining_keys'] == 500 and second['eta_sec'] == 50
+        text = format_status(second)
+        assert '1,501 keys' in text and '75.0%' in text and '00:00:50' in text
+
+    def test_queues_only(self, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(scaler, 'time', clock)
+        sqs = FakeSqs(depths={'q1': (100, 0)})
+        status = MigrationStatus(sqs, ['q1'], batch_num=10)
+        assert status.refresh()['eta_sec'] is None
+        clock.now += 10
+        sqs.depths['q1'] = (90, 0)
+        result = status.refresh()
+        assert result['done'] is None and result['remaining_keys'] == 900
+        assert result['eta_sec'] == 90
+        assert format_duration(90061) == '1d 01:01:01'
+
+    def test_keys_per_message(self, tmpdir, monkeypatch):
+        clock = FakeClock()
+        monkeypatch.setattr(scaler, 'time', clock)
+        writer = OutcomeWriter(str(tmpdir))
+        for i in range(10):
+            writer.record('bucket', str(i), 'copied', size=1, message_keys=10)
+        for i in range(200):
+            writer.record('bucket', str(i), 'copied', size=1, message_keys=100)
+        writer.close()
+        sqs = FakeSqs(depths={'q1': (100, 0)})
+        status = MigrationStatus(sqs, ['q1'], batch_num=500, outcome_files=lambda: [str(f) for f in tmpdir.listdir()])
+        # 210 keys in 3 messages processed, keys per message vary with adaptive batch
+        assert status.refresh()['remaining_keys'] == 7000